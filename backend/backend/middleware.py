@@ -3,9 +3,13 @@
 用于增强应用的安全性
 """
 
+from collections import Counter
+from contextlib import ExitStack, contextmanager
 from django.http import HttpResponseForbidden
 from django.conf import settings
+from django.db import connections
 import re
+import time
 import structlog
 
 logger = structlog.get_logger(__name__)
@@ -92,4 +96,103 @@ class SecurityMiddleware:
         if request.is_secure():
             response['Strict-Transport-Security'] = 'max-age=31536000; includeSubDomains'
         
-        return response 
\ No newline at end of file
+        return response
+
+
+DEFAULT_QUERY_BUDGET = {
+    'ENABLED': False,
+    'RAISE': False,
+    'BUDGETS': {},
+}
+
+
+class QueryBudgetExceeded(Exception):
+    """请求的SQL查询次数超过声明的预算"""
+
+
+class QueryRecorder:
+    """
+    SQL查询记录器
+    通过 execute_wrapper 记录每条语句及耗时，不依赖 DEBUG
+    """
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - started))
+
+    @contextmanager
+    def record(self):
+        """在代码块内记录所有数据库连接上的查询"""
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self))
+            yield self
+
+    def summary(self):
+        """查询次数、总耗时，以及重复执行的语句（参数不同的同一语句通常意味着N+1）"""
+        counts = Counter(sql for sql, _ in self.queries)
+        return {
+            'count': len(self.queries),
+            'time_ms': round(sum(duration for _, duration in self.queries) * 1000, 3),
+            'duplicates': {sql: count for sql, count in counts.most_common() if count > 1},
+        }
+
+
+class QueryBudgetMiddleware:
+    """
+    每请求SQL查询预算中间件
+    视图集用 query_budgets = {'list': 3} 声明各动作的查询上限，
+    QUERY_BUDGET['BUDGETS'] 可按 '类名.动作' 覆盖；超出时记录日志，RAISE为True时抛出异常
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def options(self):
+        return {**DEFAULT_QUERY_BUDGET, **getattr(settings, 'QUERY_BUDGET', {})}
+
+    def __call__(self, request):
+        options = self.options()
+        if not options['ENABLED']:
+            return self.get_response(request)
+        recorder = QueryRecorder()
+        with recorder.record():
+            response = self.get_response(request)
+        summary = recorder.summary()
+        if settings.DEBUG:
+            response['X-Query-Count'] = str(summary['count'])
+            response['X-Query-Time-Ms'] = str(summary['time_ms'])
+
+        label, budget = getattr(request, '_query_budget', (None, None))
+        budget = options['BUDGETS'].get(label, budget)
+        if budget is not None and summary['count'] > budget:
+            logger.warning(
+                "query_budget_exceeded",
+                view=label,
+                path=request.path,
+                budget=budget,
+                count=summary['count'],
+                time_ms=summary['time_ms'],
+                duplicates=list(summary['duplicates'].items())[:5],
+            )
+            if options['RAISE']:
+                raise QueryBudgetExceeded(
+                    f"{label} 执行了 {summary['count']} 条查询，超出预算 {budget}；重复语句：{summary['duplicates']}")
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        cls = getattr(view_func, 'cls', None)
+        if cls is None:
+            return None
+        # 视图集的 actions 把HTTP方法映射到动作名，普通APIView按方法名
+        method = request.method.lower()
+        action = (getattr(view_func, 'actions', None) or {}).get(method, method)
+        budget = getattr(cls, 'query_budgets', {}).get(action)
+        request._query_budget = (f'{cls.__name__}.{action}', budget)
+        return None
@@ -34,6 +34,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'backend.middleware.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -56,10 +57,79 @@ if DEBUG:
     SECURE_HSTS_SECONDS = 0
 
 # 缓存配置
+# 同一主机上的所有工作进程共享一份缓存（内存映射文件），代数计数器与失效在进程间立即可见
+# LOCATION 为运行用户独占的目录（0700），不存在时自动创建；默认位于内存文件系统并带上用户ID
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+# 进程间共享的缓存（响应缓存、数据密钥擦除代数使用）：设置 SHARED_CACHE_DIR（当前用户独占的目录，
+# 如 /dev/shm/homehealth-cache）后使用内存映射文件；未设置时为进程内缓存，只适合单进程运行。
+# 同一目录的所有进程须使用相同的 SHARED_CACHE_SIZE
+SHARED_CACHE_DIR = os.getenv('SHARED_CACHE_DIR')
+if SHARED_CACHE_DIR:
+    CACHES['shared'] = {
+        'BACKEND': 'backend.sharedcache.SharedMemoryCache',
+        'LOCATION': SHARED_CACHE_DIR,
+        'OPTIONS': {
+            'SIZE': int(os.getenv('SHARED_CACHE_SIZE', 64 * 1024 * 1024)),
+            'SLOT_SIZE': 16384,
+            'WAYS': 8,
+        },
+    }
+else:
+    CACHES['shared'] = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'shared',
     }
+
+# 重量级只读接口的响应缓存：按用户代数失效，多进程部署时 ALIAS 须为共享缓存
+RESPONSE_CACHE = {
+    'ALIAS': 'shared',
+    'TIMEOUT': 300,
+    'LOCK_TIMEOUT': 10,
+}
+
+# 解密内容缓存配置（EncryptedFileStorage，进程内LRU）
+DECRYPTED_CONTENT_CACHE = {
+    'MAX_BYTES': 64 * 1024 * 1024,
+    'MAX_ENTRY_BYTES': 16 * 1024 * 1024,
+    'ZERO_ON_EVICT': True,
+}
+
+# 加密文件存储后端：本地文件系统或S3兼容对象存储（records.storage.EncryptedS3Storage）
+ENCRYPTED_FILE_STORAGE = os.getenv('ENCRYPTED_FILE_STORAGE', 'records.storage.EncryptedFileStorage')
+
+# S3兼容对象存储配置，对象键为 LOCATION 加原有的 upload_to 路径
+S3_STORAGE = {
+    'BUCKET': os.getenv('S3_BUCKET', ''),
+    'LOCATION': os.getenv('S3_LOCATION', 'media'),
+    'ENDPOINT_URL': os.getenv('S3_ENDPOINT_URL'),
+    'REGION_NAME': os.getenv('S3_REGION_NAME'),
+    'ACCESS_KEY_ID': os.getenv('S3_ACCESS_KEY_ID'),
+    'SECRET_ACCESS_KEY': os.getenv('S3_SECRET_ACCESS_KEY'),
+    'MAX_POOL_CONNECTIONS': 32,
+    'MULTIPART_THRESHOLD': 8 * 1024 * 1024,
+    'PART_SIZE': 8 * 1024 * 1024,
+    'MAX_CONCURRENCY': 4,
+    'URL_EXPIRES': 300,
+}
+
+# 用户数据密钥缓存：解包后的数据密钥在进程内最多保留TTL秒
+DATA_KEY_CACHE = {
+    'MAX_ENTRIES': 1024,
+    'TTL': 300,
+    # 擦除代数所在的缓存，须在进程间共享
+    'SHRED_ALIAS': 'shared',
+}
+
+# 加密存储压缩配置：首块压缩收益低于MIN_GAIN时整个文件不压缩
+ENCRYPTED_STORAGE_COMPRESSION = {
+    'ENABLED': True,
+    'LEVEL': 6,
+    'MIN_GAIN': 0.1,
 }
 
 # 邮件配置
@@ -140,6 +210,39 @@ REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 }
 
+# 每请求SQL查询预算：超出视图 query_budgets 声明时记录日志，默认只在 DEBUG 下启用
+# 运行测试时由 TEST_RUNNER 开启并在超出时抛出异常
+# BUDGETS 按 '类名.动作' 覆盖视图声明，例如 {'MedicalRecordViewSet.list': 3}
+QUERY_BUDGET = {
+    'ENABLED': DEBUG,
+    'RAISE': False,
+    'BUDGETS': {},
+}
+TEST_RUNNER = 'backend.testrunner.BudgetEnforcingTestRunner'
+
+# 医院、医生、药品名称联想：全站结果只包含至少 GLOBAL_MIN_USERS 个用户用过的名称
+NAME_SUGGESTIONS = {
+    'LIMIT': 10,
+    'MAX_LIMIT': 50,
+    'GLOBAL_MIN_USERS': 2,
+    'SHORT_PREFIX_LENGTH': 2,
+    'GLOBAL_CACHE_TIMEOUT': 60,
+}
+
+# 药品名称补全：每个工作进程在内存中保存前缀索引，REFRESH_INTERVAL 秒后重建以纳入其他进程的写入
+DRUG_AUTOCOMPLETE = {
+    'TOP_K': 10,
+    'SCAN_LIMIT': 64,
+    'REFRESH_INTERVAL': 300,
+    'DICTIONARY': os.getenv('DRUG_DICTIONARY') or None,
+}
+
+# 记录列表键集分页：每页默认条数与 page_size 参数上限
+RECORD_PAGINATION = {
+    'PAGE_SIZE': 20,
+    'MAX_PAGE_SIZE': 100,
+}
+
 # JWT设置
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=1),
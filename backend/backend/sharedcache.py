@@ -0,0 +1,357 @@
+"""
+进程间共享的缓存后端
+同一主机上的所有工作进程映射同一个文件，条目只存一份，
+任一进程的写入和失效对其他进程立即可见；通过单独的缓存别名启用（见 settings 中的 CACHES['shared']）
+值以 pickle 保存，能写入映射文件的用户即可在读取进程中执行任意代码，
+因此 LOCATION 必须是当前用户独占的目录（权限 0700），映射文件不跟随符号链接，
+属主或权限不符时拒绝使用
+
+文件是组相联的哈希表：键哈希决定所在的组，每组有固定数量的定长槽位，
+组满时淘汰组内最久未访问的条目（近似LRU）。每组使用独立的文件区间锁，
+不同组的读写互不阻塞；incr/add 在组锁内完成读改写，跨进程原子
+较大的值压缩后存放；压缩后仍超过槽位大小的值不缓存（与 Memcached 的条目大小上限相同），
+这类写入计入 oversize 统计并记录警告，便于据此调整 SLOT_SIZE
+"""
+
+import fcntl
+import mmap
+import os
+import pickle
+import stat
+import struct
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from hashlib import blake2b
+
+import structlog
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.exceptions import ImproperlyConfigured
+
+logger = structlog.get_logger(__name__)
+
+MAGIC = b'HHSC'
+VERSION = 2
+FILE_NAME = 'cache.bin'
+
+DEFAULT_OPTIONS = {
+    'SIZE': 64 * 1024 * 1024,
+    # 报告、趋势等接口的响应序列化后在数KB到十余KB之间
+    'SLOT_SIZE': 16384,
+    'WAYS': 8,
+    # 序列化后超过该字节数的值先压缩再存放
+    'COMPRESS_THRESHOLD': 1024,
+}
+
+# 文件头：魔数、版本、槽位大小、每组槽位数、组数
+_HEADER = struct.Struct('<4sHIII')
+HEADER_SIZE = 64
+# 槽位头：键哈希（0表示空槽）、过期时间（0表示不过期）、最近访问时间、键长度、值长度、标志
+_SLOT = struct.Struct('<QdQHIB')
+SLOT_HEADER_SIZE = 32
+# 标志位：值经过 zlib 压缩
+FLAG_COMPRESSED = 1
+# 进程内线程锁的分条数
+THREAD_LOCK_STRIPES = 64
+
+
+def _private_directory(location):
+    """
+    确认缓存目录为当前用户独占：不存在时以 0700 创建；
+    已存在时不能是符号链接，属主须为当前用户，组和其他用户不能有任何权限
+    """
+    if not location:
+        raise ImproperlyConfigured('SharedMemoryCache 需要在 LOCATION 中指定当前用户独占的目录')
+    try:
+        os.mkdir(location, 0o700)
+    except FileExistsError:
+        pass
+    info = os.lstat(location)
+    if not stat.S_ISDIR(info.st_mode):
+        raise ImproperlyConfigured(f'共享缓存目录 {location} 不是目录')
+    if info.st_uid != os.getuid() or stat.S_IMODE(info.st_mode) & 0o077:
+        raise ImproperlyConfigured(f'共享缓存目录 {location} 须属于当前用户且权限为 0700')
+    return location
+
+
+def _open_private_file(directory):
+    """打开（必要时创建）映射文件，不跟随符号链接，并确认属主与权限"""
+    dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW)
+    try:
+        fd = os.open(FILE_NAME, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600, dir_fd=dir_fd)
+    finally:
+        os.close(dir_fd)
+    info = os.fstat(fd)
+    if not stat.S_ISREG(info.st_mode) or info.st_uid != os.getuid() or stat.S_IMODE(info.st_mode) != 0o600:
+        os.close(fd)
+        raise ImproperlyConfigured(f'共享缓存文件 {os.path.join(directory, FILE_NAME)} 须为当前用户所有且权限为 0600')
+    return fd
+
+
+class _Table:
+    """
+    一个进程内对映射文件的唯一句柄
+    文件区间锁属于进程，关闭同一文件的任意描述符都会释放本进程的全部锁，
+    因此每个文件在进程内只打开一次，各线程的缓存实例共用
+    """
+
+    def __init__(self, directory, header, size):
+        fd = _open_private_file(_private_directory(directory))
+        fcntl.lockf(fd, fcntl.LOCK_EX)
+        try:
+            existing = os.fstat(fd).st_size
+            if existing == 0:
+                os.ftruncate(fd, size)
+                os.pwrite(fd, header, 0)
+            matches = existing in (0, size) and os.pread(fd, _HEADER.size, 0) == header
+        finally:
+            fcntl.lockf(fd, fcntl.LOCK_UN)
+        if not matches:
+            # 其他进程可能仍映射着该文件，截断会使其访问映射时收到 SIGBUS
+            os.close(fd)
+            raise ImproperlyConfigured(
+                f'共享缓存文件 {os.path.join(directory, FILE_NAME)} 的布局与当前配置不一致，'
+                '所有进程须使用相同的 SIZE、SLOT_SIZE 与 WAYS；确认没有进程使用后删除该文件')
+        self.fd = fd
+        self.map = mmap.mmap(fd, size)
+        self.size = size
+        self.pid = os.getpid()
+        # 同一进程内的线程不受文件锁互斥，按组分条加线程锁
+        self.thread_locks = [threading.Lock() for _ in range(THREAD_LOCK_STRIPES)]
+
+
+# 缓存目录 -> 本进程的句柄
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+class SharedMemoryCache(BaseCache):
+    """
+    基于内存映射文件的共享缓存
+    LOCATION 为当前用户独占的目录，映射文件位于其中；OPTIONS 中 SIZE 为总大小，
+    SLOT_SIZE 为单个条目（含键，压缩后）的上限，WAYS 为每组槽位数。
+    所有进程须使用相同的配置；已有文件的布局与配置不一致时拒绝使用，不会截断其他进程正在映射的文件
+    """
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = {**DEFAULT_OPTIONS, **params.get('OPTIONS', {})}
+        if not location:
+            raise ImproperlyConfigured('SharedMemoryCache 需要在 LOCATION 中指定当前用户独占的目录')
+        self._path = location
+        self._slot_size = options['SLOT_SIZE']
+        self._ways = options['WAYS']
+        self._compress_threshold = options['COMPRESS_THRESHOLD']
+        # 本进程内因超过槽位大小而未缓存的写入次数
+        self.oversize = 0
+        self._buckets = max(options['SIZE'] // (self._slot_size * self._ways), 1)
+        self._size = HEADER_SIZE + self._buckets * self._ways * self._slot_size
+        self._table = None
+
+    @property
+    def _map(self):
+        return self._table.map
+
+    def _open(self):
+        """首次使用时映射文件；文件不存在或布局不一致时在文件锁内初始化"""
+        header = _HEADER.pack(MAGIC, VERSION, self._slot_size, self._ways, self._buckets)
+        with _tables_lock:
+            table = _tables.get(self._path)
+            # fork 出的子进程不沿用父进程的句柄，线程锁可能在 fork 时处于持有状态
+            if table is None or table.size != self._size or table.pid != os.getpid():
+                table = _tables[self._path] = _Table(self._path, header, self._size)
+        self._table = table
+
+    def _locate(self, key):
+        key_bytes = key.encode()
+        key_hash = int.from_bytes(blake2b(key_bytes, digest_size=8).digest(), 'little') or 1
+        return key_bytes, key_hash, key_hash % self._buckets
+
+    @contextmanager
+    def _locked(self, bucket):
+        """锁定一个组：线程锁排除本进程的其他线程，文件区间锁排除其他进程"""
+        if self._table is None or self._table.pid != os.getpid():
+            self._open()
+        table = self._table
+        with table.thread_locks[bucket % THREAD_LOCK_STRIPES]:
+            # 区间锁只用于互斥，偏移量不需要对应实际数据
+            fcntl.lockf(table.fd, fcntl.LOCK_EX, 1, bucket + 1)
+            try:
+                yield HEADER_SIZE + bucket * self._ways * self._slot_size
+            finally:
+                fcntl.lockf(table.fd, fcntl.LOCK_UN, 1, bucket + 1)
+
+    def _find(self, start, key_bytes, key_hash):
+        """在组内查找键，返回(槽位偏移, 过期时间, 值长度)"""
+        for way in range(self._ways):
+            offset = start + way * self._slot_size
+            slot_hash, expires, _, key_length, value_length, _ = _SLOT.unpack_from(self._map, offset)
+            if slot_hash != key_hash or key_length != len(key_bytes):
+                continue
+            key_start = offset + SLOT_HEADER_SIZE
+            if self._map[key_start:key_start + key_length] == key_bytes:
+                return offset, expires, value_length
+        return None, 0, 0
+
+    def _find_live(self, start, key_bytes, key_hash, now):
+        """查找未过期的条目，过期条目顺便清除"""
+        offset, expires, value_length = self._find(start, key_bytes, key_hash)
+        if offset is not None and expires and expires <= now:
+            self._clear_slot(offset)
+            return None, 0
+        return offset, value_length
+
+    def _victim(self, start, now):
+        """选择写入位置：空槽、过期条目，否则为最久未访问的条目"""
+        oldest, oldest_access = None, None
+        for way in range(self._ways):
+            offset = start + way * self._slot_size
+            slot_hash, expires, accessed, _, _, _ = _SLOT.unpack_from(self._map, offset)
+            if slot_hash == 0 or (expires and expires <= now):
+                return offset
+            if oldest is None or accessed < oldest_access:
+                oldest, oldest_access = offset, accessed
+        return oldest
+
+    def _encode(self, value):
+        """返回(存放的字节, 标志)"""
+        pickled = pickle.dumps(value, self.pickle_protocol)
+        if len(pickled) > self._compress_threshold:
+            compressed = zlib.compress(pickled, 1)
+            if len(compressed) < len(pickled):
+                return compressed, FLAG_COMPRESSED
+        return pickled, 0
+
+    def _write(self, offset, key_bytes, key_hash, encoded, expires):
+        data, flags = encoded
+        key_start = offset + SLOT_HEADER_SIZE
+        value_start = key_start + len(key_bytes)
+        self._map[key_start:value_start] = key_bytes
+        self._map[value_start:value_start + len(data)] = data
+        # 槽位头最后写入，读取方在同一把锁下不会看到写了一半的条目
+        _SLOT.pack_into(self._map, offset, key_hash, expires, time.time_ns(), len(key_bytes), len(data), flags)
+
+    def _read(self, offset, key_length, value_length):
+        """返回(存放的字节, 标志)"""
+        value_start = offset + SLOT_HEADER_SIZE + key_length
+        flags = _SLOT.unpack_from(self._map, offset)[5]
+        return self._map[value_start:value_start + value_length], flags
+
+    @staticmethod
+    def _decode(stored):
+        data, flags = stored
+        return pickle.loads(zlib.decompress(data) if flags & FLAG_COMPRESSED else data)
+
+    def _touch_access(self, offset):
+        # 槽位头中最近访问时间位于第16字节
+        struct.pack_into('<Q', self._map, offset + 16, time.time_ns())
+
+    def _clear_slot(self, offset):
+        struct.pack_into('<Q', self._map, offset, 0)
+
+    def _fits(self, key, key_bytes, encoded):
+        if SLOT_HEADER_SIZE + len(key_bytes) + len(encoded[0]) <= self._slot_size:
+            return True
+        self.oversize += 1
+        logger.warning("shared_cache_value_too_large", key=key, size=len(encoded[0]), slot_size=self._slot_size)
+        return False
+
+    def stats(self):
+        return {'oversize': self.oversize, 'slot_size': self._slot_size}
+
+    def _expiry(self, timeout):
+        expires = self.get_backend_timeout(timeout)
+        return 0.0 if expires is None else expires
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        key_bytes, key_hash, bucket = self._locate(key)
+        encoded = self._encode(value)
+        if not self._fits(key, key_bytes, encoded):
+            return False
+        with self._locked(bucket) as start:
+            now = time.time()
+            if self._find_live(start, key_bytes, key_hash, now)[0] is not None:
+                return False
+            self._write(self._victim(start, now), key_bytes, key_hash, encoded, self._expiry(timeout))
+            return True
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        key_bytes, key_hash, bucket = self._locate(key)
+        with self._locked(bucket) as start:
+            offset, value_length = self._find_live(start, key_bytes, key_hash, time.time())
+            if offset is None:
+                return default
+            self._touch_access(offset)
+            stored = self._read(offset, len(key_bytes), value_length)
+        return self._decode(stored)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        key_bytes, key_hash, bucket = self._locate(key)
+        encoded = self._encode(value)
+        fits = self._fits(key, key_bytes, encoded)
+        with self._locked(bucket) as start:
+            offset = self._find(start, key_bytes, key_hash)[0]
+            if not fits:
+                # 新值无法缓存时丢弃旧值，避免读到过时数据
+                if offset is not None:
+                    self._clear_slot(offset)
+                return
+            if offset is None:
+                offset = self._victim(start, time.time())
+            self._write(offset, key_bytes, key_hash, encoded, self._expiry(timeout))
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        key_bytes, key_hash, bucket = self._locate(key)
+        with self._locked(bucket) as start:
+            offset = self._find_live(start, key_bytes, key_hash, time.time())[0]
+            if offset is None:
+                return False
+            struct.pack_into('<d', self._map, offset + 8, self._expiry(timeout))
+            return True
+
+    def incr(self, key, delta=1, version=None):
+        """在组锁内读改写，多个进程并发递增不会丢失更新"""
+        key = self.make_and_validate_key(key, version=version)
+        key_bytes, key_hash, bucket = self._locate(key)
+        with self._locked(bucket) as start:
+            offset, value_length = self._find_live(start, key_bytes, key_hash, time.time())
+            if offset is None:
+                raise ValueError("Key '%s' not found" % key)
+            expires = _SLOT.unpack_from(self._map, offset)[1]
+            new_value = self._decode(self._read(offset, len(key_bytes), value_length)) + delta
+            self._write(offset, key_bytes, key_hash, self._encode(new_value), expires)
+        return new_value
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        key_bytes, key_hash, bucket = self._locate(key)
+        with self._locked(bucket) as start:
+            offset = self._find_live(start, key_bytes, key_hash, time.time())[0]
+            if offset is None:
+                return False
+            self._clear_slot(offset)
+            return True
+
+    def clear(self):
+        """锁定整个文件后清空所有槽位"""
+        if self._table is None or self._table.pid != os.getpid():
+            self._open()
+        table = self._table
+        for lock in table.thread_locks:
+            lock.acquire()
+        try:
+            fcntl.lockf(table.fd, fcntl.LOCK_EX)
+            try:
+                for offset in range(HEADER_SIZE, self._size, self._slot_size):
+                    self._clear_slot(offset)
+            finally:
+                fcntl.lockf(table.fd, fcntl.LOCK_UN)
+        finally:
+            for lock in table.thread_locks:
+                lock.release()
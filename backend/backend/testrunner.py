@@ -0,0 +1,22 @@
+"""
+测试运行器
+测试期间开启SQL查询预算并在超出时抛出异常，使查询次数回退直接表现为测试失败；
+生产配置中预算默认只在 DEBUG 下启用，且只记录日志
+"""
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class BudgetEnforcingTestRunner(DiscoverRunner):
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        budgets = {**getattr(settings, 'QUERY_BUDGET', {}), 'ENABLED': True, 'RAISE': True}
+        self._query_budget = override_settings(QUERY_BUDGET=budgets)
+        self._query_budget.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._query_budget.disable()
+        super().teardown_test_environment(**kwargs)
@@ -8,7 +8,7 @@ from drf_spectacular.views import (
     SpectacularSwaggerView,
     SpectacularRedocView
 )
-from .views import HealthCheckView, health_check
+from .views import HealthCheckView, health_check, metrics
 from records.views import HealthOverviewAPI
 
 # 初始化DRF默认路由器（自动生成API根视图）
@@ -36,6 +36,8 @@ urlpatterns = [
     # 健康检查端点
     path('api/health/', health_check, name='health-check'),
     path('api/health-class/', HealthCheckView.as_view(), name='health-class'),
+    # 运行指标端点（仅管理员）
+    path('api/metrics/', metrics, name='metrics'),
 ]
 
 # ------------------------- 开发环境扩展配置 -------------------------
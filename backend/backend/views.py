@@ -1,7 +1,8 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAdminUser
 from rest_framework.decorators import api_view, permission_classes
+from django.core.cache import caches
 
 class HealthCheckView(APIView):
     """健康检查API视图"""
@@ -21,4 +22,20 @@ def health_check(request):
     return Response({
         "status": "healthy", 
         "message": "小树家健康管理系统API正常运行"
-    }) 
\ No newline at end of file
+    })
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def metrics(request):
+    """运行指标视图（仅管理员），供监控系统采集"""
+    from records.contentcache import decrypted_content_cache
+    from records.datakeys import data_key_cache
+    from records.responsecache import response_cache
+    from records.storage import write_stats
+    return Response({
+        'decrypted_content_cache': decrypted_content_cache.stats(),
+        'data_key_cache': data_key_cache.stats(),
+        'response_cache': response_cache.stats(),
+        'shared_cache': caches['shared'].stats() if hasattr(caches['shared'], 'stats') else None,
+        'encrypted_writes': write_stats.snapshot(),
+    })
@@ -1,11 +1,20 @@
 from django.contrib import admin
+from django.core.exceptions import PermissionDenied
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html
 from django.utils.translation import gettext_lazy as _
+from .downloads import report_file_response
 from .models import (
     MedicalRecord,
     MedicationRecord,
     VaccinationRecord,
     PhysicalExam,
-    MedicalAttachment
+    MedicalAttachment,
+    AttachmentBlob,
+    HealthSummary,
+    parse_blood_pressure
 )
 
 @admin.register(MedicalRecord)
@@ -57,6 +66,7 @@ class MedicationRecordAdmin(admin.ModelAdmin):
         'medical_record__diagnosis'
     )
     raw_id_fields = ('medical_record',)
+    list_select_related = ('medical_record',)
     # 自定义字段方法
     def medical_record_link(self, obj):
         """创建医疗记录管理链接"""
@@ -123,10 +133,12 @@ class PhysicalExamAdmin(admin.ModelAdmin):
         'exam_date',
         'bmi_display',
         'blood_pressure',
+        'severity',
         'report_link'
     )
     list_filter = (
         'exam_date',
+        'severity',
         ('user', admin.RelatedOnlyFieldListFilter)
     )
     search_fields = (
@@ -136,7 +148,7 @@ class PhysicalExamAdmin(admin.ModelAdmin):
     # 表单验证
     def save_model(self, request, obj, form, change):
         """保存前验证血压格式"""
-        if '/' not in obj.blood_pressure:
+        if parse_blood_pressure(obj.blood_pressure)[0] is None:
             from django.core.exceptions import ValidationError
             raise ValidationError("血压格式必须为 收缩压/舒张压")
         super().save_model(request, obj, form, change)
@@ -156,21 +168,57 @@ class PhysicalExamAdmin(admin.ModelAdmin):
     bmi_display.short_description = _('体质指数')
 
     def report_link(self, obj):
-        """生成报告下载链接"""
+        """生成报告下载链接，经管理后台的下载视图读取，不受接口按用户过滤的限制"""
         if obj.report_pdf:
-            return f'<a href="{obj.report_pdf.url}" download>下载报告</a>'
+            url = reverse('admin:records_physicalexam_report', args=[obj.pk])
+            return format_html('<a href="{}" download>下载报告</a>', url)
         return '-'
     report_link.short_description = _('体检报告')
-    report_link.allow_tags = True
+
+    def get_urls(self):
+        return [
+            path('<int:pk>/report/', self.admin_site.admin_view(self.report_view), name='records_physicalexam_report'),
+            *super().get_urls(),
+        ]
+
+    def report_view(self, request, pk):
+        """管理员下载任意用户的体检报告"""
+        exam = get_object_or_404(PhysicalExam, pk=pk)
+        if not self.has_view_permission(request, exam):
+            raise PermissionDenied
+        if not exam.report_pdf:
+            raise Http404
+        return report_file_response(request, exam.report_pdf)
 
 @admin.register(MedicalAttachment)
 class MedicalAttachmentAdmin(admin.ModelAdmin):
     """就医记录附件管理"""
     list_display = ['id', 'record', 'name', 'size', 'upload_time']
+    list_select_related = ('record__user',)
     list_filter = ['upload_time']
     search_fields = ['name']
     readonly_fields = ['size', 'upload_time']
 
+@admin.register(AttachmentBlob)
+class AttachmentBlobAdmin(admin.ModelAdmin):
+    """附件内容管理（只读）"""
+    list_display = ['digest', 'size', 'ref_count', 'created_at']
+    search_fields = ['digest']
+    readonly_fields = ['digest', 'file', 'size', 'ref_count', 'created_at']
+
+@admin.register(HealthSummary)
+class HealthSummaryAdmin(admin.ModelAdmin):
+    """健康汇总管理（只读，由信号维护）"""
+    list_display = ['user', 'medical_total', 'medication_total', 'active_medications',
+                    'vaccination_total', 'exam_total', 'abnormal_exams', 'latest_exam_date', 'updated_at']
+    search_fields = ['user__username']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
 # 可选：添加全局管理配置
 admin.site.site_header = _('健康档案管理系统')
 admin.site.site_title = _('健康数据管理')
@@ -19,8 +19,8 @@ class RecordsConfig(AppConfig):
         当Django启动时会自动调用
         用于注册信号处理器等初始化操作
         """
-        # 示例：注册信号处理器（需要时取消注释）
-        # from . import signals
+        # 注册信号处理器
+        from . import signals  # noqa
 
         # 示例：添加自定义系统检查
         # from django.core.checks import register
@@ -0,0 +1,222 @@
+"""
+药品名称自动补全模块
+每个工作进程在内存中保存一份药品名称的前缀索引，联想不查询数据库：
+- 名称、全拼、首字母三种键放在同一个有序数组中，前缀对应数组上的一段连续区间
+- 匹配的键较多的前缀预先计算好按使用次数排序的前 K 个；其余前缀的区间很小，
+  查询时二分定位后直接挑选，单次查询最多扫描 SCAN_LIMIT 个键
+新增用药记录提交后在本进程内增量更新；其他进程的写入在索引定期重建后可见
+"""
+
+import heapq
+import threading
+import time
+from bisect import bisect_left
+
+import structlog
+from django.conf import settings
+
+from .models import NameSuggestion
+from .suggestions import name_keys, normalize_query, suggestion_setting
+
+logger = structlog.get_logger(__name__)
+
+DEFAULT_DRUG_AUTOCOMPLETE = {
+    'TOP_K': 10,
+    # 匹配的键多于该数量的前缀预先计算前 TOP_K 个名称，其余前缀查询时直接扫描
+    'SCAN_LIMIT': 64,
+    # 索引的最长使用时间（秒），到期后从数据库重建，纳入其他进程的写入
+    'REFRESH_INTERVAL': 300,
+    # 可选的药品词典文件，每行一个名称，可用制表符附带基础使用次数
+    'DICTIONARY': None,
+}
+
+_END = '\U0010ffff'
+
+
+def autocomplete_setting(name):
+    configured = getattr(settings, 'DRUG_AUTOCOMPLETE', {})
+    return configured.get(name, DEFAULT_DRUG_AUTOCOMPLETE[name])
+
+
+def _rank(counts):
+    # 查询与更新并发时名称可能刚被移除
+    return lambda name: (-counts.get(name, 0), name)
+
+
+class PrefixIndex:
+    """
+    名称前缀索引
+    counts 为 名称 -> 使用次数，keys 为 名称 -> 检索键（缺少时用拼音计算）；
+    entries 为按键排序的(键数组, 名称数组)，top 为 匹配较多的前缀 -> 前 K 个名称
+    """
+
+    def __init__(self, counts, top_k, scan_limit, keys=None):
+        self.counts = dict(counts)
+        self.top_k = top_k
+        self.scan_limit = scan_limit
+        keys = keys or {}
+        self.keys = {name: keys.get(name) or self._compute_keys(name) for name in self.counts}
+        entries = sorted((key, name) for name, name_keys in self.keys.items() for key in name_keys)
+        self.entries = ([key for key, _ in entries], [name for _, name in entries])
+        self.top = {}
+        self._build_top('', 0, len(entries))
+
+    @staticmethod
+    def _compute_keys(name):
+        pinyin, initials = name_keys(name)
+        return tuple({key for key in (name, pinyin, initials) if key})
+
+    def _build_top(self, prefix, low, high):
+        """
+        keys[low:high] 为以 prefix 开头的键，返回其中的前 K 个名称
+        区间超过 scan_limit 时按下一个字符分组递归，由各组的前 K 个合并，并记入 top；
+        较小的区间查询时直接扫描，不需要预先计算
+        """
+        keys, names = self.entries
+        rank = _rank(self.counts)
+        if high - low <= self.scan_limit:
+            return heapq.nsmallest(self.top_k, set(names[low:high]), key=rank)
+        candidates = set()
+        position = low
+        # 与前缀完全相同的键排在最前面
+        while position < high and len(keys[position]) == len(prefix):
+            candidates.add(names[position])
+            position += 1
+        while position < high:
+            child = keys[position][:len(prefix) + 1]
+            end = bisect_left(keys, child + _END, position, high)
+            candidates.update(self._build_top(child, position, end))
+            position = end
+        top = heapq.nsmallest(self.top_k, candidates, key=rank)
+        if prefix:
+            self.top[prefix] = top
+        return top
+
+    def __len__(self):
+        return len(self.counts)
+
+    def lookup(self, key, limit):
+        """返回匹配前缀的 [(名称, 使用次数)]，按使用次数倒序"""
+        if not key:
+            return []
+        counts = self.counts
+        if key in self.top and limit <= self.top_k:
+            names = self.top[key][:limit]
+        else:
+            keys, names = self.entries
+            low = bisect_left(keys, key)
+            high = bisect_left(keys, key + _END, low)
+            # 同一名称的多个键可能同时匹配，已移除的名称不再返回
+            matched = {name for name in names[low:high] if name in counts}
+            names = heapq.nsmallest(limit, matched, key=_rank(counts))
+        return [(name, counts[name]) for name in names if name in counts]
+
+    def update(self, name, count):
+        """
+        设置名称的使用次数，count 为None表示移除
+        查询不加锁，数组和前 K 列表都整体替换，不在原地修改
+        """
+        if count is None:
+            if self.counts.pop(name, None) is None:
+                return
+        else:
+            if name not in self.keys:
+                self.keys[name] = self._compute_keys(name)
+                keys, names = list(self.entries[0]), list(self.entries[1])
+                for key in self.keys[name]:
+                    position = bisect_left(keys, key)
+                    keys.insert(position, key)
+                    names.insert(position, name)
+                self.entries = (keys, names)
+            self.counts[name] = count
+        rank = _rank(self.counts)
+        prefixes = {key[:length] for key in self.keys[name] for length in range(1, len(key) + 1)}
+        for prefix in prefixes & self.top.keys():
+            names = [other for other in self.top[prefix] if other != name]
+            if count is not None:
+                # 次数减少时排在前 K 之外的名称不会补入，等待下次重建
+                names = sorted(names + [name], key=rank)[:self.top_k]
+            self.top[prefix] = names
+
+
+def load_dictionary(path):
+    """读取药品词典，返回 名称 -> 基础使用次数"""
+    counts = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            name, _, count = line.strip().partition('\t')
+            if name:
+                counts[name] = int(count or 0)
+    return counts
+
+
+class DrugAutocomplete:
+    """
+    进程内的药品名称补全服务
+    名称来自用药记录汇总出的全站联想词条（使用人数达到下限）与可选的药品词典
+    """
+
+    def __init__(self):
+        self._index = None
+        self._loaded_at = 0.0
+        self._dictionary = None
+        self._lock = threading.Lock()
+
+    def _build(self):
+        if self._dictionary is None:
+            path = autocomplete_setting('DICTIONARY')
+            self._dictionary = load_dictionary(path) if path else {}
+        counts, keys = dict(self._dictionary), {}
+        entries = NameSuggestion.objects.filter(
+            user__isnull=True,
+            field=NameSuggestion.Field.DRUG,
+            users__gte=suggestion_setting('GLOBAL_MIN_USERS'),
+        ).values_list('name', 'uses', 'pinyin', 'initials')
+        for name, uses, pinyin, initials in entries:
+            counts[name] = self._dictionary.get(name, 0) + uses
+            # 词条中已保存拼音，不必重新计算
+            keys[name] = tuple({key for key in (name, pinyin, initials) if key})
+        started = time.perf_counter()
+        index = PrefixIndex(counts, autocomplete_setting('TOP_K'), autocomplete_setting('SCAN_LIMIT'), keys)
+        logger.info("drug_autocomplete_built", names=len(index),
+                    build_ms=round((time.perf_counter() - started) * 1000, 3))
+        return index
+
+    def index(self):
+        """返回当前索引，首次使用或到期时重建"""
+        index = self._index
+        if index is None or time.monotonic() - self._loaded_at > autocomplete_setting('REFRESH_INTERVAL'):
+            with self._lock:
+                if self._index is index:
+                    self._index = self._build()
+                    self._loaded_at = time.monotonic()
+                index = self._index
+        return index
+
+    def lookup(self, query, limit):
+        """返回 [{'name': 名称, 'uses': 使用次数}]，按使用次数倒序"""
+        return [{'name': name, 'uses': uses} for name, uses in self.index().lookup(normalize_query(query), limit)]
+
+    def update(self, name, uses, users):
+        """
+        全站词条变化后增量更新本进程的索引
+        使用人数低于下限且不在词典中的名称从索引中移除
+        """
+        with self._lock:
+            if self._index is None:
+                # 尚未加载，首次使用时从数据库读取最新数据
+                return
+            base = self._dictionary.get(name)
+            if users < suggestion_setting('GLOBAL_MIN_USERS') or uses <= 0:
+                self._index.update(name, base)
+            else:
+                self._index.update(name, (base or 0) + uses)
+
+    def clear(self):
+        """丢弃索引，下次使用时重建"""
+        with self._lock:
+            self._index = None
+            self._dictionary = None
+
+
+drug_autocomplete = DrugAutocomplete()
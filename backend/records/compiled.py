@@ -0,0 +1,292 @@
+"""
+编译的只读序列化模块
+列表接口直接从 values_list() 元组生成输出，跳过模型实例化与DRF逐字段的属性访问
+每个序列化器生成一个专用的行渲染函数，无需转换的列直接按下标取值
+输出须与对应的 ModelSerializer 完全一致，含无法编译的字段时整个序列化器回退到常规路径
+"""
+
+import decimal
+
+from django.core.exceptions import FieldDoesNotExist
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.relations import RelatedField
+from rest_framework.response import Response
+from rest_framework.settings import ISO_8601, api_settings
+
+# (序列化器类, 模型, 保留的字段) -> 编译结果，无法编译时为None
+# 编译结果在请求之间共用，只能依赖渲染时传入的 context，不能持有某次请求的序列化器实例
+_compiled = {}
+
+
+class Unsupported(Exception):
+    """字段无法编译"""
+
+
+def _static(converter):
+    return lambda context: converter
+
+
+def _date_converter(field, default_format):
+    output_format = getattr(field, 'format', default_format)
+    if output_format is None:
+        return None
+    if output_format.lower() == ISO_8601:
+        return _static(lambda value: value.isoformat())
+    return _static(field.to_representation)
+
+
+def _datetime_converter(field):
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    if output_format is None:
+        return None
+    if output_format.lower() != ISO_8601:
+        return _static(field.to_representation)
+
+    def factory(context):
+        # 与 enforce_timezone 相同：时区在渲染时确定，整页只取一次
+        field_timezone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+        if field_timezone is None:
+            return field.to_representation
+
+        def convert(value):
+            if value.tzinfo is None:
+                value = timezone.make_aware(value, field_timezone)
+            else:
+                value = value.astimezone(field_timezone)
+            value = value.isoformat()
+            return value[:-6] + 'Z' if value.endswith('+00:00') else value
+        return convert
+    return factory
+
+
+def _decimal_converter(field):
+    if field.localize or field.normalize_output or field.decimal_places is None:
+        return _static(field.to_representation)
+    coerce_to_string = getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+    quantum = decimal.Decimal('.1') ** field.decimal_places
+    rounding = field.rounding
+
+    def factory(context):
+        quantize_context = decimal.getcontext().copy()
+        if field.max_digits is not None:
+            quantize_context.prec = field.max_digits
+
+        # 身高、体重等列的取值重复度高，同一次渲染内缓存转换结果
+        converted = {}
+
+        def convert(value):
+            result = converted.get(value)
+            if result is None:
+                number = value if isinstance(value, decimal.Decimal) else decimal.Decimal(str(value).strip())
+                number = number.quantize(quantum, rounding=rounding, context=quantize_context)
+                result = converted[value] = f'{number:f}' if coerce_to_string else number
+            return result
+        return convert
+    return factory
+
+
+def _converter(field):
+    """
+    列值到输出值的转换函数工厂，行为与 field.to_representation 一致
+    返回None表示数据库返回的值可直接输出
+    """
+    if isinstance(field, serializers.DateTimeField):
+        return _datetime_converter(field)
+    if isinstance(field, serializers.DateField):
+        return _date_converter(field, api_settings.DATE_FORMAT)
+    if isinstance(field, serializers.TimeField):
+        return _date_converter(field, api_settings.TIME_FORMAT)
+    if isinstance(field, serializers.DecimalField):
+        return _decimal_converter(field)
+    if isinstance(field, (serializers.CharField, serializers.ChoiceField,
+                          serializers.IntegerField, serializers.BooleanField)):
+        # 数据库返回的值已是对应的Python类型，to_representation 不会改变它
+        return None
+    return _static(field.to_representation)
+
+
+class CompiledSerializer:
+    """
+    从序列化器实例编译出的渲染器
+    columns 为 values_list() 需要读取的列，render(rows, context) 生成与原序列化器相同的数据
+    """
+
+    def __init__(self, serializer, model, prefix='', columns=None):
+        self.model = model
+        self.columns = [] if columns is None else columns
+        self.pk_index = self._column(prefix + model._meta.pk.name)
+        # 生成代码中的字段表达式，以及每次渲染时生成辅助函数的工厂（参数为context和整页的行）
+        expressions = []
+        self.factories = []
+        for name, field in serializer.fields.items():
+            if not field.write_only:
+                expressions.append(f'{name!r}: {self._compile(name, field, serializer, prefix)}')
+        helpers = ', '.join(f'f{i}' for i in range(len(self.factories)))
+        source = (
+            f'def make({helpers}):\n'
+            f'    def render(row):\n'
+            f'        return {{{", ".join(expressions)}}}\n'
+            f'    return render\n'
+        )
+        namespace = {}
+        exec(compile(source, f'<compiled {type(serializer).__name__}>', 'exec'), namespace)
+        self._make = namespace['make']
+
+    def _column(self, lookup):
+        if lookup not in self.columns:
+            self.columns.append(lookup)
+        return self.columns.index(lookup)
+
+    def _helper(self, factory):
+        self.factories.append(factory)
+        return f'f{len(self.factories) - 1}'
+
+    def _value(self, index, converter):
+        """列值的表达式，空值与DRF一致直接输出None"""
+        if converter is None:
+            return f'row[{index}]'
+        helper = self._helper(lambda context, rows: converter(context))
+        return f'(None if row[{index}] is None else {helper}(row[{index}]))'
+
+    def _compile(self, name, field, serializer, prefix):
+        model = self.model
+        if isinstance(field, serializers.SerializerMethodField):
+            # compile_<字段名> 为静态方法，参数为渲染时的 context，返回由依赖列计算输出值的函数
+            compile_function = getattr(type(serializer), f'compile_{name}', None)
+            dependencies = getattr(serializer.Meta, 'column_dependencies', {}).get(name)
+            if compile_function is None or dependencies is None:
+                raise Unsupported(name)
+            arguments = ', '.join(f'row[{self._column(prefix + column)}]' for column in dependencies)
+            return f'{self._helper(lambda context, rows: compile_function(context))}({arguments})'
+
+        attrs = field.source_attrs
+        if len(attrs) != 1:
+            raise Unsupported(name)
+        attr = attrs[0]
+        if attr.startswith('get_') and attr.endswith('_display'):
+            model_field = model._meta.get_field(attr[4:-8])
+            labels = {value: str(label) for value, label in model_field.flatchoices}
+            index = self._column(prefix + model_field.name)
+            return f'{self._helper(lambda context, rows: labels.get)}(row[{index}], row[{index}])'
+        try:
+            model_field = model._meta.get_field(attr)
+        except FieldDoesNotExist:
+            raise Unsupported(name)
+
+        if isinstance(field, serializers.ListSerializer):
+            return f'{self._helper(self._compile_many(field.child, model_field))}(row)'
+        if isinstance(field, serializers.BaseSerializer):
+            if not (model_field.many_to_one or model_field.one_to_one) or not model_field.concrete:
+                raise Unsupported(name)
+            index = self._column(prefix + model_field.attname)
+            nested = CompiledSerializer(field, model_field.related_model, f'{prefix}{attr}__', self.columns)
+            helper = self._helper(nested.row_renderer)
+            return f'(None if row[{index}] is None else {helper}(row))'
+        if isinstance(field, RelatedField):
+            if not field.use_pk_only_optimization() or not model_field.concrete:
+                raise Unsupported(name)
+            return f'row[{self._column(prefix + model_field.attname)}]'
+        if not model_field.concrete or model_field.is_relation:
+            raise Unsupported(name)
+
+        index = self._column(prefix + model_field.name)
+        if isinstance(field, serializers.FileField):
+            return f'{self._helper(self._compile_file(field, model_field))}(row[{index}])'
+        return self._value(index, _converter(field))
+
+    def _compile_file(self, field, model_field):
+        """文件字段输出存储URL，有请求时转为绝对地址"""
+        storage = model_field.storage
+        use_url = getattr(field, 'use_url', api_settings.UPLOADED_FILES_USE_URL)
+
+        def factory(context, rows):
+            request = context.get('request')
+
+            def render(name):
+                if not name:
+                    return None
+                if not use_url:
+                    return name
+                url = storage.url(name)
+                return request.build_absolute_uri(url) if request is not None else url
+            return render
+        return factory
+
+    def _compile_many(self, child, relation):
+        """反向外键的嵌套列表：整页父记录共用一次查询，按外键分组"""
+        if not relation.one_to_many:
+            raise Unsupported(relation.name)
+        child_model = relation.related_model
+        foreign_key = relation.field
+        compiled = CompiledSerializer(child, child_model)
+        pk_index = self.pk_index
+
+        def factory(context, rows):
+            groups = {}
+            parents = [row[pk_index] for row in rows]
+            if parents:
+                children = list(child_model._default_manager
+                                .filter(**{f'{foreign_key.name}__in': parents})
+                                .values_list(*compiled.columns, foreign_key.attname))
+                for child_row, data in zip(children, compiled.render(children, context)):
+                    groups.setdefault(child_row[-1], []).append(data)
+            return lambda row: groups.get(row[pk_index], [])
+        return factory
+
+    def row_renderer(self, context, rows):
+        """生成本次渲染使用的 row -> dict 函数"""
+        return self._make(*[factory(context, rows) for factory in self.factories])
+
+    def render(self, rows, context):
+        render = self.row_renderer(context, rows)
+        return [render(row) for row in rows]
+
+
+def _template(serializer):
+    """
+    与请求无关的同类序列化器实例，只保留 serializer 中的字段
+    编译结果引用的字段挂在该实例上，不会持有首次编译时请求的 context
+    """
+    template = type(serializer)(context={})
+    for name in list(template.fields):
+        if name not in serializer.fields:
+            template.fields.pop(name)
+    return template
+
+
+def compile_serializer(serializer, model):
+    """按序列化器类与字段编译，含无法编译的字段时返回None"""
+    key = (type(serializer), model, tuple(serializer.fields))
+    if key not in _compiled:
+        try:
+            _compiled[key] = CompiledSerializer(_template(serializer), model)
+        except Unsupported:
+            _compiled[key] = None
+    return _compiled[key]
+
+
+class CompiledListMixin:
+    """
+    视图集混入类
+    list 接口使用编译的序列化器直接从 values_list() 渲染，无法编译时回退到常规序列化
+    """
+    compiled_list = True
+
+    def list(self, request, *args, **kwargs):
+        serializer = self.get_serializer()
+        queryset = self.filter_queryset(self.get_queryset())
+        compiled = compile_serializer(serializer, queryset.model) if self.compiled_list else None
+        if compiled is None:
+            return super().list(request, *args, **kwargs)
+        # 编译路径自行读取关联数据，清除为模型实例准备的预取
+        columns = list(compiled.columns)
+        for field in getattr(self, 'ordering', None) or ():
+            if field.lstrip('-') not in columns:
+                columns.append(field.lstrip('-'))
+        rows = queryset.select_related(None).prefetch_related(None).values_list(*columns)
+        page = self.paginate_queryset(rows)
+        data = compiled.render(page if page is not None else list(rows), serializer.context)
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
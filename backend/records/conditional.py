@@ -0,0 +1,95 @@
+"""
+条件请求模块
+按用户记录集合的指纹（行数、最大更新时间）生成ETag，If-None-Match 命中时直接返回304，
+不执行列表查询与序列化。各来源的指纹合并为一条 UNION ALL 聚合查询
+"""
+
+import hashlib
+import json
+
+from django.db.models import Count, IntegerField, Max, Value
+from django.utils import timezone
+from django.utils.cache import parse_etags, patch_cache_control
+from rest_framework import status
+from rest_framework.response import Response
+
+# 响应结构版本，序列化输出格式变化时递增，使客户端缓存的旧ETag失效
+SCHEMA_VERSION = 3
+
+
+class NotModified(Exception):
+    """客户端缓存仍然有效"""
+
+
+def collection_fingerprint(sources):
+    """
+    sources 为 (查询集, 更新时间字段) 列表，返回每个来源的 (行数, 最大更新时间)
+    新增和修改会推后最大更新时间，删除会减少行数
+    """
+    branches = [
+        queryset.order_by()
+        .annotate(source=Value(index, output_field=IntegerField()))
+        .values('source')
+        .annotate(rows=Count('pk'), last=Max(field))
+        .values_list('source', 'rows', 'last')
+        for index, (queryset, field) in enumerate(sources)
+    ]
+    union = branches[0].union(*branches[1:], all=True) if len(branches) > 1 else branches[0]
+    return [(rows, last) for _, rows, last in sorted(union, key=lambda row: row[0])]
+
+
+def _matches(etag, header):
+    """If-None-Match 使用弱比较"""
+    etags = parse_etags(header)
+    return '*' in etags or etag in [tag.removeprefix('W/') for tag in etags]
+
+
+class ConditionalGetMixin:
+    """
+    视图集混入类
+    etag_actions 中的GET接口返回ETag，If-None-Match 命中时返回304；
+    ETag包含完整的请求路径与参数，不同分页、筛选和字段集各自独立
+    """
+    etag_actions = ()
+
+    def get_etag_sources(self):
+        """指纹来源，默认为当前用户的记录集合"""
+        return [(self.get_queryset(), 'updated_at')]
+
+    def get_etag_extra(self, request):
+        """不来自记录集合、但会影响输出的其他数据"""
+        return []
+
+    def get_etag(self, request):
+        parts = [
+            SCHEMA_VERSION,
+            request.user.pk,
+            request.get_full_path(),
+            # 剩余天数、进行中用药等字段随日期变化
+            timezone.localdate().isoformat(),
+            collection_fingerprint(self.get_etag_sources()),
+            self.get_etag_extra(request),
+        ]
+        digest = hashlib.sha256(json.dumps(parts, default=str).encode()).hexdigest()[:32]
+        return f'"{digest}"'
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.etag = None
+        if request.method in ('GET', 'HEAD') and self.action in self.etag_actions:
+            self.etag = self.get_etag(request)
+            if _matches(self.etag, request.headers.get('If-None-Match', '')):
+                raise NotModified()
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return Response(status=status.HTTP_304_NOT_MODIFIED)
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if getattr(self, 'etag', None) and response.status_code in (200, 304):
+            response['ETag'] = self.etag
+            # 每次使用前向服务器确认，轮询时由ETag省去响应体
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
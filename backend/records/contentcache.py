@@ -0,0 +1,203 @@
+"""
+解密内容缓存模块
+在进程内按字节预算缓存解密后的文件内容，避免重复读取和解密同一报告
+"""
+
+import io
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+DEFAULT_CACHE_SETTINGS = {
+    'MAX_BYTES': 64 * 1024 * 1024,
+    'MAX_ENTRY_BYTES': 16 * 1024 * 1024,
+    'ZERO_ON_EVICT': True,
+}
+
+
+class _Entry:
+    """缓存条目，记录正在读取该内容的读取器数量"""
+    __slots__ = ('key', 'buffer', 'readers', 'evicted')
+
+    def __init__(self, key, buffer):
+        self.key = key
+        self.buffer = buffer
+        self.readers = 0
+        self.evicted = False
+
+
+class CachedContentFile(io.RawIOBase):
+    """
+    缓存内容的只读文件视图
+    直接读取缓存缓冲区，不复制内容；关闭时释放对条目的引用
+    """
+
+    def __init__(self, cache, entry):
+        super().__init__()
+        self._cache = cache
+        self._entry = entry
+        self._view = memoryview(entry.buffer)
+        self.size = len(entry.buffer)
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError(f"无效的whence参数: {whence}")
+        if pos < 0:
+            raise ValueError("定位位置不能为负数")
+        self._pos = pos
+        return pos
+
+    def readinto(self, buffer):
+        count = max(min(len(buffer), self.size - self._pos), 0)
+        buffer[:count] = self._view[self._pos:self._pos + count]
+        self._pos += count
+        return count
+
+    def close(self):
+        if not self.closed:
+            self._view.release()
+            self._cache._release(self._entry)
+        super().close()
+
+
+class DecryptedContentCache:
+    """
+    按字节预算的LRU解密内容缓存
+    键为(文件路径, 修改时间, 文件大小)，文件被覆盖后旧内容自然失效
+    被淘汰的缓冲区在最后一个读取器关闭后清零，避免明文残留在内存中
+    """
+
+    def __init__(self, max_bytes=None, max_entry_bytes=None, zero_on_evict=None):
+        self._max_bytes = max_bytes
+        self._max_entry_bytes = max_entry_bytes
+        self._zero_on_evict = zero_on_evict
+        self._entries = OrderedDict()
+        self._keys_by_path = {}
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _setting(self, name):
+        value = getattr(self, f'_{name.lower()}')
+        if value is not None:
+            return value
+        configured = getattr(settings, 'DECRYPTED_CONTENT_CACHE', {})
+        return configured.get(name, DEFAULT_CACHE_SETTINGS[name])
+
+    @property
+    def max_bytes(self):
+        return self._setting('MAX_BYTES')
+
+    @property
+    def max_entry_bytes(self):
+        return min(self._setting('MAX_ENTRY_BYTES'), self.max_bytes)
+
+    def accepts(self, size):
+        """判断指定大小的内容是否可以进入缓存"""
+        return 0 < size <= self.max_entry_bytes
+
+    def get(self, key):
+        """查找缓存内容，命中时返回只读文件视图"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            entry.readers += 1
+        return CachedContentFile(self, entry)
+
+    def put(self, key, buffer):
+        """
+        放入解密内容并返回其只读文件视图
+        内容超过单条上限时不缓存，仅包装返回
+        """
+        entry = _Entry(key, buffer)
+        with self._lock:
+            entry.readers += 1
+            if not self.accepts(len(buffer)):
+                entry.evicted = True
+                return CachedContentFile(self, entry)
+            if key in self._entries:
+                self._evict(key)
+            previous = self._keys_by_path.get(key[0])
+            if previous is not None:
+                self._evict(previous)
+            self._entries[key] = entry
+            self._keys_by_path[key[0]] = key
+            self.current_bytes += len(buffer)
+            while self.current_bytes > self.max_bytes:
+                self._evict(next(iter(self._entries)))
+                self.evictions += 1
+        return CachedContentFile(self, entry)
+
+    def discard(self, path):
+        """丢弃指定文件的缓存内容"""
+        with self._lock:
+            key = self._keys_by_path.get(path)
+            if key is not None:
+                self._evict(key)
+
+    def clear(self, reset_stats=True):
+        """清空缓存，默认同时重置计数器"""
+        with self._lock:
+            for key in list(self._entries):
+                self._evict(key)
+            if reset_stats:
+                self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """返回监控用的缓存统计信息"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            }
+
+    def _evict(self, key):
+        entry = self._entries.pop(key)
+        if self._keys_by_path.get(key[0]) == key:
+            del self._keys_by_path[key[0]]
+        self.current_bytes -= len(entry.buffer)
+        entry.evicted = True
+        if entry.readers == 0:
+            self._scrub(entry)
+
+    def _release(self, entry):
+        with self._lock:
+            entry.readers -= 1
+            if entry.evicted and entry.readers == 0:
+                self._scrub(entry)
+
+    def _scrub(self, entry):
+        if self._setting('ZERO_ON_EVICT') and isinstance(entry.buffer, bytearray):
+            entry.buffer[:] = bytes(len(entry.buffer))
+
+
+decrypted_content_cache = DecryptedContentCache()
@@ -0,0 +1,255 @@
+"""
+用户数据密钥模块
+每个用户的加密文件使用独立的数据密钥，数据密钥由主密钥包装后保存在数据库中
+目前只有体检报告使用数据密钥；就医记录附件以明文保存在默认存储，删除数据密钥不影响附件
+解包后的数据密钥按TTL和LRU缓存在进程内，热点读取无需重复查询和解包
+数据密钥删除（密码学擦除）通过共享缓存中的擦除代数通知所有进程，
+各进程打开文件前比对代数，变化时丢弃本进程缓存的密钥与解密内容
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from cryptography.fernet import Fernet, InvalidToken
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from users.models import UserDataKey
+
+from .contentcache import decrypted_content_cache
+from .encryption import DecryptionError, FileCipher
+
+DEFAULT_DATA_KEY_CACHE = {
+    'MAX_ENTRIES': 1024,
+    'TTL': 300,
+    # 保存擦除代数的缓存，须在进程间共享；进程内缓存时其他进程只能等密钥TTL到期
+    'SHRED_ALIAS': 'default',
+}
+
+
+class DataKeyCache:
+    """
+    解包后数据密钥的缓存，键为密钥ID
+    条目超过TTL后失效，超出数量上限时淘汰最久未使用的条目
+    密钥被删除后其他进程由 shred_notifier 通知清空，TTL 只是共享缓存不可用时的上限
+    """
+
+    def __init__(self, max_entries=None, ttl=None, clock=time.monotonic):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _setting(self, name):
+        value = getattr(self, f'_{name.lower()}')
+        if value is not None:
+            return value
+        configured = getattr(settings, 'DATA_KEY_CACHE', {})
+        return configured.get(name, DEFAULT_DATA_KEY_CACHE[name])
+
+    def get(self, key_id):
+        """查找未过期的数据密钥加密器，未命中返回None"""
+        with self._lock:
+            item = self._entries.get(key_id)
+            if item is not None and item[1] <= self._clock():
+                del self._entries[key_id]
+                self.expirations += 1
+                item = None
+            if item is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key_id)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key_id, cipher):
+        """放入数据密钥加密器"""
+        max_entries = self._setting('MAX_ENTRIES')
+        if max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key_id] = (cipher, self._clock() + self._setting('TTL'))
+            self._entries.move_to_end(key_id)
+            while len(self._entries) > max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, key_id):
+        """丢弃指定的数据密钥"""
+        with self._lock:
+            self._entries.pop(key_id, None)
+
+    def clear(self, reset_stats=True):
+        """清空缓存，默认同时重置计数器"""
+        with self._lock:
+            self._entries.clear()
+            if reset_stats:
+                self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def stats(self):
+        """返回监控用的缓存统计信息"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self._setting('MAX_ENTRIES'),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+data_key_cache = DataKeyCache()
+
+
+class ShredNotifier:
+    """
+    数据密钥擦除的跨进程通知
+    共享缓存中保存擦除代数，删除数据密钥时递增；各进程在使用缓存的密钥或解密内容前比对，
+    代数与上次见到的不同时清空本进程的两类缓存。代数丢失（淘汰、重启）时以纳秒时间戳
+    重新开始，效果等同一次擦除，只会多清空一次缓存
+    """
+    KEY = 'datakeys:shred_generation'
+
+    def __init__(self):
+        self._seen = None
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        configured = getattr(settings, 'DATA_KEY_CACHE', {})
+        return caches[configured.get('SHRED_ALIAS', DEFAULT_DATA_KEY_CACHE['SHRED_ALIAS'])]
+
+    def generation(self):
+        value = self.cache.get(self.KEY)
+        if value is None:
+            self.cache.add(self.KEY, time.time_ns(), timeout=None)
+            value = self.cache.get(self.KEY)
+        return value
+
+    def _clear_local(self):
+        data_key_cache.clear(reset_stats=False)
+        # 解密内容缓存不记录密钥归属，密钥删除很少发生，直接整体清空
+        decrypted_content_cache.clear(reset_stats=False)
+
+    def sync(self):
+        """其他进程擦除过数据密钥时，丢弃本进程缓存的密钥与解密内容"""
+        generation = self.generation()
+        if generation != self._seen:
+            with self._lock:
+                if generation != self._seen:
+                    self._clear_local()
+                    self._seen = generation
+
+    def shred(self):
+        """本进程立即丢弃缓存，并递增共享代数通知其他进程"""
+        try:
+            self.cache.incr(self.KEY)
+        except ValueError:
+            self.cache.add(self.KEY, time.time_ns(), timeout=None)
+        self._clear_local()
+
+
+shred_notifier = ShredNotifier()
+
+
+class EnvelopeKeyring:
+    """
+    主密钥与用户数据密钥组成的密钥环
+    文件头中的密钥ID属于主密钥时直接使用，否则查找（必要时解包）对应的用户数据密钥
+    """
+
+    def __init__(self, master, fernet, cache=None):
+        self.master = master
+        self.primary = master.primary
+        self.fernet = fernet
+        self.cache = data_key_cache if cache is None else cache
+
+    def cipher_for(self, key_id):
+        if key_id in self.master:
+            return self.master.cipher_for(key_id)
+        cipher = self.cache.get(key_id)
+        if cipher is None:
+            wrapped = UserDataKey.objects.filter(key_id=key_id.hex()).values_list('wrapped_key', flat=True).first()
+            if wrapped is None:
+                raise DecryptionError("文件使用了未知的加密密钥")
+            cipher = self._unwrap(wrapped)
+            self.cache.put(key_id, cipher)
+        return cipher
+
+    def knows(self, key_id):
+        """判断密钥ID是否可用于解密"""
+        try:
+            self.cipher_for(key_id)
+        except DecryptionError:
+            return False
+        return True
+
+    def cipher_for_user(self, user_id):
+        """
+        返回用户的数据密钥加密器，首次使用时生成并包装保存
+        没有所属用户的文件使用主密钥
+        """
+        if user_id is None:
+            return self.primary
+        row = UserDataKey.objects.filter(user_id=user_id).values_list('key_id', 'wrapped_key').first()
+        if row is None:
+            data_key = Fernet.generate_key()
+            cipher = FileCipher(data_key)
+            try:
+                with transaction.atomic():
+                    UserDataKey.objects.create(
+                        user_id=user_id,
+                        key_id=cipher.key_id.hex(),
+                        wrapped_key=self.fernet.encrypt(data_key),
+                        master_key_id=self.primary.key_id.hex(),
+                    )
+            except IntegrityError:
+                # 并发请求已为该用户生成了数据密钥
+                row = UserDataKey.objects.filter(user_id=user_id).values_list('key_id', 'wrapped_key').get()
+            else:
+                self.cache.put(cipher.key_id, cipher)
+                return cipher
+        key_id = bytes.fromhex(row[0])
+        cipher = self.cache.get(key_id)
+        if cipher is None:
+            cipher = self._unwrap(row[1])
+            self.cache.put(key_id, cipher)
+        return cipher
+
+    def _unwrap(self, wrapped):
+        try:
+            return FileCipher(self.fernet.decrypt(bytes(wrapped)))
+        except InvalidToken:
+            raise DecryptionError("数据密钥无法用当前主密钥解包")
+
+    def rewrap_all(self, batch_size=500):
+        """
+        用当前主密钥重新包装所有旧主密钥包装的数据密钥，返回处理数量
+        数据密钥本身不变，文件无需重新加密
+        """
+        primary_id = self.primary.key_id.hex()
+        count = 0
+        while True:
+            batch = list(UserDataKey.objects.exclude(master_key_id=primary_id).order_by('pk')[:batch_size])
+            if not batch:
+                return count
+            now = timezone.now()
+            for row in batch:
+                try:
+                    row.wrapped_key = self.fernet.rotate(bytes(row.wrapped_key))
+                except InvalidToken:
+                    raise DecryptionError(f"数据密钥{row.key_id}无法用已配置的主密钥解包")
+                row.master_key_id = primary_id
+                row.rewrapped_at = now
+            UserDataKey.objects.bulk_update(batch, ['wrapped_key', 'master_key_id', 'rewrapped_at'])
+            count += len(batch)
@@ -0,0 +1,111 @@
+"""
+文件下载模块
+支持HTTP Range分段请求，只读取（并解密）请求范围覆盖的数据
+"""
+
+import mimetypes
+import os
+import re
+
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header
+from rest_framework.renderers import BaseRenderer
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(Exception):
+    """请求的范围超出文件大小"""
+
+
+class PassthroughRenderer(BaseRenderer):
+    """
+    文件下载动作使用的渲染器
+    接受任意Accept请求头，响应体由视图直接构造
+    """
+    media_type = '*/*'
+    format = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return data
+
+
+def parse_range(header, size):
+    """
+    解析单段Range请求头，返回闭区间(start, end)
+    未提供、格式不支持或包含多段时返回None（按完整文件响应）
+    """
+    if not header:
+        return None
+    match = _RANGE_RE.match(header.strip())
+    if not match or match.group(1) == match.group(2) == '':
+        return None
+    first, last = match.groups()
+    if first == '':
+        # 后缀范围：最后N个字节
+        length = int(last)
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiable()
+        return max(size - length, 0), size - 1
+    start = int(first)
+    if start >= size:
+        raise RangeNotSatisfiable()
+    end = int(last) if last else size - 1
+    if start > end:
+        return None
+    return start, min(end, size - 1)
+
+
+def _iter_file(fileobj, start, length):
+    try:
+        fileobj.seek(start)
+        remaining = length
+        while remaining > 0:
+            data = fileobj.read(min(STREAM_CHUNK_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+    finally:
+        fileobj.close()
+
+
+def ranged_file_response(request, fileobj, filename, content_type=None):
+    """
+    构造支持Range请求的文件响应
+    fileobj 需支持seek/read，响应结束后自动关闭
+    """
+    size = fileobj.size
+    content_type = content_type or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    try:
+        byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+    except RangeNotSatisfiable:
+        fileobj.close()
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    if byte_range is None:
+        start, end, status = 0, size - 1, 200
+    else:
+        (start, end), status = byte_range, 206
+    length = end - start + 1 if size else 0
+    response = StreamingHttpResponse(_iter_file(fileobj, start, length), status=status, content_type=content_type)
+    response['Content-Length'] = str(length)
+    response['Accept-Ranges'] = 'bytes'
+    response['Content-Disposition'] = content_disposition_header(False, os.path.basename(filename))
+    if status == 206:
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return response
+
+
+def report_file_response(request, report):
+    """体检报告PDF的下载响应，下载文件名移除加密文件扩展名"""
+    return ranged_file_response(
+        request,
+        report.storage.open(report.name),
+        report.name.removesuffix('.encrypted'),
+        'application/pdf',
+    )
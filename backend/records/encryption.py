@@ -0,0 +1,415 @@
+"""
+分块加密文件格式
+使用AES-GCM对文件内容逐块进行认证加密，读写时只需在内存中保留一个数据块
+
+公共文件头：魔数(4) | 版本(1)
+
+版本1（流式记录，只能顺序读取）：
+    密钥ID(16) | nonce前缀(7)
+    记录：长度(4，最高位为结束标记) | 密文+认证标签
+    最后一条记录总是带结束标记的空记录，用于发现文件被截断
+
+版本2（定长块，可随机读取）：
+    编码(1) | 块大小(4) | 密钥ID(16) | nonce前缀(7)
+    索引头：明文大小(8) | 块数(4) | 索引偏移(8)
+    数据块：每块明文固定为块大小（最后一块除外），各自独立认证
+    索引：每块密文长度(4)，按块序号排列
+
+编码为zlib时每块先压缩再加密，块内容首字节标记该块是否被压缩；
+是否启用压缩在写入第一块时根据其压缩收益决定，并记录在文件头中
+"""
+
+import hashlib
+import io
+import os
+import struct
+import time
+import zlib
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+MAGIC = b'HHEF'
+VERSION_STREAM = 1
+VERSION_BLOCKS = 2
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+TAG_SIZE = 16
+KEY_ID_SIZE = 16
+NONCE_PREFIX_SIZE = 7
+DEFAULT_BLOCK_SIZE = 64 * 1024
+# 首块压缩后体积减少不足该比例时，整个文件不压缩
+DEFAULT_MIN_GAIN = 0.1
+
+_PREAMBLE = struct.Struct('>4sB')
+_HEADER_V1 = struct.Struct('>16s7s')
+_HEADER_V2 = struct.Struct('>BI16s7s')
+_INDEX_HEADER = struct.Struct('>QIQ')
+_LENGTH = struct.Struct('>I')
+_FINAL_FLAG = 0x80000000
+_BLOCK_RAW = b'\x00'
+_BLOCK_COMPRESSED = b'\x01'
+
+
+class DecryptionError(Exception):
+    """加密文件损坏、被截断或密钥不匹配"""
+
+
+def derive_file_key(master_key):
+    """从Fernet主密钥派生AES-256文件加密密钥"""
+    return HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=None,
+        info=b'homehealth-file-encryption',
+        backend=default_backend(),
+    ).derive(master_key)
+
+
+def is_chunked(prefix):
+    """根据文件开头的字节判断是否为分块加密格式"""
+    return prefix[:len(MAGIC)] == MAGIC
+
+
+def _read_exact(fileobj, size):
+    data = fileobj.read(size)
+    if len(data) < size:
+        raise DecryptionError("文件被截断")
+    return data
+
+
+class FileCipher:
+    """
+    绑定单个文件密钥的分块加解密器
+    nonce = 随机前缀(7) | 块序号(4) | 结束标记(1)，保证块不可重排、截断或拼接
+    """
+
+    def __init__(self, master_key):
+        self.key = derive_file_key(master_key)
+        self.key_id = hashlib.sha256(b'key-id:' + self.key).digest()[:KEY_ID_SIZE]
+        self._aead = AESGCM(self.key)
+
+    @staticmethod
+    def _nonce(prefix, counter, final):
+        return prefix + struct.pack('>IB', counter, 1 if final else 0)
+
+    def encrypt_block(self, header, counter, data, final=False):
+        return self._aead.encrypt(self._nonce(header.nonce_prefix, counter, final), data, header.raw)
+
+    def decrypt_block(self, header, counter, data, final=False):
+        try:
+            return self._aead.decrypt(self._nonce(header.nonce_prefix, counter, final), data, header.raw)
+        except InvalidTag:
+            raise DecryptionError(f"第{counter}块认证失败")
+
+
+class Keyring:
+    """
+    文件加密器集合，按文件头中的密钥ID直接选择解密密钥
+    第一个密钥为主密钥，用于加密新文件；其余密钥仅用于读取（如密钥轮换期间）
+    """
+
+    def __init__(self, master_keys):
+        self.ciphers = [FileCipher(key) for key in master_keys]
+        self.primary = self.ciphers[0]
+        self._by_id = {cipher.key_id: cipher for cipher in self.ciphers}
+
+    def __contains__(self, key_id):
+        return key_id in self._by_id
+
+    def cipher_for(self, key_id):
+        cipher = self._by_id.get(key_id)
+        if cipher is None:
+            raise DecryptionError("文件使用了未知的加密密钥")
+        return cipher
+
+
+class Header:
+    """
+    解析后的文件头
+    raw 为参与认证的不可变部分，作为每一块的附加认证数据
+    """
+
+    def __init__(self, version, key_id, nonce_prefix, raw, codec=CODEC_NONE, block_size=None):
+        self.version = version
+        self.key_id = key_id
+        self.nonce_prefix = nonce_prefix
+        self.raw = raw
+        self.codec = codec
+        self.block_size = block_size
+
+    @classmethod
+    def new(cls, key_id, block_size=DEFAULT_BLOCK_SIZE, codec=CODEC_NONE):
+        nonce_prefix = os.urandom(NONCE_PREFIX_SIZE)
+        raw = (_PREAMBLE.pack(MAGIC, VERSION_BLOCKS)
+               + _HEADER_V2.pack(codec, block_size, key_id, nonce_prefix))
+        return cls(VERSION_BLOCKS, key_id, nonce_prefix, raw, codec, block_size)
+
+    @classmethod
+    def read(cls, fileobj):
+        preamble = _read_exact(fileobj, _PREAMBLE.size)
+        magic, version = _PREAMBLE.unpack(preamble)
+        if magic != MAGIC:
+            raise DecryptionError("不是分块加密文件")
+        if version == VERSION_STREAM:
+            body = _read_exact(fileobj, _HEADER_V1.size)
+            key_id, nonce_prefix = _HEADER_V1.unpack(body)
+            return cls(version, key_id, nonce_prefix, preamble + body)
+        if version == VERSION_BLOCKS:
+            body = _read_exact(fileobj, _HEADER_V2.size)
+            codec, block_size, key_id, nonce_prefix = _HEADER_V2.unpack(body)
+            if codec not in (CODEC_NONE, CODEC_ZLIB):
+                raise DecryptionError(f"不支持的压缩编码: {codec}")
+            return cls(version, key_id, nonce_prefix, preamble + body, codec, block_size)
+        raise DecryptionError(f"不支持的加密格式版本: {version}")
+
+
+class EncryptingWriter:
+    """
+    流式加密写入器（版本2）
+    累积到一个块大小即（压缩并）加密写出，close()写出最后一块、索引并回填索引头
+    compress_level 为None时不压缩；目标文件对象必须可定位
+    """
+
+    def __init__(self, cipher, fileobj, block_size=DEFAULT_BLOCK_SIZE,
+                 compress_level=None, min_gain=DEFAULT_MIN_GAIN):
+        self.cipher = cipher
+        self.fileobj = fileobj
+        self.header = None
+        self.block_size = block_size
+        self.compress_level = compress_level
+        self.min_gain = min_gain
+        self.size = 0
+        self.stored_size = 0
+        self.cpu_time = 0.0
+        self.sha256 = hashlib.sha256()
+        self._buffer = bytearray()
+        self._lengths = []
+        self._trial = None
+        self._closed = False
+        self._start = fileobj.tell()
+
+    def write(self, data):
+        if not data:
+            return
+        self.size += len(data)
+        self.sha256.update(data)
+        self._buffer += data
+        # 保留至少一个字节，确保最后一块总能在close()时带结束标记写出
+        while len(self._buffer) > self.block_size:
+            self._write_block(bytes(self._buffer[:self.block_size]), final=False)
+            del self._buffer[:self.block_size]
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._write_block(bytes(self._buffer), final=True)
+        self._buffer = bytearray()
+        index_offset = self.fileobj.tell() - self._start
+        self.fileobj.write(b''.join(_LENGTH.pack(length) for length in self._lengths))
+        end = self.fileobj.tell()
+        self.fileobj.seek(self._start + len(self.header.raw))
+        self.fileobj.write(_INDEX_HEADER.pack(self.size, len(self._lengths), index_offset))
+        self.fileobj.seek(end)
+
+    def stats(self):
+        """返回压缩率与加密耗时，用于调优压缩参数"""
+        return {
+            'codec': 'zlib' if self.header and self.header.codec == CODEC_ZLIB else 'none',
+            'size': self.size,
+            'stored_size': self.stored_size,
+            'ratio': round(self.stored_size / self.size, 4) if self.size else None,
+            'cpu_ms': round(self.cpu_time * 1000, 3),
+        }
+
+    def _start_file(self, sample):
+        """根据首块的压缩收益选择编码并写出文件头"""
+        codec = CODEC_NONE
+        if self.compress_level is not None and sample:
+            self._trial = zlib.compress(sample, self.compress_level)
+            if 1 - len(self._trial) / len(sample) >= self.min_gain:
+                codec = CODEC_ZLIB
+        self.header = Header.new(self.cipher.key_id, self.block_size, codec)
+        self.fileobj.write(self.header.raw)
+        self.fileobj.write(_INDEX_HEADER.pack(0, 0, 0))
+
+    def _encode(self, data):
+        if self.header.codec == CODEC_NONE:
+            return data
+        # 首块的试压缩结果直接复用
+        compressed = self._trial or zlib.compress(data, self.compress_level)
+        self._trial = None
+        if len(compressed) < len(data):
+            return _BLOCK_COMPRESSED + compressed
+        return _BLOCK_RAW + data
+
+    def _write_block(self, data, final):
+        started = time.thread_time()
+        if self.header is None:
+            self._start_file(data)
+        ciphertext = self.cipher.encrypt_block(self.header, len(self._lengths), self._encode(data), final)
+        self.fileobj.write(ciphertext)
+        self._lengths.append(len(ciphertext))
+        self.stored_size += len(ciphertext)
+        self.cpu_time += time.thread_time() - started
+
+
+class BlockIndex:
+    """版本2文件的索引头与块偏移表"""
+
+    def __init__(self, fileobj, header):
+        self.header = header
+        self.block_size = header.block_size
+        self.size, self.block_count, index_offset = _INDEX_HEADER.unpack(
+            _read_exact(fileobj, _INDEX_HEADER.size))
+        if self.block_count == 0:
+            raise DecryptionError("文件未正常结束写入")
+        fileobj.seek(index_offset)
+        index = _read_exact(fileobj, _LENGTH.size * self.block_count)
+        self.offsets = [len(header.raw) + _INDEX_HEADER.size]
+        for (length,) in _LENGTH.iter_unpack(index):
+            self.offsets.append(self.offsets[-1] + length)
+        if self.offsets[-1] != index_offset:
+            raise DecryptionError("块索引与文件内容不一致")
+
+    def read_block(self, fileobj, cipher, number):
+        """读取并解密指定序号的数据块"""
+        if not 0 <= number < self.block_count:
+            raise DecryptionError(f"块序号越界: {number}")
+        start, end = self.offsets[number], self.offsets[number + 1]
+        fileobj.seek(start)
+        final = number == self.block_count - 1
+        block = cipher.decrypt_block(self.header, number, _read_exact(fileobj, end - start), final)
+        expected = self.size - number * self.block_size if final else self.block_size
+        if self.header.codec == CODEC_ZLIB:
+            block = self._decode(block, expected)
+        if len(block) != expected:
+            raise DecryptionError(f"第{number}块长度与索引头不一致")
+        return block
+
+    @staticmethod
+    def _decode(block, expected):
+        marker, payload = block[:1], block[1:]
+        if marker == _BLOCK_RAW:
+            return payload
+        if marker != _BLOCK_COMPRESSED:
+            raise DecryptionError("未知的块编码标记")
+        decompressor = zlib.decompressobj()
+        try:
+            # 限制解压长度，防止异常数据膨胀
+            data = decompressor.decompress(payload, expected + 1)
+        except zlib.error:
+            raise DecryptionError("块解压失败")
+        if decompressor.unconsumed_tail:
+            raise DecryptionError("块解压后长度超出块大小")
+        return data
+
+
+class EncryptedBlockFile(io.RawIOBase):
+    """
+    版本2加密文件的随机读取视图
+    只读取并解密覆盖当前读取位置的数据块，最近一块保留在内存中
+    """
+
+    def __init__(self, fileobj, keyring):
+        super().__init__()
+        self._f = fileobj
+        fileobj.seek(0)
+        header = Header.read(fileobj)
+        if header.version != VERSION_BLOCKS:
+            raise DecryptionError("该文件不支持随机读取")
+        self.cipher = keyring.cipher_for(header.key_id)
+        self.index = BlockIndex(fileobj, header)
+        self.size = self.index.size
+        self.block_size = self.index.block_size
+        self._pos = 0
+        self._cached = (None, b'')
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError(f"无效的whence参数: {whence}")
+        if pos < 0:
+            raise ValueError("定位位置不能为负数")
+        self._pos = pos
+        return pos
+
+    def readinto(self, buffer):
+        filled = 0
+        while filled < len(buffer) and self._pos < self.size:
+            number = self._pos // self.block_size
+            if self._cached[0] != number:
+                self._cached = (number, self.index.read_block(self._f, self.cipher, number))
+            block = self._cached[1]
+            start = self._pos - number * self.block_size
+            count = min(len(buffer) - filled, len(block) - start)
+            buffer[filled:filled + count] = block[start:start + count]
+            filled += count
+            self._pos += count
+        return filled
+
+    def close(self):
+        if not self.closed:
+            self._f.close()
+        super().close()
+
+
+def plaintext_size(fileobj):
+    """
+    返回版本2文件索引头记录的明文大小，其他格式没有记录，返回None
+    读取后回到文件开头
+    """
+    fileobj.seek(0)
+    try:
+        if not is_chunked(fileobj.read(len(MAGIC))):
+            return None
+        fileobj.seek(0)
+        if Header.read(fileobj).version != VERSION_BLOCKS:
+            return None
+        size, _, _ = _INDEX_HEADER.unpack(_read_exact(fileobj, _INDEX_HEADER.size))
+        return size
+    finally:
+        fileobj.seek(0)
+
+
+def iter_decrypted(keyring, fileobj):
+    """逐块解密分块加密文件，产出明文块"""
+    header = Header.read(fileobj)
+    cipher = keyring.cipher_for(header.key_id)
+    if header.version == VERSION_BLOCKS:
+        index = BlockIndex(fileobj, header)
+        for number in range(index.block_count):
+            block = index.read_block(fileobj, cipher, number)
+            if block:
+                yield block
+        return
+    counter = 0
+    while True:
+        (length,) = _LENGTH.unpack(_read_exact(fileobj, _LENGTH.size))
+        final = bool(length & _FINAL_FLAG)
+        length &= ~_FINAL_FLAG
+        plaintext = cipher.decrypt_block(header, counter, _read_exact(fileobj, length), final)
+        if final:
+            if fileobj.read(1):
+                raise DecryptionError("结束记录之后存在多余数据")
+            return
+        yield plaintext
+        counter += 1
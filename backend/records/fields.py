@@ -0,0 +1,33 @@
+"""
+加密文件字段
+保存文件时按记录所属用户的数据密钥加密
+"""
+
+from django.db import models
+from django.db.models.fields.files import FieldFile
+
+
+class EncryptedFieldFile(FieldFile):
+    """保存前将内容交给存储按所属用户加密"""
+
+    def save(self, name, content, save=True):
+        owner_id = getattr(self.instance, f'{self.field.owner_field}_id', None) if self.field.owner_field else None
+        super().save(name, self.storage.encrypt_for(owner_id, content), save)
+
+
+class EncryptedFileField(models.FileField):
+    """
+    使用加密存储按用户加密的文件字段
+    owner_field 为指向文件所属用户的外键名称
+    """
+    attr_class = EncryptedFieldFile
+
+    def __init__(self, *args, owner_field=None, **kwargs):
+        self.owner_field = owner_field
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.owner_field:
+            kwargs['owner_field'] = self.owner_field
+        return name, path, args, kwargs
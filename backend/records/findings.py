@@ -0,0 +1,139 @@
+"""
+体检异常项目规则模块
+规则以声明式的表格给出：指标、比较方式与阈值，体检报告保存时统一判定一次，
+命中的规则按位写入 findings 位图，最高严重程度写入 severity，两列均有索引；
+读取时只需解码位图，不再逐项重新判断
+规则的 bit 一经使用不可更改或复用，否则已保存的位图含义会改变
+"""
+
+import operator
+from collections import namedtuple
+from decimal import Decimal
+
+from django.db.models import F, Q
+from django.db.models.lookups import Exact
+
+# 严重程度，与 PhysicalExam.Severity 的取值一致
+NONE, MILD, MODERATE = 0, 1, 2
+SEVERITY_NAMES = {MILD: 'mild', MODERATE: 'moderate'}
+
+_OPERATORS = {'>': operator.gt, '<': operator.lt}
+
+# code: 规则标识；bit: 位图中的位置；group: 同组规则按顺序判定，只取第一个命中的；
+# conditions: ((指标, 比较方式, 阈值), ...)，任一成立即命中；指标为 Decimal，小数阈值同样用 Decimal，
+# 避免 Decimal('6.1') > 6.1 这类与二进制浮点数比较的误差；
+# item: 报告中的异常项目；organ: 异常器官展示，为None时不展示
+Rule = namedtuple('Rule', 'code bit group severity conditions item organ')
+
+RULES = (
+    Rule('blood_pressure_high', 0, 'blood_pressure', MODERATE,
+         (('systolic', '>', 140), ('diastolic', '>', 90)),
+         {'name': '高血压',
+          'description': '血压值偏高({blood_pressure} mmHg)，正常范围应小于140/90 mmHg。',
+          'suggestion': '控制饮食，减少盐分摄入，适当运动，心内科随诊。',
+          'position': {'top': 35, 'left': 58}},
+         {'id': 1, 'name': '心脏', 'status': 'danger',
+          'description': '血压偏高({blood_pressure}mmHg)，可能存在高血压风险，建议进一步检查。'}),
+    Rule('blood_pressure_low', 1, 'blood_pressure', MILD,
+         (('systolic', '<', 90), ('diastolic', '<', 60)),
+         {'name': '低血压',
+          'description': '血压值偏低({blood_pressure} mmHg)，正常范围应大于90/60 mmHg。',
+          'suggestion': '多补充水分，适量增加盐分摄入，必要时就医。',
+          'position': {'top': 35, 'left': 58}},
+         {'id': 2, 'name': '心脏', 'status': 'warning',
+          'description': '血压偏低({blood_pressure}mmHg)，注意休息，适量补充水分和盐分。'}),
+    Rule('obesity', 2, 'bmi', MODERATE,
+         (('bmi', '>', 28),),
+         {'name': '肥胖',
+          'description': '体重指数(BMI)为{bmi}，属于肥胖。',
+          'suggestion': '控制饮食，增加运动量，营养科随诊。',
+          'position': {'top': 45, 'left': 50}},
+         {'id': 3, 'name': '肥胖', 'status': 'danger',
+          'description': '体重指数(BMI)为{bmi:.1f}，属于肥胖，建议控制饮食，增加运动。'}),
+    Rule('overweight', 3, 'bmi', MILD,
+         (('bmi', '>', 24),),
+         {'name': '超重',
+          'description': '体重指数(BMI)为{bmi}，属于超重。',
+          'suggestion': '注意饮食健康，适量运动。',
+          'position': {'top': 45, 'left': 50}},
+         {'id': 4, 'name': '超重', 'status': 'warning',
+          'description': '体重指数(BMI)为{bmi:.1f}，属于超重，建议适当控制饮食。'}),
+    Rule('glucose_high', 4, 'blood_glucose', MODERATE,
+         (('blood_glucose', '>', Decimal('6.1')),),
+         {'name': '血糖偏高',
+          'description': '空腹血糖值为{blood_glucose} mmol/L，正常范围为3.9-6.1 mmol/L。',
+          'suggestion': '控制碳水化合物摄入，内分泌科随诊。',
+          'position': {'top': 55, 'left': 45}},
+         None),
+    Rule('glucose_low', 5, 'blood_glucose', MILD,
+         (('blood_glucose', '<', Decimal('3.9')),),
+         {'name': '血糖偏低',
+          'description': '空腹血糖值为{blood_glucose} mmol/L，正常范围为3.9-6.1 mmol/L。',
+          'suggestion': '定时进食，避免空腹。',
+          'position': {'top': 55, 'left': 45}},
+         None),
+    Rule('cholesterol_high', 6, 'cholesterol', MODERATE,
+         (('cholesterol', '>', Decimal('5.2')),),
+         {'name': '胆固醇偏高',
+          'description': '总胆固醇值为{cholesterol} mmol/L，正常范围应小于5.2 mmol/L。',
+          'suggestion': '控制油脂摄入，多食用富含膳食纤维的食物，心内科随诊。',
+          'position': {'top': 45, 'left': 68}},
+         None),
+)
+RULES_BY_CODE = {rule.code: rule for rule in RULES}
+
+
+def _matches(rule, metrics):
+    """缺少的指标（None 或 0，与原先“未填写不判断”一致）不参与判定"""
+    return any(
+        metrics.get(metric) and _OPERATORS[op](metrics[metric], threshold)
+        for metric, op, threshold in rule.conditions
+    )
+
+
+def evaluate(metrics):
+    """
+    按规则表判定一次体检的指标
+    metrics 为 指标名 -> 数值；返回(位图, 最高严重程度)
+    """
+    findings, severity, matched_groups = 0, NONE, set()
+    for rule in RULES:
+        if rule.group in matched_groups or not _matches(rule, metrics):
+            continue
+        matched_groups.add(rule.group)
+        findings |= 1 << rule.bit
+        severity = max(severity, rule.severity)
+    return findings, severity
+
+
+def decode(findings):
+    """位图 -> 命中的规则列表，按规则表顺序"""
+    return [rule for rule in RULES if findings & (1 << rule.bit)]
+
+
+def abnormal_items(findings, values):
+    """报告中的异常项目，values 用于填充描述中的数值"""
+    return [
+        {
+            'name': rule.item['name'],
+            'severity': SEVERITY_NAMES[rule.severity],
+            'description': rule.item['description'].format(**values),
+            'suggestion': rule.item['suggestion'],
+            'position': rule.item['position'],
+        }
+        for rule in decode(findings)
+    ]
+
+
+def abnormal_organs(findings, values):
+    """异常器官展示数据"""
+    return [
+        {**rule.organ, 'description': rule.organ['description'].format(**values)}
+        for rule in decode(findings) if rule.organ
+    ]
+
+
+def finding_filter(code):
+    """命中某条规则的查询条件；findings > 0 使查询可以使用只包含异常体检的部分索引"""
+    bit = 1 << RULES_BY_CODE[code].bit
+    return Q(findings__gt=0) & Q(Exact(F('findings').bitand(bit), bit))
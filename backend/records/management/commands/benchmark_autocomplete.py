@@ -0,0 +1,85 @@
+"""
+药品名称补全基准测试命令
+在回滚的事务中生成全站药品词条，比较内存前缀索引与数据库前缀查询的耗时，并校验结果一致
+用法：
+    python manage.py benchmark_autocomplete --names 20000
+"""
+
+import json
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from records.autocomplete import DrugAutocomplete
+from records.models import NameSuggestion
+from records.suggestions import name_keys, normalize_query, popular_names
+
+STEMS = ['阿莫西林', '布洛芬', '对乙酰氨基酚', '头孢克肟', '阿司匹林', '氯雷他定', '奥美拉唑', '二甲双胍',
+         '硝苯地平', '阿托伐他汀', '左氧氟沙星', '蒙脱石散', '甲硝唑', '维生素C', '复方甘草']
+FORMS = ['片', '胶囊', '颗粒', '口服液', '缓释片', '肠溶片', '分散片', '注射液', '软膏', '滴眼液']
+
+
+class Command(BaseCommand):
+    help = '比较药品名称补全的内存索引与数据库查询耗时'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--names', type=int, default=20000, help='生成的药品名称数')
+        parser.add_argument('--lookups', type=int, default=2000, help='每种查询方式的查询次数')
+        parser.add_argument('--seed', type=int, default=0, help='随机数种子')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        names = {f'{rng.choice(STEMS)}{rng.choice(FORMS)}{i}mg' for i in range(options['names'])}
+        with transaction.atomic():
+            NameSuggestion.objects.bulk_create([
+                NameSuggestion(field=NameSuggestion.Field.DRUG, name=name, pinyin=pinyin, initials=initials,
+                               uses=rng.randint(1, 1000), users=rng.randint(2, 100))
+                for name in names for pinyin, initials in [name_keys(name)]
+            ], batch_size=1000)
+            autocomplete = DrugAutocomplete()
+            started = time.perf_counter()
+            index = autocomplete.index()
+            build_seconds = time.perf_counter() - started
+            # 各种长度的首字母、全拼、汉字前缀
+            queries = []
+            for name in rng.sample(sorted(names), min(len(names), 200)):
+                pinyin, initials = name_keys(name)
+                key = rng.choice([pinyin, initials, name])
+                queries.append(key[:rng.randint(1, len(key))])
+            memory = self._time(lambda query: index.lookup(normalize_query(query), 10), queries, options['lookups'])
+            database = self._time(lambda query: popular_names(NameSuggestion.Field.DRUG, query, 10), queries,
+                                  options['lookups'])
+            identical = all(
+                [entry['uses'] for entry in autocomplete.lookup(query, 10)]
+                == [entry['uses'] for entry in popular_names(NameSuggestion.Field.DRUG, query, 10)]
+                for query in queries
+            )
+            transaction.set_rollback(True)
+
+        report = {
+            'names': len(index),
+            'keys': len(index.entries[0]),
+            'precomputed_prefixes': len(index.top),
+            'build_ms': round(build_seconds * 1000, 1),
+            'memory_us': memory,
+            'database_us': database,
+            'identical': identical,
+        }
+        self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2))
+        if not identical:
+            raise CommandError('内存索引的结果与数据库查询不一致')
+
+    def _time(self, lookup, queries, lookups):
+        latencies = []
+        for i in range(lookups):
+            query = queries[i % len(queries)]
+            started = time.perf_counter()
+            lookup(query)
+            latencies.append(time.perf_counter() - started)
+        return {
+            'p50': round(statistics.median(latencies) * 1e6, 1),
+            'p95': round(statistics.quantiles(latencies, n=20)[-1] * 1e6, 1),
+        }
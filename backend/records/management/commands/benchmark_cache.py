@@ -0,0 +1,144 @@
+"""
+缓存后端基准测试命令
+比较 LocMemCache、FileBasedCache 与共享内存缓存在多进程下的吞吐、延迟、
+跨进程命中率以及并发 incr 丢失的更新数
+用法：
+    python manage.py benchmark_cache --concurrency 1,4,8 --output cache-bench.json
+"""
+
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+
+BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'shared': 'backend.sharedcache.SharedMemoryCache',
+}
+
+_cache = None
+_barrier = None
+
+
+def _init_worker(backend, location, barrier, env):
+    global _cache, _barrier
+    os.environ.update(env)
+    django.setup()
+    from django.utils.module_loading import import_string
+    # 与 CACHES 相同的构造方式；LocMemCache 的 LOCATION 只是进程内的名称
+    _cache = import_string(BACKENDS[backend])(location, {'TIMEOUT': None, 'OPTIONS': {'MAX_ENTRIES': 100000}})
+    _barrier = barrier
+
+
+def _run(worker, workers, operations, value_size):
+    """
+    在工作进程中依次执行 set、get、incr，各阶段之间用屏障同步
+    返回 {操作: (每次耗时列表, 阶段耗时, 命中数)} 与最终计数器值
+    """
+    value = os.urandom(value_size)
+    _cache.add('bench:counter', 0)
+    phases = {}
+    for op in ('set', 'get', 'incr'):
+        _barrier.wait()
+        latencies, hits = [], 0
+        phase_started = time.perf_counter()
+        for i in range(operations):
+            started = time.perf_counter()
+            if op == 'set':
+                _cache.set(f'bench:{worker}:{i}', value)
+            elif op == 'get':
+                # 读取下一个进程写入的键，进程间不共享的后端在多进程下全部未命中
+                hits += _cache.get(f'bench:{(worker + 1) % workers}:{i}') is not None
+            else:
+                _cache.incr('bench:counter')
+            latencies.append(time.perf_counter() - started)
+        phases[op] = (latencies, time.perf_counter() - phase_started, hits)
+    _barrier.wait()
+    return phases, _cache.get('bench:counter')
+
+
+class Command(BaseCommand):
+    help = '比较各缓存后端的多进程吞吐、延迟、跨进程命中率与并发递增的正确性'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backends', default=','.join(BACKENDS), help='后端列表，逗号分隔')
+        parser.add_argument('--concurrency', default='1,4', help='进程数列表，逗号分隔')
+        parser.add_argument('--operations', type=int, default=1000, help='每个进程每种操作的次数')
+        parser.add_argument('--value-size', type=int, default=1024, help='写入值的字节数')
+        parser.add_argument('--output', help='结果JSON文件路径，默认输出到标准输出')
+
+    def handle(self, *args, **options):
+        backends = [backend.strip() for backend in options['backends'].split(',')]
+        if set(backends) - set(BACKENDS):
+            raise CommandError(f"--backends 只支持 {', '.join(BACKENDS)}")
+        levels = [int(level) for level in options['concurrency'].split(',')]
+        env = {'DJANGO_SETTINGS_MODULE': os.getenv('DJANGO_SETTINGS_MODULE', 'backend.settings')}
+
+        results = []
+        for backend in backends:
+            for level in levels:
+                # mkdtemp 创建的目录权限为 0700，满足共享缓存对独占目录的要求
+                directory = tempfile.mkdtemp(prefix='cache-bench-')
+                location = directory
+                try:
+                    barrier = multiprocessing.Barrier(level)
+                    with ProcessPoolExecutor(max_workers=level, initializer=_init_worker,
+                                             initargs=(backend, location, barrier, env)) as pool:
+                        results.extend(self._scenario(pool, backend, level, options))
+                finally:
+                    shutil.rmtree(directory, ignore_errors=True)
+                self.stderr.write(f'{backend} x{level} 完成')
+
+        report = {
+            'environment': {
+                'python': sys.version.split()[0],
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+            },
+            'operations': options['operations'],
+            'value_size': options['value_size'],
+            'results': results,
+        }
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+
+    def _scenario(self, pool, backend, level, options):
+        operations = options['operations']
+        # 进程数与任务数相同，每个进程恰好执行一个任务
+        futures = [pool.submit(_run, worker, level, operations, options['value_size'])
+                   for worker in range(level)]
+        outcomes = [future.result() for future in futures]
+        results = []
+        for op in ('set', 'get', 'incr'):
+            latencies = [latency for phases, _ in outcomes for latency in phases[op][0]]
+            seconds = max(phases[op][1] for phases, _ in outcomes)
+            result = {
+                'backend': backend,
+                'op': op,
+                'concurrency': level,
+                'ops': len(latencies),
+                'ops_per_sec': round(len(latencies) / seconds, 2),
+                'p50_us': round(statistics.median(latencies) * 1e6, 2),
+                'p95_us': round(statistics.quantiles(latencies, n=20)[-1] * 1e6, 2),
+            }
+            if op == 'get':
+                result['hit_ratio'] = round(sum(phases[op][2] for phases, _ in outcomes) / len(latencies), 4)
+            if op == 'incr':
+                # 进程内缓存的计数器互不可见，取各进程读到的最大值
+                result['lost_increments'] = level * operations - max(counter for _, counter in outcomes)
+            results.append(result)
+        return results
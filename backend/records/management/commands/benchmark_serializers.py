@@ -0,0 +1,84 @@
+"""
+列表序列化基准测试命令
+在回滚的事务中生成测试数据，比较 DRF 序列化与编译序列化的耗时，并校验输出一致
+用法：
+    python manage.py benchmark_serializers --rows 10000
+"""
+
+import json
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from records.compiled import CompiledSerializer
+from records.models import MedicalRecord, PhysicalExam
+from records.prefetch import plan_for
+from records.serializers import MedicalRecordSerializer, PhysicalExamSerializer
+
+
+class Command(BaseCommand):
+    help = '比较记录列表的 DRF 序列化与编译序列化耗时'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help='每种记录生成的行数')
+        parser.add_argument('--min-speedup', type=float, default=0, help='序列化阶段加速比低于该值时报错')
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        with transaction.atomic():
+            user = get_user_model().objects.create_user(username='benchmark-serializers')
+            MedicalRecord.objects.bulk_create([
+                MedicalRecord(user=user, hospital='协和', visit_date='2024-01-01',
+                              department='internal', diagnosis='感冒')
+                for _ in range(rows)
+            ])
+            PhysicalExam.objects.bulk_create([
+                PhysicalExam(user=user, exam_date='2024-01-01', height=170 + i % 10,
+                             weight=60 + i % 20, blood_pressure='120/80', heart_rate=70)
+                for i in range(rows)
+            ])
+            results = [
+                self._measure(MedicalRecord, MedicalRecordSerializer, user),
+                self._measure(PhysicalExam, PhysicalExamSerializer, user),
+            ]
+            transaction.set_rollback(True)
+
+        self.stdout.write(json.dumps({'rows': rows, 'results': results}, ensure_ascii=False, indent=2))
+        for result in results:
+            if not result['identical']:
+                raise CommandError(f"{result['model']} 编译序列化输出与 DRF 不一致")
+            if result['serialize_speedup'] < options['min_speedup']:
+                raise CommandError(
+                    f"{result['model']} 序列化加速比 {result['serialize_speedup']} 低于 {options['min_speedup']}")
+
+    def _measure(self, model, serializer_class, user):
+        """分别测量读取与序列化两个阶段，编译路径的收益主要在序列化阶段"""
+        context = {'request': Request(APIRequestFactory().get('/'))}
+        serializer = serializer_class(context=context)
+        queryset = model.objects.filter(user=user)
+
+        started = time.perf_counter()
+        instances = list(plan_for(serializer, model).apply(queryset))
+        drf_fetch = time.perf_counter() - started
+        expected = serializer_class(instances, many=True, context=context).data
+        drf_serialize = time.perf_counter() - started - drf_fetch
+
+        compiled = CompiledSerializer(serializer, model)
+        started = time.perf_counter()
+        rows = list(queryset.values_list(*compiled.columns))
+        compiled_fetch = time.perf_counter() - started
+        data = compiled.render(rows, context)
+        compiled_serialize = time.perf_counter() - started - compiled_fetch
+
+        return {
+            'model': model.__name__,
+            'drf_seconds': {'fetch': round(drf_fetch, 4), 'serialize': round(drf_serialize, 4)},
+            'compiled_seconds': {'fetch': round(compiled_fetch, 4), 'serialize': round(compiled_serialize, 4)},
+            'serialize_speedup': round(drf_serialize / compiled_serialize, 1),
+            'speedup': round((drf_fetch + drf_serialize) / (compiled_fetch + compiled_serialize), 1),
+            'identical': [dict(item) for item in expected] == data,
+        }
@@ -0,0 +1,216 @@
+"""
+加密存储吞吐基准测试命令
+用法：
+    python manage.py benchmark_storage --output bench.json
+    python manage.py benchmark_storage --baseline bench.json --tolerance 0.2
+"""
+
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import django
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+
+from records.contentcache import decrypted_content_cache
+from records.storage import EncryptedFileStorage
+
+SIZE_UNITS = {'K': 1024, 'M': 1024 * 1024}
+
+_storage = None
+
+
+def parse_size(text):
+    """解析 10K、1M 形式的大小"""
+    text = text.strip().upper()
+    if text[-1:] in SIZE_UNITS:
+        return int(float(text[:-1]) * SIZE_UNITS[text[-1]])
+    return int(text)
+
+
+def _init_worker(location, env=None):
+    global _storage
+    if env:
+        # 子进程中恢复与父进程相同的密钥与配置
+        os.environ.update(env)
+        django.setup()
+    _storage = EncryptedFileStorage(location=location)
+
+
+def _drop_page_cache(path):
+    """通知内核丢弃文件的页缓存，模拟冷读"""
+    if hasattr(os, 'posix_fadvise'):
+        with open(path, 'rb') as f:
+            os.fsync(f.fileno())
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def _run_ops(op, size, names, cold=False):
+    """在工作线程或进程中执行一组操作，返回(每次耗时列表, 保存得到的文件名)"""
+    latencies = []
+    saved = []
+    if op == 'open' and cold:
+        decrypted_content_cache.clear(reset_stats=False)
+        for name in names:
+            _drop_page_cache(_storage.path(name))
+    payload = os.urandom(size) if op == 'save' else None
+    for name in names:
+        started = time.perf_counter()
+        if op == 'save':
+            saved.append(_storage.save(name, ContentFile(payload)))
+        elif op == 'open':
+            with _storage.open(name) as f:
+                while f.read(1024 * 1024):
+                    pass
+        elif op == 'exists':
+            _storage.exists(name)
+        else:
+            _storage.size(name)
+        latencies.append(time.perf_counter() - started)
+    return latencies, saved
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def result_key(result):
+    return f"{result['op']}/{result['size']}/{result['mode']}/{result['concurrency']}/{result['cache']}"
+
+
+def compare(results, baseline, tolerance):
+    """与基线比较，返回退化项列表：p95延迟变长或吞吐下降超过容差"""
+    previous = {result_key(item): item for item in baseline.get('results', [])}
+    regressions = []
+    for result in results:
+        old = previous.get(result_key(result))
+        if old is None:
+            continue
+        if result['p95_ms'] > old['p95_ms'] * (1 + tolerance):
+            regressions.append({'key': result_key(result), 'metric': 'p95_ms',
+                                'baseline': old['p95_ms'], 'current': result['p95_ms']})
+        if result['ops_per_sec'] < old['ops_per_sec'] * (1 - tolerance):
+            regressions.append({'key': result_key(result), 'metric': 'ops_per_sec',
+                                'baseline': old['ops_per_sec'], 'current': result['ops_per_sec']})
+    return regressions
+
+
+class Command(BaseCommand):
+    help = '测量加密存储 _save/_open/exists/size 的吞吐、延迟与峰值内存，并可与基线比较'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10K,100K,1M,10M', help='文件大小列表，逗号分隔')
+        parser.add_argument('--concurrency', default='1,4,16,32', help='并发数列表，逗号分隔')
+        parser.add_argument('--modes', default='thread,process', help='并发方式：thread、process')
+        parser.add_argument('--iterations', type=int, default=3, help='每个并发单元执行的操作次数')
+        parser.add_argument('--output', help='结果JSON文件路径，默认输出到标准输出')
+        parser.add_argument('--baseline', help='基线结果JSON文件路径')
+        parser.add_argument('--tolerance', type=float, default=0.2, help='允许的相对退化比例')
+
+    def handle(self, *args, **options):
+        sizes = [parse_size(size) for size in options['sizes'].split(',')]
+        levels = [int(level) for level in options['concurrency'].split(',')]
+        modes = [mode.strip() for mode in options['modes'].split(',')]
+        if set(modes) - {'thread', 'process'}:
+            raise CommandError('--modes 只支持 thread 和 process')
+
+        location = tempfile.mkdtemp(prefix='storage-bench-')
+        # 未配置密钥时由存储生成，子进程需使用同一密钥
+        EncryptedFileStorage(location=location)
+        env = {
+            'FILE_ENCRYPTION_KEY': os.environ['FILE_ENCRYPTION_KEY'],
+            'DJANGO_SETTINGS_MODULE': os.getenv('DJANGO_SETTINGS_MODULE', 'backend.settings'),
+        }
+        results = []
+        try:
+            for mode in modes:
+                for level in levels:
+                    if mode == 'thread':
+                        _init_worker(location)
+                        pool = ThreadPoolExecutor(max_workers=level)
+                    else:
+                        pool = ProcessPoolExecutor(max_workers=level, initializer=_init_worker,
+                                                   initargs=(location, env))
+                    with pool:
+                        for size in sizes:
+                            results.extend(self._scenario(pool, mode, level, size, options['iterations']))
+                    self.stderr.write(f'{mode} x{level} 完成')
+        finally:
+            shutil.rmtree(location, ignore_errors=True)
+            decrypted_content_cache.clear(reset_stats=False)
+
+        report = {
+            'environment': {
+                'python': sys.version.split()[0],
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+            },
+            # Linux下 ru_maxrss 单位为KB
+            'peak_rss_kb': {
+                'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+            },
+            'results': results,
+        }
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as f:
+                report['regressions'] = compare(results, json.load(f), options['tolerance'])
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+        if report.get('regressions'):
+            for item in report['regressions']:
+                self.stderr.write(f"{item['key']} {item['metric']}: {item['baseline']} -> {item['current']}")
+            raise CommandError(f"发现 {len(report['regressions'])} 项性能退化")
+
+    def _scenario(self, pool, mode, level, size, iterations):
+        """在同一并发配置下依次测量保存、冷读、热读、exists 和 size"""
+        prefix = f'bench/{mode}-{level}-{size}'
+        batches = [[f'{prefix}/{worker}-{i}.pdf' for i in range(iterations)] for worker in range(level)]
+        measured, saved = self._measure(pool, 'save', size, batches)
+        results = [self._summarize('save', mode, level, size, 'n/a', *measured)]
+        for cache, cold in (('cold', True), ('warm', False)):
+            measured, _ = self._measure(pool, 'open', size, saved, cold=cold)
+            results.append(self._summarize('open', mode, level, size, cache, *measured))
+        for op in ('exists', 'size'):
+            measured, _ = self._measure(pool, op, size, saved)
+            results.append(self._summarize(op, mode, level, size, 'warm', *measured))
+        return results
+
+    def _measure(self, pool, op, size, batches, cold=False):
+        started = time.perf_counter()
+        futures = [pool.submit(_run_ops, op, size, batch, cold) for batch in batches]
+        latencies, saved = [], []
+        for future in futures:
+            batch_latencies, batch_saved = future.result()
+            latencies.extend(batch_latencies)
+            saved.append(batch_saved)
+        return (latencies, time.perf_counter() - started), saved
+
+    def _summarize(self, op, mode, level, size, cache, latencies, seconds):
+        transferred = size * len(latencies) if op in ('save', 'open') else 0
+        return {
+            'op': op,
+            'size': size,
+            'mode': mode,
+            'concurrency': level,
+            'cache': cache,
+            'ops': len(latencies),
+            'seconds': round(seconds, 4),
+            'ops_per_sec': round(len(latencies) / seconds, 2) if seconds else None,
+            'mb_per_sec': round(transferred / seconds / (1024 * 1024), 2) if seconds and transferred else None,
+            'p50_ms': round(statistics.median(latencies) * 1000, 3),
+            'p95_ms': round(_percentile(latencies, 0.95) * 1000, 3),
+        }
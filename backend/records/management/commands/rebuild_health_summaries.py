@@ -0,0 +1,26 @@
+"""
+健康汇总重建命令
+用法：
+    python manage.py rebuild_health_summaries            # 重建全部用户
+    python manage.py rebuild_health_summaries --user 42  # 只重建指定用户
+"""
+
+from django.core.management.base import BaseCommand
+
+from records.models import HealthSummary
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = '根据明细表重建用户健康汇总，用于上线初始化或校正汇总数据'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='user_ids', help='只重建指定用户ID，可重复')
+
+    def handle(self, *args, **options):
+        user_ids = options['user_ids'] or CustomUser.objects.order_by('pk').values_list('pk', flat=True).iterator()
+        count = 0
+        for user_id in user_ids:
+            HealthSummary.rebuild(user_id)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'已重建 {count} 个用户的健康汇总'))
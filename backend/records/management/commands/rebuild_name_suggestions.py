@@ -0,0 +1,20 @@
+"""
+名称联想词条重建命令
+批量导入（bulk_create、update）不触发信号，导入后需重建词条
+用法：
+    python manage.py rebuild_name_suggestions
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from records import suggestions
+
+
+class Command(BaseCommand):
+    help = '根据就医、用药记录重建医院、医生、药品名称的联想词条'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = suggestions.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'已重建 {count} 条名称联想词条'))
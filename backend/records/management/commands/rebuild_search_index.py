@@ -0,0 +1,25 @@
+"""
+全文检索索引重建命令
+批量导入（bulk_create、update）不触发信号，导入后需重建索引
+用法：
+    python manage.py rebuild_search_index
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from records import search
+
+
+class Command(BaseCommand):
+    help = '根据明细表重建全文检索索引'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='每批写入的记录数')
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            raise CommandError('全文检索索引需要 SQLite FTS5')
+        with transaction.atomic():
+            count = search.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'已重建全文检索索引，共 {count} 条记录'))
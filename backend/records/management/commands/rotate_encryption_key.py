@@ -0,0 +1,118 @@
+"""
+加密文件密钥轮换命令
+用法：
+    FILE_ENCRYPTION_KEY=<新密钥> FILE_ENCRYPTION_OLD_KEYS=<旧密钥> python manage.py rotate_encryption_key
+"""
+
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+
+from records.storage import EncryptedFileStorage
+
+DONE_STATUSES = {'rotated', 'skipped'}
+
+_worker_storage = None
+
+
+def _init_worker(location, env):
+    """子进程初始化：恢复密钥环境变量并创建存储"""
+    global _worker_storage
+    os.environ.update(env)
+    django.setup()
+    _worker_storage = EncryptedFileStorage(location=location)
+
+
+def _rotate(name):
+    try:
+        rotated = _worker_storage.reencrypt_file(name)
+    except Exception as e:
+        # 单个文件失败不影响其他文件，Fernet InvalidToken 等异常没有消息
+        return name, 'failed', str(e) or e.__class__.__name__
+    return name, 'rotated' if rotated else 'skipped', None
+
+
+def load_checkpoint(path):
+    """读取检查点文件，返回已完成的文件名集合"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # 进程被杀死时最后一行可能不完整
+                continue
+            if entry.get('status') in DONE_STATUSES:
+                done.add(entry['name'])
+    return done
+
+
+class Command(BaseCommand):
+    help = '用当前 FILE_ENCRYPTION_KEY 重新包装用户数据密钥，并并行重新加密仍使用旧主密钥的文件，支持中断后续跑'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='并行进程数')
+        parser.add_argument('--checkpoint', help='检查点文件路径，默认位于 MEDIA_ROOT 下并按新密钥区分')
+        parser.add_argument('--prefix', default='physical_exams', help='需要轮换的目录（相对 MEDIA_ROOT）')
+        parser.add_argument('--dry-run', action='store_true', help='只列出待处理文件，不做修改')
+
+    def handle(self, *args, **options):
+        if not os.getenv('FILE_ENCRYPTION_KEY'):
+            raise CommandError('请先设置新的 FILE_ENCRYPTION_KEY，旧密钥放入 FILE_ENCRYPTION_OLD_KEYS')
+        storage = EncryptedFileStorage()
+        if not options['dry_run']:
+            # 用户数据密钥只需重新包装，对应文件不受影响
+            rewrapped = storage.keyring.rewrap_all()
+            self.stdout.write(f'重新包装 {rewrapped} 个用户数据密钥')
+        checkpoint = options['checkpoint'] or os.path.join(
+            storage.location, f'.key_rotation_{storage.cipher.key_id.hex()}.log'
+        )
+        done = load_checkpoint(checkpoint)
+        names = [name for name in self._collect(storage, options['prefix']) if name not in done]
+        self.stdout.write(f'待处理 {len(names)} 个文件，已完成 {len(done)} 个')
+        if options['dry_run'] or not names:
+            for name in names:
+                self.stdout.write(name)
+            return
+
+        env = {
+            'FILE_ENCRYPTION_KEY': os.environ['FILE_ENCRYPTION_KEY'],
+            'FILE_ENCRYPTION_OLD_KEYS': os.getenv('FILE_ENCRYPTION_OLD_KEYS', ''),
+            'DJANGO_SETTINGS_MODULE': os.getenv('DJANGO_SETTINGS_MODULE', 'backend.settings'),
+        }
+        counts = {'rotated': 0, 'skipped': 0, 'failed': 0}
+        with open(checkpoint, 'a', encoding='utf-8') as log, ProcessPoolExecutor(
+            max_workers=max(options['workers'], 1),
+            initializer=_init_worker,
+            initargs=(storage.location, env),
+        ) as pool:
+            futures = [pool.submit(_rotate, name) for name in names]
+            for future in as_completed(futures):
+                name, status, error = future.result()
+                counts[status] += 1
+                # 每完成一个文件立即落盘，中断后从此处继续
+                log.write(json.dumps({'name': name, 'status': status, 'error': error}, ensure_ascii=False) + '\n')
+                log.flush()
+                os.fsync(log.fileno())
+                if error:
+                    self.stderr.write(f'{name}: {error}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f"轮换完成：重新加密 {counts['rotated']} 个，跳过 {counts['skipped']} 个，失败 {counts['failed']} 个"
+        ))
+        if counts['failed']:
+            raise CommandError('部分文件轮换失败，修复后重新运行即可继续')
+
+    def _collect(self, storage, prefix):
+        root = os.path.join(storage.location, prefix)
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.endswith('.encrypted'):
+                    path = os.path.join(dirpath, filename)
+                    yield os.path.relpath(path, storage.location).replace(os.sep, '/')
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+import records.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('records', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttachmentBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True, verbose_name='SHA-256摘要')),
+                ('file', models.FileField(max_length=255, upload_to=records.models.blob_upload_to, verbose_name='文件')),
+                ('size', models.BigIntegerField(verbose_name='文件大小')),
+                ('ref_count', models.PositiveIntegerField(default=0, verbose_name='引用次数')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+            ],
+            options={
+                'verbose_name': '附件内容',
+                'verbose_name_plural': '附件内容',
+            },
+        ),
+        migrations.AddField(
+            model_name='medicalattachment',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='attachments', to='records.attachmentblob', verbose_name='附件内容'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:42
+
+import django.core.validators
+from django.db import migrations
+import records.fields
+import records.models
+import records.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('records', '0003_alter_physicalexam_report_pdf'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='physicalexam',
+            name='report_pdf',
+            field=records.fields.EncryptedFileField(help_text='上传体检报告PDF文件（最大10MB，文件将被加密存储）', owner_field='user', storage=records.storage.get_encrypted_storage, upload_to='physical_exams/%Y/%m/', validators=[django.core.validators.FileExtensionValidator(allowed_extensions=['pdf']), records.models.validate_file_size, records.models.validate_file_name], verbose_name='体检报告PDF'),
+        ),
+    ]
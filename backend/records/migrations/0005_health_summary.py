@@ -0,0 +1,67 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:49
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import OuterRef, Subquery
+
+
+def fill_medication_user(apps, schema_editor):
+    """用关联医疗记录的用户回填用药记录的冗余用户字段"""
+    MedicalRecord = apps.get_model('records', 'MedicalRecord')
+    MedicationRecord = apps.get_model('records', 'MedicationRecord')
+    MedicationRecord.objects.update(
+        user_id=Subquery(MedicalRecord.objects.filter(pk=OuterRef('medical_record_id')).values('user_id')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_userdatakey'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('records', '0004_alter_physicalexam_report_pdf'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HealthSummary',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='health_summary', serialize=False, to=settings.AUTH_USER_MODEL, verbose_name='所属用户')),
+                ('medical_total', models.PositiveIntegerField(default=0, verbose_name='就医记录数')),
+                ('department_counts', models.JSONField(default=dict, verbose_name='各科室就医次数')),
+                ('medication_total', models.PositiveIntegerField(default=0, verbose_name='用药记录数')),
+                ('active_medications', models.PositiveIntegerField(default=0, verbose_name='正在服用的药物数')),
+                ('active_medications_until', models.DateField(blank=True, help_text='正在服用的药物中最早的结束日期，过了这一天需要重新统计', null=True, verbose_name='正在服用数有效期')),
+                ('vaccination_total', models.PositiveIntegerField(default=0, verbose_name='接种记录数')),
+                ('pending_doses', models.PositiveIntegerField(default=0, verbose_name='待接种剂次')),
+                ('exam_total', models.PositiveIntegerField(default=0, verbose_name='体检报告数')),
+                ('latest_exam_date', models.DateField(blank=True, null=True, verbose_name='最近体检日期')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+            ],
+            options={
+                'verbose_name': '健康汇总',
+                'verbose_name_plural': '健康汇总',
+            },
+        ),
+        migrations.AddField(
+            model_name='medicationrecord',
+            name='user',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='medication_records', to=settings.AUTH_USER_MODEL, verbose_name='所属用户'),
+        ),
+        migrations.RunPython(fill_medication_user, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='medicationrecord',
+            name='user',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='medication_records', to=settings.AUTH_USER_MODEL, verbose_name='所属用户'),
+        ),
+        migrations.AddIndex(
+            model_name='medicationrecord',
+            index=models.Index(fields=['user', 'end_date'], name='records_med_user_id_516bb5_idx'),
+        ),
+        migrations.AddField(
+            model_name='healthsummary',
+            name='latest_exam',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='records.physicalexam', verbose_name='最近一次体检'),
+        ),
+    ]
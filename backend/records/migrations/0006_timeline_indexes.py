@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('records', '0005_health_summary'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='medicalrecord',
+            index=models.Index(fields=['user', 'visit_date'], name='records_med_user_id_fd7e99_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='medicationrecord',
+            index=models.Index(fields=['user', 'start_date'], name='records_med_user_id_ea6776_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vaccinationrecord',
+            index=models.Index(fields=['user', 'vaccination_date'], name='records_vac_user_id_24809d_idx'),
+        ),
+    ]
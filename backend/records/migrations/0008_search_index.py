@@ -0,0 +1,124 @@
+import re
+
+from django.db import migrations
+
+# 以下为迁移编写时 records.search 的索引格式快照，迁移不引用会继续演变的运行时模块，
+# 只使用 apps.get_model 提供的历史模型
+TABLE = 'records_search_index'
+BATCH_SIZE = 1000
+
+# 类型 -> (模型, 日期字段, 描述标题字段, 描述详情字段, 标题字段, 正文字段)
+SOURCES = {
+    'medical': ('MedicalRecord', 'visit_date', 'hospital', 'department',
+                ('hospital', 'doctor', 'department'), ('chief_complaint', 'diagnosis', 'treatment', 'notes')),
+    'medication': ('MedicationRecord', 'start_date', 'drug_name', 'dosage', ('drug_name',), ('dosage',)),
+    'physical': ('PhysicalExam', 'exam_date', 'blood_pressure', 'heart_rate', ('blood_pressure',), ()),
+    'vaccination': ('VaccinationRecord', 'vaccination_date', 'vaccine_type', 'dose_number',
+                    ('vaccine_type', 'institution'), ('batch_number',)),
+}
+KINDS = sorted(SOURCES)
+
+_CJK = '぀-ヿ㐀-䶿一-鿿豈-﫿가-힯'
+_TOKEN = re.compile(f'([{_CJK}]+)|([^\\W_{_CJK}]+)')
+
+
+def tokenize(text):
+    """汉字串切分为二元组，末字单独成词；其他按字母数字分词"""
+    tokens = []
+    for cjk, word in _TOKEN.findall(text or ''):
+        if word:
+            tokens.append(word.lower())
+            continue
+        tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+        tokens.append(cjk[-1])
+    return ' '.join(tokens)
+
+
+def field_text(instance, name):
+    field = instance._meta.get_field(name)
+    value = getattr(instance, name)
+    if value is None:
+        return ''
+    if field.choices:
+        return str(dict(field.flatchoices).get(value, value))
+    return str(value)
+
+
+def describe(kind, instance, title_field, detail_field):
+    title, detail = str(getattr(instance, title_field)), str(getattr(instance, detail_field))
+    if kind == 'medical':
+        return f'就医于{title}{field_text(instance, detail_field)}'
+    if kind == 'medication':
+        return f'开始服用{title}（{detail}）'
+    if kind == 'vaccination':
+        return f'接种{field_text(instance, title_field)}第{detail}剂'
+    return f'进行体检，血压{title}，心率{detail}'
+
+
+def document(kind, instance):
+    _, date_field, title_field, detail_field, title_fields, body_fields = SOURCES[kind]
+    summary = describe(kind, instance, title_field, detail_field)
+    title = ' '.join(field_text(instance, name) for name in title_fields)
+    body = ' '.join([summary, *(field_text(instance, name) for name in body_fields)])
+    happened_on = getattr(instance, date_field)
+    return (
+        instance.pk * len(KINDS) + KINDS.index(kind),
+        f'u{instance.user_id}',
+        tokenize(title),
+        tokenize(body),
+        kind,
+        instance.pk,
+        happened_on.isoformat() if happened_on else None,
+        summary,
+    )
+
+
+def fill_search_index(apps, connection):
+    """为已有记录写入索引行，按批插入"""
+    def flush(rows):
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {TABLE} (rowid, owner, title, body, kind, record_id, happened_on, summary) '
+                f'VALUES (%s, %s, %s, %s, %s, %s, %s, %s)',
+                rows,
+            )
+
+    for kind in KINDS:
+        model = apps.get_model('records', SOURCES[kind][0])
+        rows = []
+        for instance in model._base_manager.using(connection.alias).order_by('pk').iterator(chunk_size=BATCH_SIZE):
+            rows.append(document(kind, instance))
+            if len(rows) >= BATCH_SIZE:
+                flush(rows)
+                rows = []
+        flush(rows)
+
+
+def create_search_index(apps, schema_editor):
+    """创建 FTS5 虚拟表并为已有记录建立索引；其他数据库不支持 FTS5，跳过"""
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE {TABLE} USING fts5("
+        "owner, title, body, kind UNINDEXED, record_id UNINDEXED, happened_on UNINDEXED, summary UNINDEXED, "
+        "tokenize = 'unicode61 remove_diacritics 2')"
+    )
+    fill_search_index(apps, schema_editor.connection)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('records', '0007_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
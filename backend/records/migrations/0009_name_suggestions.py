@@ -0,0 +1,92 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:29
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+import re
+from collections import Counter
+
+from pypinyin import Style, lazy_pinyin
+
+# 迁移编写时 records.suggestions 的词条来源与拼音键规则快照，迁移不引用运行时模块
+# 模型 -> ((词条类型, 字段名, 未填写时的默认值), ...)
+SOURCES = {
+    'MedicalRecord': (('hospital', 'hospital', '未知医院'), ('doctor', 'doctor', '未知医生')),
+    'MedicationRecord': (('drug', 'drug_name', None),),
+}
+_NON_KEY = re.compile('[^a-z0-9]')
+
+
+def name_keys(name):
+    """返回(全拼, 首字母)；非汉字部分保留小写字母与数字"""
+    syllables = [_NON_KEY.sub('', syllable.lower()) for syllable in lazy_pinyin(name, style=Style.NORMAL)]
+    syllables = [syllable for syllable in syllables if syllable]
+    return ''.join(syllables), ''.join(syllable[0] for syllable in syllables)
+
+
+def fill_name_suggestions(apps, schema_editor):
+    """根据已有的就医、用药记录生成每个用户与全站的联想词条"""
+    per_user = Counter()
+    for model_name, fields in SOURCES.items():
+        model = apps.get_model('records', model_name)
+        for field, attname, default in fields:
+            rows = model.objects.order_by().values_list('user_id', attname).annotate(uses=models.Count('pk'))
+            for user_id, value, uses in rows:
+                name = (value or '').strip()
+                if name and name != default:
+                    per_user[user_id, field, name] += uses
+    totals, users = Counter(), Counter()
+    for (_, field, name), uses in per_user.items():
+        totals[field, name] += uses
+        users[field, name] += 1
+    keys = {name: name_keys(name) for _, name in totals}
+
+    NameSuggestion = apps.get_model('records', 'NameSuggestion')
+    entries = [
+        NameSuggestion(user_id=user_id, field=field, name=name, pinyin=keys[name][0], initials=keys[name][1], uses=uses)
+        for (user_id, field, name), uses in per_user.items()
+    ] + [
+        NameSuggestion(user_id=None, field=field, name=name, pinyin=keys[name][0], initials=keys[name][1],
+                       uses=uses, users=users[field, name])
+        for (field, name), uses in totals.items()
+    ]
+    NameSuggestion.objects.bulk_create(entries, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('records', '0008_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NameSuggestion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field', models.CharField(choices=[('hospital', '医院'), ('doctor', '医生'), ('drug', '药品')], max_length=10, verbose_name='名称类型')),
+                ('name', models.CharField(max_length=100, verbose_name='名称')),
+                ('pinyin', models.CharField(max_length=255, verbose_name='全拼')),
+                ('initials', models.CharField(max_length=100, verbose_name='拼音首字母')),
+                ('uses', models.PositiveIntegerField(default=0, verbose_name='使用次数')),
+                ('users', models.PositiveIntegerField(default=1, help_text='仅全站汇总有意义', verbose_name='使用人数')),
+                ('user', models.ForeignKey(blank=True, help_text='为空表示全站汇总', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='name_suggestions', to=settings.AUTH_USER_MODEL, verbose_name='所属用户')),
+            ],
+            options={
+                'verbose_name': '名称联想',
+                'verbose_name_plural': '名称联想',
+                'indexes': [models.Index(fields=['user', 'field', 'name'], name='records_nam_user_id_958539_idx'), models.Index(fields=['user', 'field', 'pinyin'], name='records_nam_user_id_4d7cbb_idx'), models.Index(fields=['user', 'field', 'initials'], name='records_nam_user_id_ee0b88_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='namesuggestion',
+            constraint=models.UniqueConstraint(condition=models.Q(('user__isnull', False)), fields=('user', 'field', 'name'), name='unique_user_name_suggestion'),
+        ),
+        migrations.AddConstraint(
+            model_name='namesuggestion',
+            constraint=models.UniqueConstraint(condition=models.Q(('user__isnull', True)), fields=('field', 'name'), name='unique_global_name_suggestion'),
+        ),
+        migrations.RunPython(fill_name_suggestions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:37
+
+import re
+
+from django.db import migrations, models, transaction
+
+BATCH_SIZE = 1000
+# 迁移编写时 records.models.parse_blood_pressure 的规则快照，迁移不引用运行时模块
+BLOOD_PRESSURE_PATTERN = re.compile(r'^\s*(\d{1,3})\s*/\s*(\d{1,3})\s*$')
+
+
+def parse_blood_pressure(value):
+    """解析“收缩压/舒张压”，格式不正确时返回(None, None)"""
+    match = BLOOD_PRESSURE_PATTERN.match(value or '')
+    if not match:
+        return None, None
+    return int(match.group(1)), int(match.group(2))
+
+
+def fill_blood_pressure(apps, schema_editor):
+    """
+    解析已有体检记录的血压字符串写入新列
+    按主键分批读取、批量更新，每批单独提交，不长时间占用写锁
+    """
+    PhysicalExam = apps.get_model('records', 'PhysicalExam')
+    using = schema_editor.connection.alias
+    last_pk = 0
+    while True:
+        batch = list(
+            PhysicalExam.objects.using(using).filter(pk__gt=last_pk).order_by('pk')
+            .only('pk', 'blood_pressure')[:BATCH_SIZE]
+        )
+        if not batch:
+            break
+        for exam in batch:
+            exam.systolic, exam.diastolic = parse_blood_pressure(exam.blood_pressure)
+        with transaction.atomic(using=using):
+            PhysicalExam.objects.using(using).bulk_update(batch, ['systolic', 'diastolic'])
+        last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+    # 回填分批提交，不在一个事务中完成
+    atomic = False
+
+    dependencies = [
+        ('records', '0009_name_suggestions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='physicalexam',
+            name='diastolic',
+            field=models.PositiveSmallIntegerField(blank=True, editable=False, null=True, verbose_name='舒张压(mmHg)'),
+        ),
+        migrations.AddField(
+            model_name='physicalexam',
+            name='systolic',
+            field=models.PositiveSmallIntegerField(blank=True, editable=False, null=True, verbose_name='收缩压(mmHg)'),
+        ),
+        # 先回填再建索引，回填时不必逐行维护索引
+        migrations.RunPython(fill_blood_pressure, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='physicalexam',
+            index=models.Index(fields=['systolic'], name='records_phy_systoli_793040_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='physicalexam',
+            index=models.Index(fields=['diastolic'], name='records_phy_diastol_48339a_idx'),
+        ),
+    ]
@@ -0,0 +1,98 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:41
+
+import operator
+from decimal import Decimal
+
+from django.db import migrations, models, transaction
+
+BATCH_SIZE = 1000
+METRIC_COLUMNS = ('pk', 'systolic', 'diastolic', 'height', 'weight', 'blood_glucose', 'cholesterol')
+
+# 迁移编写时 records.findings 规则表的快照（位、分组、严重程度与阈值），迁移不引用运行时模块；
+# 之后修改规则时，已有记录需要新的数据迁移重新判定
+_OPERATORS = {'>': operator.gt, '<': operator.lt}
+RULES = (
+    (0, 'blood_pressure', 2, (('systolic', '>', 140), ('diastolic', '>', 90))),
+    (1, 'blood_pressure', 1, (('systolic', '<', 90), ('diastolic', '<', 60))),
+    (2, 'bmi', 2, (('bmi', '>', 28),)),
+    (3, 'bmi', 1, (('bmi', '>', 24),)),
+    (4, 'blood_glucose', 2, (('blood_glucose', '>', Decimal('6.1')),)),
+    (5, 'blood_glucose', 1, (('blood_glucose', '<', Decimal('3.9')),)),
+    (6, 'cholesterol', 2, (('cholesterol', '>', Decimal('5.2')),)),
+)
+
+
+def compute_bmi(height, weight):
+    if height and weight:
+        return round(weight / ((height / 100) ** 2), 1)
+    return None
+
+
+def evaluate(metrics):
+    """返回(位图, 最高严重程度)，同组规则只取第一个命中的"""
+    findings, severity, matched_groups = 0, 0, set()
+    for bit, group, rule_severity, conditions in RULES:
+        if group in matched_groups:
+            continue
+        if any(metrics.get(metric) and _OPERATORS[op](metrics[metric], threshold)
+               for metric, op, threshold in conditions):
+            matched_groups.add(group)
+            findings |= 1 << bit
+            severity = max(severity, rule_severity)
+    return findings, severity
+
+
+def fill_findings(apps, schema_editor):
+    """按规则判定已有体检记录，分批更新，每批单独提交"""
+    PhysicalExam = apps.get_model('records', 'PhysicalExam')
+    using = schema_editor.connection.alias
+    last_pk = 0
+    while True:
+        batch = list(
+            PhysicalExam.objects.using(using).filter(pk__gt=last_pk).order_by('pk').only(*METRIC_COLUMNS)[:BATCH_SIZE]
+        )
+        if not batch:
+            break
+        for exam in batch:
+            exam.findings, exam.severity = evaluate({
+                'systolic': exam.systolic,
+                'diastolic': exam.diastolic,
+                'bmi': compute_bmi(exam.height, exam.weight),
+                'blood_glucose': exam.blood_glucose,
+                'cholesterol': exam.cholesterol,
+            })
+        with transaction.atomic(using=using):
+            PhysicalExam.objects.using(using).bulk_update(batch, ['findings', 'severity'])
+        last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+    # 回填分批提交，不在一个事务中完成
+    atomic = False
+
+    dependencies = [
+        ('records', '0010_blood_pressure_columns'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='physicalexam',
+            name='findings',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='异常项目位图'),
+        ),
+        migrations.AddField(
+            model_name='physicalexam',
+            name='severity',
+            field=models.PositiveSmallIntegerField(choices=[(0, '正常'), (1, '轻度异常'), (2, '中度异常')], default=0, editable=False, verbose_name='异常程度'),
+        ),
+        # 先回填再建索引
+        migrations.RunPython(fill_findings, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='physicalexam',
+            index=models.Index(condition=models.Q(('findings__gt', 0)), fields=['findings'], name='records_exam_findings_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='physicalexam',
+            index=models.Index(fields=['user', 'severity'], name='records_phy_user_id_bb5d9d_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:14
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def fill_abnormal_exams(apps, schema_editor):
+    """按 findings > 0 的部分索引统计已有汇总的异常体检数"""
+    HealthSummary = apps.get_model('records', 'HealthSummary')
+    PhysicalExam = apps.get_model('records', 'PhysicalExam')
+    using = schema_editor.connection.alias
+    abnormal = (PhysicalExam.objects.using(using)
+                .filter(user_id=models.OuterRef('user_id'), findings__gt=0)
+                .order_by().values('user_id').annotate(count=models.Count('id')).values('count'))
+    HealthSummary.objects.using(using).update(
+        abnormal_exams=Coalesce(models.Subquery(abnormal), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('records', '0011_exam_findings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='healthsummary',
+            name='abnormal_exams',
+            field=models.PositiveIntegerField(default=0, verbose_name='异常体检数'),
+        ),
+        migrations.RunPython(fill_abnormal_exams, migrations.RunPython.noop),
+    ]
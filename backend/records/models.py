@@ -1,4 +1,6 @@
-from django.db import models
+import hashlib
+from django.db import models, transaction, IntegrityError
+from django.db.models import F
 from django.utils.translation import gettext_lazy as _
 from users.models import CustomUser
 from django.core.validators import FileExtensionValidator
@@ -8,7 +10,9 @@ from datetime import datetime
 from django.contrib.contenttypes.fields import GenericRelation
 from django.contrib.admin.models import LogEntry, ADDITION, CHANGE, DELETION
 import structlog
-from .storage import EncryptedFileStorage
+from .storage import get_encrypted_storage
+from .fields import EncryptedFileField
+from . import findings as finding_rules
 from django.conf import settings
 from django.utils import timezone
 
@@ -82,17 +86,86 @@ class MedicalRecord(models.Model):
         verbose_name = '就医记录'
         verbose_name_plural = verbose_name
         ordering = ['-visit_date']
+        indexes = [
+            models.Index(fields=['user', 'visit_date']),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.hospital} - {self.visit_date}"
 
+def blob_upload_to(instance, filename):
+    """按内容摘要确定附件内容的存储路径"""
+    return f'medical_records/blobs/{instance.digest[:2]}/{instance.digest}'
+
+class AttachmentBlob(models.Model):
+    """
+    内容寻址的附件内容
+    相同内容只存储一份，由引用计数决定何时删除文件
+    文件以明文保存在默认存储，不在主密钥或用户数据密钥的加密范围内
+    """
+    digest = models.CharField('SHA-256摘要', max_length=64, unique=True)
+    file = models.FileField('文件', upload_to=blob_upload_to, max_length=255)
+    size = models.BigIntegerField('文件大小')
+    ref_count = models.PositiveIntegerField('引用次数', default=0)
+    created_at = models.DateTimeField('创建时间', auto_now_add=True)
+
+    class Meta:
+        verbose_name = '附件内容'
+        verbose_name_plural = verbose_name
+
+    def __str__(self):
+        return f"{self.digest[:12]} ({self.ref_count})"
+
+    @classmethod
+    def acquire(cls, content, digest=None):
+        """
+        获取内容对应的存储对象并增加一次引用
+        已存在相同摘要时只增加引用计数，不再写入文件
+        """
+        if digest is None:
+            sha256 = hashlib.sha256()
+            for chunk in content.chunks():
+                sha256.update(chunk)
+            digest = sha256.hexdigest()
+        while True:
+            with transaction.atomic():
+                if cls.objects.filter(digest=digest).update(ref_count=F('ref_count') + 1):
+                    return cls.objects.get(digest=digest)
+            blob = cls(digest=digest, size=content.size, ref_count=1)
+            blob.file.save(digest, content, save=False)
+            try:
+                with transaction.atomic():
+                    blob.save()
+                return blob
+            except IntegrityError:
+                # 并发上传了相同内容，丢弃本次写入的文件后改为增加引用
+                blob.file.delete(save=False)
+
+    def release(self):
+        """释放一次引用，引用归零时在事务提交后删除文件"""
+        with transaction.atomic():
+            AttachmentBlob.objects.filter(pk=self.pk).update(ref_count=F('ref_count') - 1)
+            deleted, _ = AttachmentBlob.objects.filter(pk=self.pk, ref_count=0).delete()
+        if deleted:
+            storage, name = self.file.storage, self.file.name
+            transaction.on_commit(lambda: storage.delete(name))
+
 class MedicalAttachment(models.Model):
     """就医记录附件"""
     record = models.ForeignKey(MedicalRecord, on_delete=models.CASCADE, related_name='attachments')
     name = models.CharField('文件名', max_length=255)
     file = models.FileField('文件', upload_to='medical_records/')
+    blob = models.ForeignKey(
+        AttachmentBlob,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name='attachments',
+        verbose_name='附件内容'
+    )
     size = models.IntegerField('文件大小')
     upload_time = models.DateTimeField('上传时间', auto_now_add=True)
+    updated_at = models.DateTimeField('更新时间', auto_now=True)
 
     class Meta:
         verbose_name = '就医记录附件'
@@ -113,6 +186,14 @@ class MedicationRecord(models.Model):
         related_name='medications',
         verbose_name=_('关联医疗记录')
     )
+    # 冗余的所属用户，始终与关联医疗记录的用户一致，便于按用户查询和汇总
+    user = models.ForeignKey(
+        CustomUser,
+        on_delete=models.CASCADE,
+        related_name='medication_records',
+        verbose_name=_('所属用户'),
+        editable=False
+    )
     # 药物信息
     drug_name = models.CharField(
         max_length=100,
@@ -155,6 +236,10 @@ class MedicationRecord(models.Model):
         null=True,
         verbose_name=_('提醒时间')
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name=_('更新时间')
+    )
 
     class Meta:
         verbose_name = _('用药记录')
@@ -164,10 +249,16 @@ class MedicationRecord(models.Model):
             models.Index(fields=['medical_record']),
             models.Index(fields=['drug_name']),
             models.Index(fields=['start_date', 'end_date']),
+            models.Index(fields=['user', 'end_date']),
+            models.Index(fields=['user', 'start_date']),
         ]
     def __str__(self):
         return f"{self.drug_name} ({self.get_frequency_display()})"
 
+    def save(self, *args, **kwargs):
+        self.user_id = self.medical_record.user_id
+        super().save(*args, **kwargs)
+
     def duration_days(self):
         """计算用药持续天数"""
         if self.end_date:
@@ -220,6 +311,10 @@ class VaccinationRecord(models.Model):
         max_length=50,
         verbose_name=_('疫苗批号')
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name=_('更新时间')
+    )
 
     class Meta:
         verbose_name = _('疫苗接种记录')
@@ -228,15 +323,65 @@ class VaccinationRecord(models.Model):
         indexes = [
             models.Index(fields=['user', 'vaccine_type']),
             models.Index(fields=['vaccination_date']),
+            models.Index(fields=['user', 'vaccination_date']),
         ]
     def __str__(self):
         return f"{self.user}的{self.get_vaccine_type_display()}第{self.dose_number}剂"
 
+# 血压阈值（mmHg）：收缩压或舒张压高于 BLOOD_PRESSURE_HIGH 为偏高，
+# 不偏高时收缩压或舒张压低于 BLOOD_PRESSURE_LOW 为偏低
+BLOOD_PRESSURE_HIGH = (140, 90)
+BLOOD_PRESSURE_LOW = (90, 60)
+BLOOD_PRESSURE_PATTERN = re.compile(r'^\s*(\d{1,3})\s*/\s*(\d{1,3})\s*$')
+
+
+def parse_blood_pressure(value):
+    """解析“收缩压/舒张压”格式的血压，格式不正确时返回(None, None)"""
+    match = BLOOD_PRESSURE_PATTERN.match(value or '')
+    if not match:
+        return None, None
+    return int(match.group(1)), int(match.group(2))
+
+
+def blood_pressure_level(systolic, diastolic):
+    """血压分级：high、low、normal，缺少数值时为None"""
+    if systolic is None or diastolic is None:
+        return None
+    if systolic > BLOOD_PRESSURE_HIGH[0] or diastolic > BLOOD_PRESSURE_HIGH[1]:
+        return 'high'
+    if systolic < BLOOD_PRESSURE_LOW[0] or diastolic < BLOOD_PRESSURE_LOW[1]:
+        return 'low'
+    return 'normal'
+
+
+def blood_pressure_filter(level):
+    """与 blood_pressure_level 对应的查询条件，可以使用收缩压、舒张压索引"""
+    high = models.Q(systolic__gt=BLOOD_PRESSURE_HIGH[0]) | models.Q(diastolic__gt=BLOOD_PRESSURE_HIGH[1])
+    low = models.Q(systolic__lt=BLOOD_PRESSURE_LOW[0]) | models.Q(diastolic__lt=BLOOD_PRESSURE_LOW[1])
+    measured = models.Q(systolic__isnull=False, diastolic__isnull=False)
+    if level == 'high':
+        return high
+    if level == 'low':
+        return low & ~high & measured
+    return ~high & ~low & measured
+
+
+def compute_bmi(height, weight):
+    """由身高(cm)、体重(kg)计算BMI，保留一位小数"""
+    if height and weight:
+        return round(weight / ((height / 100) ** 2), 1)
+    return None
+
 class PhysicalExam(AuditModelMixin, models.Model):
     """
     体检报告模型
     存储用户的定期体检数据
     """
+    class Severity(models.IntegerChoices):
+        NONE = finding_rules.NONE, _('正常')
+        MILD = finding_rules.MILD, _('轻度异常')
+        MODERATE = finding_rules.MODERATE, _('中度异常')
+
     user = models.ForeignKey(
         CustomUser,
         on_delete=models.CASCADE,
@@ -261,6 +406,19 @@ class PhysicalExam(AuditModelMixin, models.Model):
         verbose_name=_('血压(mmHg)'),
         help_text=_('格式：收缩压/舒张压 如：120/80')
     )
+    # 由 blood_pressure 解析，保存时写入，用于按血压范围筛选与统计
+    systolic = models.PositiveSmallIntegerField(
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name=_('收缩压(mmHg)')
+    )
+    diastolic = models.PositiveSmallIntegerField(
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name=_('舒张压(mmHg)')
+    )
     heart_rate = models.PositiveSmallIntegerField(
         verbose_name=_('心率(bpm)')
     )
@@ -279,10 +437,23 @@ class PhysicalExam(AuditModelMixin, models.Model):
         null=True,
         verbose_name=_('总胆固醇(mmol/L)')
     )
+    # 异常项目，保存时按 records.findings 中的规则判定，位图每一位对应一条规则
+    findings = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name=_('异常项目位图')
+    )
+    severity = models.PositiveSmallIntegerField(
+        choices=Severity.choices,
+        default=Severity.NONE,
+        editable=False,
+        verbose_name=_('异常程度')
+    )
     # 报告文件
-    report_pdf = models.FileField(
+    report_pdf = EncryptedFileField(
         upload_to='physical_exams/%Y/%m/',
-        storage=EncryptedFileStorage(),
+        storage=get_encrypted_storage,
+        owner_field='user',
         verbose_name=_('体检报告PDF'),
         help_text=_('上传体检报告PDF文件（最大10MB，文件将被加密存储）'),
         validators=[
@@ -295,6 +466,10 @@ class PhysicalExam(AuditModelMixin, models.Model):
         auto_now_add=True,
         verbose_name=_('上传时间')
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name=_('更新时间')
+    )
 
     class Meta:
         verbose_name = _('体检报告')
@@ -303,14 +478,257 @@ class PhysicalExam(AuditModelMixin, models.Model):
         indexes = [
             models.Index(fields=['user', 'exam_date']),
             models.Index(fields=['created_at']),
+            # 偏高条件为 收缩压 OR 舒张压，两列分别建索引
+            models.Index(fields=['systolic']),
+            models.Index(fields=['diastolic']),
+            # 异常体检通常是少数，部分索引只包含有异常项目的行
+            models.Index(fields=['findings'], condition=models.Q(findings__gt=0), name='records_exam_findings_idx'),
+            models.Index(fields=['user', 'severity']),
         ]
+
+    # 参与异常判定的字段，修改后需要重新判定
+    METRIC_FIELDS = {'blood_pressure', 'height', 'weight', 'blood_glucose', 'cholesterol'}
+
+    def save(self, *args, **kwargs):
+        """结构化的血压列与异常项目随指标一起写入"""
+        self.systolic, self.diastolic = parse_blood_pressure(self.blood_pressure)
+        self.findings, self.severity = finding_rules.evaluate(self.metrics())
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            update_fields = set(update_fields)
+            if 'blood_pressure' in update_fields:
+                update_fields |= {'systolic', 'diastolic'}
+            if update_fields & self.METRIC_FIELDS:
+                update_fields |= {'findings', 'severity'}
+            kwargs['update_fields'] = update_fields
+        super().save(*args, **kwargs)
+
+    def metrics(self):
+        """异常判定与描述使用的指标；通过 objects.create 传入的数值可能仍是字符串"""
+        values = {name: self._meta.get_field(name).to_python(getattr(self, name))
+                  for name in ('height', 'weight', 'blood_glucose', 'cholesterol')}
+        return {
+            'blood_pressure': self.blood_pressure,
+            'systolic': self.systolic,
+            'diastolic': self.diastolic,
+            'bmi': compute_bmi(values['height'], values['weight']),
+            'blood_glucose': values['blood_glucose'],
+            'cholesterol': values['cholesterol'],
+        }
+
+    def abnormal_items(self):
+        """由异常项目位图解码出的报告项目"""
+        return finding_rules.abnormal_items(self.findings, self.metrics())
+
+    def blood_pressure_level(self):
+        return blood_pressure_level(self.systolic, self.diastolic)
+
     def calculate_bmi(self):
         """计算体质指数BMI"""
-        if self.height and self.weight:
-            return round(self.weight / ((self.height/100) ** 2), 1)
-        return None
+        return compute_bmi(self.height, self.weight)
     calculate_bmi.short_description = _('体质指数')
 
     def __str__(self):
         return f"{self.user}的{self.exam_date}体检报告"
 
+
+class HealthSummary(models.Model):
+    """
+    用户健康汇总
+    由记录的保存、删除信号在事务内增量维护，总览接口只需一次主键读取
+    """
+    user = models.OneToOneField(
+        CustomUser,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='health_summary',
+        verbose_name=_('所属用户')
+    )
+    medical_total = models.PositiveIntegerField(_('就医记录数'), default=0)
+    department_counts = models.JSONField(_('各科室就医次数'), default=dict)
+    medication_total = models.PositiveIntegerField(_('用药记录数'), default=0)
+    active_medications = models.PositiveIntegerField(_('正在服用的药物数'), default=0)
+    active_medications_until = models.DateField(
+        _('正在服用数有效期'),
+        null=True,
+        blank=True,
+        help_text=_('正在服用的药物中最早的结束日期，过了这一天需要重新统计')
+    )
+    vaccination_total = models.PositiveIntegerField(_('接种记录数'), default=0)
+    pending_doses = models.PositiveIntegerField(_('待接种剂次'), default=0)
+    exam_total = models.PositiveIntegerField(_('体检报告数'), default=0)
+    abnormal_exams = models.PositiveIntegerField(_('异常体检数'), default=0)
+    latest_exam = models.ForeignKey(
+        PhysicalExam,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+',
+        verbose_name=_('最近一次体检')
+    )
+    latest_exam_date = models.DateField(_('最近体检日期'), null=True, blank=True)
+    updated_at = models.DateTimeField(_('更新时间'), auto_now=True)
+
+    class Meta:
+        verbose_name = _('健康汇总')
+        verbose_name_plural = _('健康汇总')
+
+    def __str__(self):
+        return f"{self.user_id}的健康汇总"
+
+    @classmethod
+    def for_user(cls, user_id, lock=False):
+        """
+        获取用户的汇总，不存在时根据明细表重建
+        返回(汇总, 是否刚重建)；lock为True时锁定该行直到事务结束
+        """
+        queryset = cls.objects.select_for_update() if lock else cls.objects
+        summary = queryset.filter(pk=user_id).first()
+        if summary is not None:
+            return summary, False
+        return cls.rebuild(user_id), True
+
+    @classmethod
+    def current(cls, user_id):
+        """读取用户的汇总；正在服用的药物有已到期的，先重新统计"""
+        summary, _ = cls.for_user(user_id)
+        if summary.is_stale():
+            with transaction.atomic():
+                summary, _ = cls.for_user(user_id, lock=True)
+                summary.refresh_medications()
+                summary.save()
+        return summary
+
+    @classmethod
+    def rebuild(cls, user_id):
+        """根据明细表完整重建用户的汇总"""
+        summary = cls(user_id=user_id)
+        summary.refresh_medical_records()
+        summary.refresh_medications()
+        summary.refresh_vaccinations()
+        summary.refresh_exams()
+        try:
+            with transaction.atomic():
+                summary.save(force_insert=True)
+        except IntegrityError:
+            # 并发请求已创建汇总，改为覆盖
+            summary.save(force_update=True)
+        return summary
+
+    def refresh_medical_records(self):
+        rows = MedicalRecord.objects.filter(user_id=self.user_id).values('department').annotate(count=models.Count('id'))
+        self.department_counts = {row['department']: row['count'] for row in rows}
+        self.medical_total = sum(self.department_counts.values())
+
+    def refresh_medications(self, today=None):
+        """重新统计用药记录；是否正在服用与日期有关，过期后需要再次统计"""
+        today = today or timezone.localdate()
+        active = models.Q(end_date__isnull=True) | models.Q(end_date__gte=today)
+        stats = MedicationRecord.objects.filter(user_id=self.user_id).aggregate(
+            total=models.Count('id'),
+            active=models.Count('id', filter=active),
+            until=models.Min('end_date', filter=active),
+        )
+        self.medication_total = stats['total']
+        self.active_medications = stats['active']
+        self.active_medications_until = stats['until']
+
+    def refresh_vaccinations(self):
+        stats = VaccinationRecord.objects.filter(user_id=self.user_id).aggregate(
+            total=models.Count('id'),
+            pending=models.Count('id', filter=models.Q(next_due_date__isnull=False)),
+        )
+        self.vaccination_total = stats['total']
+        self.pending_doses = stats['pending']
+
+    def refresh_exams(self):
+        stats = PhysicalExam.objects.filter(user_id=self.user_id).aggregate(
+            total=models.Count('id'),
+            abnormal=models.Count('id', filter=models.Q(findings__gt=0)),
+        )
+        self.exam_total = stats['total']
+        self.abnormal_exams = stats['abnormal']
+        self.refresh_latest_exam()
+
+    def refresh_latest_exam(self):
+        """通过 (user, exam_date) 索引取最近一次体检"""
+        latest = (PhysicalExam.objects.filter(user_id=self.user_id)
+                  .order_by('-exam_date', '-id').values_list('id', 'exam_date').first())
+        self.latest_exam_id, self.latest_exam_date = latest or (None, None)
+
+    def is_stale(self, today=None):
+        """正在服用的药物中有已过结束日期的"""
+        today = today or timezone.localdate()
+        return self.active_medications_until is not None and self.active_medications_until < today
+
+    def as_dict(self):
+        return {
+            'medical_records': {
+                'total': self.medical_total,
+                'by_department': [
+                    {'department': department, 'count': count}
+                    for department, count in sorted(self.department_counts.items())
+                ],
+            },
+            'medication_records': {
+                'total': self.medication_total,
+                'active': self.active_medications,
+            },
+            'vaccination_records': {
+                'total': self.vaccination_total,
+                'pending_next_dose': self.pending_doses,
+            },
+            'physical_exams': {
+                'total': self.exam_total,
+                'abnormal': self.abnormal_exams,
+                'latest_exam_id': self.latest_exam_id,
+                'latest_exam_date': self.latest_exam_date,
+            },
+            'updated_at': self.updated_at,
+        }
+
+
+class NameSuggestion(models.Model):
+    """
+    医院、医生、药品名称的联想词条
+    每个用户用过的名称各占一行，user 为空的行是全站汇总；
+    预先计算的全拼与首字母键配合 (user, field, 键) 索引做前缀范围查询
+    """
+    class Field(models.TextChoices):
+        HOSPITAL = 'hospital', _('医院')
+        DOCTOR = 'doctor', _('医生')
+        DRUG = 'drug', _('药品')
+
+    user = models.ForeignKey(
+        CustomUser,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='name_suggestions',
+        verbose_name=_('所属用户'),
+        help_text=_('为空表示全站汇总')
+    )
+    field = models.CharField(_('名称类型'), max_length=10, choices=Field.choices)
+    name = models.CharField(_('名称'), max_length=100)
+    pinyin = models.CharField(_('全拼'), max_length=255)
+    initials = models.CharField(_('拼音首字母'), max_length=100)
+    uses = models.PositiveIntegerField(_('使用次数'), default=0)
+    users = models.PositiveIntegerField(_('使用人数'), default=1, help_text=_('仅全站汇总有意义'))
+
+    class Meta:
+        verbose_name = _('名称联想')
+        verbose_name_plural = _('名称联想')
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'field', 'name'], condition=models.Q(user__isnull=False),
+                                    name='unique_user_name_suggestion'),
+            models.UniqueConstraint(fields=['field', 'name'], condition=models.Q(user__isnull=True),
+                                    name='unique_global_name_suggestion'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'field', 'name']),
+            models.Index(fields=['user', 'field', 'pinyin']),
+            models.Index(fields=['user', 'field', 'initials']),
+        ]
+
+    def __str__(self):
+        return f"{self.get_field_display()}：{self.name}"
@@ -0,0 +1,149 @@
+"""
+键集分页模块
+游标记录上一页最后一行的排序键，翻页代价与页码无关
+"""
+
+import base64
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+DEFAULT_RECORD_PAGINATION = {
+    'PAGE_SIZE': 20,
+    'MAX_PAGE_SIZE': 100,
+}
+
+
+def pagination_setting(name):
+    return getattr(settings, 'RECORD_PAGINATION', {}).get(name, DEFAULT_RECORD_PAGINATION[name])
+
+
+def encode_cursor(position):
+    """将排序键编码为不透明的游标字符串"""
+    data = json.dumps(position, separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """解析游标，格式错误时返回400"""
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        position = json.loads(data)
+    except (ValueError, TypeError):
+        raise ValidationError({'cursor': '无效的分页游标'})
+    if not isinstance(position, list):
+        raise ValidationError({'cursor': '无效的分页游标'})
+    return position
+
+
+def get_page_size(request):
+    """读取 page_size 参数并限制在 1 到 MAX_PAGE_SIZE 之间"""
+    try:
+        size = int(request.query_params.get('page_size', pagination_setting('PAGE_SIZE')))
+    except ValueError:
+        raise ValidationError({'page_size': '必须是整数'})
+    return max(1, min(size, pagination_setting('MAX_PAGE_SIZE')))
+
+
+def keyset_filter(ordering, position):
+    """
+    排在 position 之后的行的条件
+    ordering 为 ('-visit_date', '-id') 形式，按字典序逐项比较
+    """
+    condition = Q()
+    equal = Q()
+    for field, value in zip(ordering, position):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        condition |= equal & Q(**{f'{name}__{lookup}': value})
+        equal &= Q(**{name: value})
+    return condition
+
+
+class KeysetPagination(BasePagination):
+    """
+    记录列表的键集分页
+    按视图的 ordering 排序，最后一项须为唯一字段（通常是id）以保证顺序稳定；
+    游标记录上一页最后一行的排序字段值，翻页期间插入或删除记录不会导致重复或遗漏
+    排序字段不能为空值
+    """
+    cursor_query_param = 'cursor'
+
+    def get_ordering(self, view, queryset):
+        ordering = list(getattr(view, 'ordering', None) or queryset.model._meta.ordering)
+        if not ordering or ordering[-1].lstrip('-') not in ('id', 'pk'):
+            # 补充主键作为平局判定，方向与首个排序字段一致
+            ordering.append('-id' if ordering and ordering[0].startswith('-') else 'id')
+        return ordering
+
+    def _field(self, model, field):
+        name = field.lstrip('-')
+        return model._meta.pk if name == 'pk' else model._meta.get_field(name)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = self.get_ordering(view, queryset)
+        self.page_size = get_page_size(request)
+        model = queryset.model
+        queryset = queryset.order_by(*self.ordering)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            position = decode_cursor(cursor)
+            if len(position) != len(self.ordering):
+                raise ValidationError({'cursor': '无效的分页游标'})
+            try:
+                position = [
+                    self._field(model, field).to_python(value)
+                    for field, value in zip(self.ordering, position)
+                ]
+            except (TypeError, ValueError, DjangoValidationError):
+                raise ValidationError({'cursor': '无效的分页游标'})
+            queryset = queryset.filter(keyset_filter(self.ordering, position))
+
+        names = [field.lstrip('-') for field in self.ordering]
+        if queryset._fields:
+            # values_list() 查询集的行是元组，按列位置取排序键
+            indexes = [queryset._fields.index(name) for name in names]
+            self._position = lambda row: [row[i] for i in indexes]
+        else:
+            self._position = lambda row: [getattr(row, name) for name in names]
+
+        rows = list(queryset[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        position = self._position(self.page[-1])
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, encode_cursor(position))
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {'name': self.cursor_query_param, 'required': False, 'in': 'query',
+             'description': '分页游标，取自上一页的 next', 'schema': {'type': 'string'}},
+            {'name': 'page_size', 'required': False, 'in': 'query',
+             'description': '每页条数', 'schema': {'type': 'integer'}},
+        ]
@@ -0,0 +1,134 @@
+"""
+查询预取规划模块
+遍历序列化器字段，为嵌套的关联对象生成 select_related / prefetch_related，
+使列表接口的查询次数与返回行数无关
+"""
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import serializers
+from rest_framework.relations import ManyRelatedField, RelatedField
+
+# (序列化器类, 模型) -> 预取计划，序列化器字段在运行期间不变，只需分析一次
+_plans = {}
+
+
+class PrefetchPlan:
+    """一个查询集的预取计划：select_related 路径与 prefetch_related 子计划"""
+
+    def __init__(self):
+        self.select = []
+        # (路径, 关联模型, 子计划)，子计划为None时直接按路径预取
+        self.prefetch = []
+        # 稀疏字段集下需要读取的列，None表示读取全部列
+        self.only = None
+
+    def apply(self, queryset, extra_columns=()):
+        if self.only is not None:
+            queryset = queryset.only(*self.only, *extra_columns)
+        if self.select:
+            queryset = queryset.select_related(*self.select)
+        for path, model, plan in self.prefetch:
+            if plan is None:
+                queryset = queryset.prefetch_related(path)
+            else:
+                # 每次构造新的 Prefetch，查询集不在请求之间共享
+                queryset = queryset.prefetch_related(
+                    Prefetch(path, queryset=plan.apply(model._default_manager.all())))
+        return queryset
+
+
+def _walk(model, attrs):
+    """
+    沿 source 的属性链解析关联字段
+    返回(关联路径列表, 终点模型, 是否经过一对多或多对多关系)；遇到非关联属性时停止
+    """
+    path, many = [], False
+    for attr in attrs:
+        try:
+            field = model._meta.get_field(attr)
+        except FieldDoesNotExist:
+            break
+        if not field.is_relation or field.related_model is None:
+            break
+        path.append(attr)
+        many = many or field.one_to_many or field.many_to_many
+        model = field.related_model
+    return path, model, many
+
+
+def _plan(serializer, model, plan, prefix=''):
+    for field in serializer.fields.values():
+        if field.write_only or field.source == '*':
+            continue
+        path, related_model, many = _walk(model, field.source_attrs)
+        if not path:
+            continue
+        lookup = prefix + '__'.join(path)
+        if isinstance(field, serializers.ListSerializer) and many:
+            child = PrefetchPlan()
+            _plan(field.child, related_model, child)
+            plan.prefetch.append((lookup, related_model, child))
+        elif isinstance(field, ManyRelatedField) or many:
+            plan.prefetch.append((lookup, related_model, None))
+        elif isinstance(field, serializers.BaseSerializer):
+            plan.select.append(lookup)
+            _plan(field, related_model, plan, lookup + '__')
+        elif isinstance(field, RelatedField):
+            # 主键字段直接读取外键列，不需要关联查询
+            if not (field.use_pk_only_optimization() and len(field.source_attrs) == 1):
+                plan.select.append(lookup)
+        else:
+            # 形如 source='user.username' 的普通字段
+            plan.select.append(lookup)
+
+
+def _columns(serializer, model):
+    """
+    稀疏字段集需要读取的列
+    计算字段通过 Meta.column_dependencies 声明依赖的列，无法确定时返回None读取全部列
+    """
+    dependencies = getattr(getattr(serializer, 'Meta', None), 'column_dependencies', {})
+    columns = set()
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        if name in dependencies:
+            columns.update(dependencies[name])
+            continue
+        if field.source == '*':
+            return None
+        try:
+            model_field = model._meta.get_field(field.source_attrs[0])
+        except FieldDoesNotExist:
+            return None
+        if model_field.concrete and not model_field.many_to_many:
+            columns.add(model_field.name)
+    return sorted(columns)
+
+
+def plan_for(serializer, model):
+    """返回序列化器实例在指定模型上的预取计划，稀疏字段集按保留的字段分别规划"""
+    sparse = getattr(serializer, 'sparse', False)
+    key = (type(serializer), model, tuple(serializer.fields) if sparse else None)
+    plan = _plans.get(key)
+    if plan is None:
+        plan = PrefetchPlan()
+        _plan(serializer, model, plan)
+        if sparse:
+            plan.only = _columns(serializer, model)
+        _plans[key] = plan
+    return plan
+
+
+class PrefetchPlannerMixin:
+    """
+    视图集混入类
+    按序列化器的嵌套字段自动为查询集加上预取，列表和详情接口都生效；
+    稀疏字段集只读取需要的列，分页排序字段始终读取
+    """
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        ordering = [field.lstrip('-') for field in getattr(self, 'ordering', None) or ()]
+        return plan_for(self.get_serializer(), queryset.model).apply(queryset, ordering)
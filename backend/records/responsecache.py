@@ -0,0 +1,194 @@
+"""
+响应缓存模块
+重量级只读接口的结果按用户缓存在 Django 缓存中，键包含用户的代数计数器；
+用户的任何记录写入都会递增代数，旧代数下的结果不再被读取，失效为O(1)
+同一键的并发未命中只计算一次，其余请求等待计算结果
+"""
+
+import functools
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+DEFAULT_RESPONSE_CACHE = {
+    'ALIAS': 'default',
+    'TIMEOUT': 300,
+    # 计算锁的有效期，同时是等待其他请求计算结果的最长时间
+    'LOCK_TIMEOUT': 10,
+}
+
+# 等待其他进程计算结果时的轮询间隔（秒）
+POLL_INTERVAL = 0.05
+
+
+class ResponseCache:
+    """
+    按用户代数失效的响应缓存
+    进程内同一键的并发未命中由一个线程计算；跨进程通过缓存中的计算锁协调
+    多进程部署时 ALIAS 须指向共享缓存（Redis、Memcached等），代数计数器才能在进程间同步
+    """
+
+    def __init__(self, alias=None, timeout=None, lock_timeout=None):
+        self._alias = alias
+        self._timeout = timeout
+        self._lock_timeout = lock_timeout
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.computations = 0
+        self.compute_seconds = 0.0
+        self.max_compute_seconds = 0.0
+
+    def _setting(self, name):
+        value = getattr(self, f'_{name.lower()}')
+        if value is not None:
+            return value
+        configured = getattr(settings, 'RESPONSE_CACHE', {})
+        return configured.get(name, DEFAULT_RESPONSE_CACHE[name])
+
+    @property
+    def cache(self):
+        return caches[self._setting('ALIAS')]
+
+    def _generation_key(self, user_id):
+        return f'records:generation:{user_id}'
+
+    def generation(self, user_id):
+        """读取用户当前代数"""
+        key = self._generation_key(user_id)
+        value = self.cache.get(key)
+        if value is None:
+            # 计数器丢失（淘汰或重启）时以纳秒时间戳重新开始，不会与旧代数重合
+            self.cache.add(key, time.time_ns(), timeout=None)
+            value = self.cache.get(key)
+        return value
+
+    def invalidate(self, user_id):
+        """递增用户代数，该用户已缓存的结果全部失效"""
+        key = self._generation_key(user_id)
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            self.cache.add(key, time.time_ns(), timeout=None)
+
+    def key(self, user_id, name):
+        digest = hashlib.sha256(name.encode()).hexdigest()[:32]
+        return f'records:response:{user_id}:{self.generation(user_id)}:{digest}'
+
+    def get_or_compute(self, user_id, name, compute):
+        """
+        读取缓存结果，未命中时调用 compute 计算
+        compute 返回None表示结果不可缓存（如错误响应），此时不写入缓存
+        """
+        key = self.key(user_id, name)
+        value = self.cache.get(key)
+        if value is not None:
+            with self._lock:
+                self.hits += 1
+            return value
+
+        with self._lock:
+            self.misses += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = threading.Event()
+        if not leader:
+            # 同进程内已有线程在计算，等待其结果
+            flight.wait(self._setting('LOCK_TIMEOUT'))
+            value = self.cache.get(key)
+            if value is not None:
+                with self._lock:
+                    self.coalesced += 1
+                return value
+            # 领头请求失败或结果不可缓存，自行计算
+            return self._compute(key, compute)
+        try:
+            return self._compute_once(key, compute)
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.set()
+
+    def _compute_once(self, key, compute):
+        """跨进程协调：取得计算锁的进程计算，其余进程轮询结果"""
+        lock_key = f'{key}:lock'
+        lock_timeout = self._setting('LOCK_TIMEOUT')
+        if self.cache.add(lock_key, 1, timeout=lock_timeout):
+            try:
+                return self._compute(key, compute)
+            finally:
+                self.cache.delete(lock_key)
+        deadline = time.monotonic() + lock_timeout
+        while time.monotonic() < deadline:
+            time.sleep(POLL_INTERVAL)
+            value = self.cache.get(key)
+            if value is not None:
+                with self._lock:
+                    self.coalesced += 1
+                return value
+            if self.cache.get(lock_key) is None:
+                break
+        return self._compute(key, compute)
+
+    def _compute(self, key, compute):
+        started = time.perf_counter()
+        value = compute()
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.computations += 1
+            self.compute_seconds += elapsed
+            self.max_compute_seconds = max(self.max_compute_seconds, elapsed)
+        if value is not None:
+            self.cache.set(key, value, timeout=self._setting('TIMEOUT'))
+        return value
+
+    def stats(self):
+        """返回监控用的缓存统计信息，合并等待的请求计为命中"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            served = self.hits + self.coalesced
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'computations': self.computations,
+                'hit_ratio': round(served / lookups, 4) if lookups else None,
+                'compute_ms_total': round(self.compute_seconds * 1000, 3),
+                'compute_ms_avg': round(self.compute_seconds * 1000 / self.computations, 3)
+                if self.computations else None,
+                'compute_ms_max': round(self.max_compute_seconds * 1000, 3),
+            }
+
+
+response_cache = ResponseCache()
+
+
+def cached_response(view_method):
+    """
+    视图动作装饰器：200响应的数据按用户缓存
+    键包含完整URL（含主机名，结果中可能有绝对地址）与当天日期（年龄、进行中用药随日期变化）
+    缓存按请求用户的代数失效，被装饰的动作只能返回请求用户自己的记录（查询集须按用户过滤），
+    否则记录所有者的修改不会使请求用户的缓存失效
+    """
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        responses = []
+
+        def compute():
+            response = view_method(self, request, *args, **kwargs)
+            responses.append(response)
+            return response.data if response.status_code == status.HTTP_200_OK else None
+
+        name = f'{request.build_absolute_uri()}|{timezone.localdate().isoformat()}'
+        data = response_cache.get_or_compute(request.user.pk, name, compute)
+        return responses[0] if responses else Response(data)
+    return wrapper
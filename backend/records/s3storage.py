@@ -0,0 +1,272 @@
+"""
+S3兼容对象存储模块
+多个Web节点共享同一存储桶，不再依赖本地 MEDIA_ROOT
+对象键为 LOCATION 前缀加文件名，upload_to 生成的路径原样作为对象键
+"""
+
+import io
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import Storage
+from django.utils.deconstruct import deconstructible
+
+DEFAULT_S3_SETTINGS = {
+    'BUCKET': '',
+    'LOCATION': '',
+    'ENDPOINT_URL': None,
+    'REGION_NAME': None,
+    'ACCESS_KEY_ID': None,
+    'SECRET_ACCESS_KEY': None,
+    'MAX_POOL_CONNECTIONS': 32,
+    'MULTIPART_THRESHOLD': 8 * 1024 * 1024,
+    'PART_SIZE': 8 * 1024 * 1024,
+    'MAX_CONCURRENCY': 4,
+    'READ_AHEAD': 256 * 1024,
+    # 预签名下载地址的有效期（秒）
+    'URL_EXPIRES': 300,
+}
+
+# S3单次分段上传最多10000段
+MAX_PARTS = 10000
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(options):
+    """
+    返回按连接参数共享的S3客户端
+    客户端线程安全，同一进程内所有请求复用其连接池
+    """
+    key = tuple(options[name] for name in (
+        'ENDPOINT_URL', 'REGION_NAME', 'ACCESS_KEY_ID', 'SECRET_ACCESS_KEY', 'MAX_POOL_CONNECTIONS'))
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            try:
+                import boto3
+                from botocore.config import Config
+            except ImportError:
+                raise ImproperlyConfigured("使用对象存储需要安装 boto3")
+            client = boto3.session.Session().client(
+                's3',
+                endpoint_url=options['ENDPOINT_URL'],
+                region_name=options['REGION_NAME'],
+                aws_access_key_id=options['ACCESS_KEY_ID'],
+                aws_secret_access_key=options['SECRET_ACCESS_KEY'],
+                config=Config(max_pool_connections=options['MAX_POOL_CONNECTIONS'], retries={'mode': 'standard'}),
+            )
+            _clients[key] = client
+        return client
+
+
+def _is_not_found(error):
+    return error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+
+class S3RangeReader(io.RawIOBase):
+    """
+    对象的只读随机访问视图
+    每次缓冲区未命中时发起一次Range GET，至少预读 read_ahead 字节
+    带ETag条件请求，读取期间对象被覆盖时报错而不是混读新旧内容
+    """
+
+    def __init__(self, client, bucket, key, size, etag=None, read_ahead=DEFAULT_S3_SETTINGS['READ_AHEAD']):
+        super().__init__()
+        self._client = client
+        self._bucket = bucket
+        self._key = key
+        self._etag = etag
+        self._read_ahead = read_ahead
+        self.size = size
+        self.requests = 0
+        self._pos = 0
+        self._buffer_start = 0
+        self._buffer = b''
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError(f"无效的whence参数: {whence}")
+        if pos < 0:
+            raise ValueError("定位位置不能为负数")
+        self._pos = pos
+        return pos
+
+    def readinto(self, buffer):
+        filled = 0
+        while filled < len(buffer) and self._pos < self.size:
+            offset = self._pos - self._buffer_start
+            if not 0 <= offset < len(self._buffer):
+                self._fetch(self._pos, max(len(buffer) - filled, self._read_ahead))
+                offset = 0
+                if not self._buffer:
+                    break
+            count = min(len(buffer) - filled, len(self._buffer) - offset)
+            buffer[filled:filled + count] = self._buffer[offset:offset + count]
+            filled += count
+            self._pos += count
+        return filled
+
+    def _fetch(self, start, length):
+        end = min(start + length, self.size) - 1
+        params = {'Bucket': self._bucket, 'Key': self._key, 'Range': f'bytes={start}-{end}'}
+        if self._etag:
+            params['IfMatch'] = self._etag
+        response = self._client.get_object(**params)
+        self.requests += 1
+        with response['Body'] as body:
+            self._buffer = body.read()
+        self._buffer_start = start
+
+
+@deconstructible
+class S3Storage(Storage):
+    """
+    S3兼容对象存储
+    大文件并行分段上传，读取使用Range GET按需获取
+    """
+
+    def __init__(self, options=None, client=None):
+        self._options = options
+        self._client = client
+
+    @property
+    def options(self):
+        return {**DEFAULT_S3_SETTINGS, **getattr(settings, 'S3_STORAGE', {}), **(self._options or {})}
+
+    @property
+    def client(self):
+        return self._client or get_client(self.options)
+
+    @property
+    def bucket(self):
+        bucket = self.options['BUCKET']
+        if not bucket:
+            raise ImproperlyConfigured("S3_STORAGE['BUCKET'] 未配置")
+        return bucket
+
+    def _key(self, name):
+        location = self.options['LOCATION'].strip('/')
+        name = name.replace('\\', '/').lstrip('/')
+        return f'{location}/{name}' if location else name
+
+    def head(self, name):
+        """返回对象元数据，不存在时返回None"""
+        from botocore.exceptions import ClientError
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._key(name))
+        except ClientError as e:
+            if _is_not_found(e):
+                return None
+            raise
+
+    def _open(self, name, mode='rb'):
+        return self.open_reader(name)
+
+    def open_reader(self, name, head=None):
+        """打开对象的随机访问视图"""
+        head = head or self.head(name)
+        if head is None:
+            raise FileNotFoundError(name)
+        return S3RangeReader(
+            self.client, self.bucket, self._key(name), head['ContentLength'],
+            etag=head.get('ETag'), read_ahead=self.options['READ_AHEAD'],
+        )
+
+    def _save(self, name, content):
+        if hasattr(content, 'temporary_file_path'):
+            self.upload_file(name, content.temporary_file_path())
+            return name
+        with tempfile.NamedTemporaryFile(dir=settings.FILE_UPLOAD_TEMP_DIR) as spooled:
+            content.seek(0)
+            shutil.copyfileobj(content, spooled)
+            spooled.flush()
+            self.upload_file(name, spooled.name)
+        return name
+
+    def upload_file(self, name, path):
+        """上传本地文件，超过阈值时并行分段上传"""
+        options = self.options
+        size = os.path.getsize(path)
+        key = self._key(name)
+        if size < options['MULTIPART_THRESHOLD']:
+            with open(path, 'rb') as f:
+                self.client.put_object(Bucket=self.bucket, Key=key, Body=f)
+            return
+        part_size = max(options['PART_SIZE'], -(-size // MAX_PARTS))
+        parts = [
+            (number, offset, min(part_size, size - offset))
+            for number, offset in enumerate(range(0, size, part_size), start=1)
+        ]
+        upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=key)['UploadId']
+
+        def upload_part(part):
+            number, offset, length = part
+            with open(path, 'rb') as f:
+                body = os.pread(f.fileno(), length, offset)
+            response = self.client.upload_part(
+                Bucket=self.bucket, Key=key, UploadId=upload_id, PartNumber=number, Body=body)
+            return {'PartNumber': number, 'ETag': response['ETag']}
+
+        try:
+            with ThreadPoolExecutor(max_workers=options['MAX_CONCURRENCY']) as pool:
+                uploaded = list(pool.map(upload_part, parts))
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket, Key=key, UploadId=upload_id, MultipartUpload={'Parts': uploaded})
+        except BaseException:
+            # 未完成的分段会持续占用存储空间，失败时必须放弃
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+            raise
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(name))
+
+    def exists(self, name):
+        return self.head(name) is not None
+
+    def size(self, name):
+        head = self.head(name)
+        if head is None:
+            raise FileNotFoundError(name)
+        return head['ContentLength']
+
+    def listdir(self, path):
+        prefix = self._key(path).rstrip('/')
+        prefix = f'{prefix}/' if prefix else ''
+        directories, files = [], []
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix, Delimiter='/'):
+            for entry in page.get('CommonPrefixes', []):
+                directories.append(entry['Prefix'][len(prefix):].rstrip('/'))
+            for entry in page.get('Contents', []):
+                files.append(entry['Key'][len(prefix):])
+        return directories, files
+
+    def url(self, name):
+        """对象不经应用服务器提供，返回有时效的预签名GET地址"""
+        return self.client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': self.bucket, 'Key': self._key(name)},
+            ExpiresIn=self.options['URL_EXPIRES'],
+        )
@@ -0,0 +1,187 @@
+"""
+存储巡检模块
+并行校验加密文件的认证标签，并与数据库中的文件引用交叉核对
+读取速度受令牌桶限制，可在业务时间运行
+"""
+
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cryptography.fernet import InvalidToken
+from django.db import connection
+
+from .encryption import DecryptionError
+from .models import AttachmentBlob, MedicalAttachment, PhysicalExam
+
+SCAN_PREFIXES = ('physical_exams', 'medical_records')
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class TokenBucket:
+    """
+    字节令牌桶，所有工作线程共享
+    rate 为每秒允许读取的字节数，为空时不限速
+    """
+
+    def __init__(self, rate=None, burst=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst or rate
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = self.burst or 0
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def consume(self, count):
+        """取走count个令牌，令牌不足时等待补足"""
+        if not self.rate:
+            return
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # 允许透支，等待时间由欠下的令牌决定，保证大块读取也能推进
+            self._tokens -= count
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            self._sleep(wait)
+
+
+class ThrottledFile:
+    """按令牌桶限速读取的文件包装"""
+
+    def __init__(self, fileobj, bucket):
+        self._f = fileobj
+        self._bucket = bucket
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self._f.read(size)
+        self._bucket.consume(len(data))
+        self.bytes_read += len(data)
+        return data
+
+    def seek(self, *args):
+        return self._f.seek(*args)
+
+    def tell(self):
+        return self._f.tell()
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class StorageScrubber:
+    """
+    存储巡检器
+    encrypted_storage 用于解密校验体检报告，plain_storage 为附件所在的默认存储
+    """
+
+    def __init__(self, encrypted_storage, plain_storage, workers=4, rate=None, prefixes=SCAN_PREFIXES):
+        self.encrypted_storage = encrypted_storage
+        self.plain_storage = plain_storage
+        self.workers = workers
+        self.bucket = TokenBucket(rate)
+        self.prefixes = prefixes
+
+    def run(self):
+        """执行一次完整巡检，返回报告字典"""
+        started = time.monotonic()
+        expected = self._referenced_files()
+        on_disk = set(self._walk())
+        report = {
+            'scanned': 0,
+            'bytes_read': 0,
+            'corrupt': [],
+            'size_mismatch': [],
+            'orphans': sorted(name for name in on_disk if name not in expected),
+            'dangling': [],
+        }
+        for name, refs in sorted(expected.items()):
+            if name not in on_disk:
+                report['dangling'].extend({'name': name, **ref} for ref in refs)
+
+        names = sorted(name for name in on_disk if name in expected)
+        with ThreadPoolExecutor(max_workers=max(self.workers, 1)) as pool:
+            for name, size, digest, bytes_read, error in pool.map(self._verify, names):
+                report['scanned'] += 1
+                report['bytes_read'] += bytes_read
+                if error:
+                    report['corrupt'].append({'name': name, 'error': error})
+                    continue
+                for ref in expected[name]:
+                    if ref.get('size') is not None and ref['size'] != size:
+                        report['size_mismatch'].append({'name': name, **ref, 'actual': size})
+                    if ref.get('digest') and ref['digest'] != digest:
+                        report['corrupt'].append({'name': name, 'error': '内容摘要与记录不一致'})
+        report['seconds'] = round(time.monotonic() - started, 3)
+        return report
+
+    def _referenced_files(self):
+        """数据库中引用的文件名 -> 引用列表"""
+        expected = {}
+
+        def add(name, **ref):
+            if name:
+                expected.setdefault(name, []).append(ref)
+
+        for pk, name in PhysicalExam.objects.exclude(report_pdf='').values_list('pk', 'report_pdf').iterator():
+            add(name, model='PhysicalExam', pk=pk)
+        attachments = MedicalAttachment.objects.filter(blob__isnull=True).exclude(file='')
+        for pk, name, size in attachments.values_list('pk', 'file', 'size').iterator():
+            add(name, model='MedicalAttachment', pk=pk, size=size)
+        for pk, name, size, digest in AttachmentBlob.objects.values_list('pk', 'file', 'size', 'digest').iterator():
+            add(name, model='AttachmentBlob', pk=pk, size=size, digest=digest)
+        return expected
+
+    def _walk(self):
+        for prefix in self.prefixes:
+            for storage in {self.encrypted_storage.location: self.encrypted_storage,
+                            self.plain_storage.location: self.plain_storage}.values():
+                root = os.path.join(storage.location, prefix)
+                for dirpath, dirnames, filenames in os.walk(root):
+                    for filename in filenames:
+                        if filename.startswith('.'):
+                            # 密钥轮换等操作的临时文件
+                            continue
+                        path = os.path.join(dirpath, filename)
+                        yield os.path.relpath(path, storage.location).replace(os.sep, '/')
+
+    def _verify(self, name):
+        """
+        流式校验单个文件，返回(文件名, 明文大小, 摘要, 读取字节数, 错误)
+        加密文件逐块校验认证标签，明文只在内存中停留一个块
+        """
+        encrypted = name.endswith('.encrypted')
+        storage = self.encrypted_storage if encrypted else self.plain_storage
+        # 加密文件已由认证标签校验，只有附件内容需要计算摘要与AttachmentBlob核对
+        sha256 = None if encrypted else hashlib.sha256()
+        size = 0
+        f = ThrottledFile(open(storage.path(name), 'rb'), self.bucket)
+        try:
+            with f:
+                if encrypted:
+                    chunks = self.encrypted_storage._iter_plaintext(f)
+                else:
+                    chunks = iter(lambda: f.read(READ_CHUNK_SIZE), b'')
+                for chunk in chunks:
+                    if sha256:
+                        sha256.update(chunk)
+                    size += len(chunk)
+        except (DecryptionError, InvalidToken) as e:
+            return name, size, None, f.bytes_read, str(e) or '认证失败'
+        except OSError as e:
+            return name, size, None, f.bytes_read, f'读取失败: {e}'
+        finally:
+            # 查询用户数据密钥时工作线程会打开自己的数据库连接
+            connection.close()
+        return name, size, sha256 and sha256.hexdigest(), f.bytes_read, None
@@ -0,0 +1,190 @@
+"""
+全文检索模块
+四类记录的文本写入 SQLite FTS5 虚拟表，由保存、删除信号增量维护
+FTS5 的 unicode61 分词器把连续汉字视为一个词，因此中日韩文本在写入前切分为
+重叠的二元组（“高血压” -> “高血 血压 压”），查询按同样的规则切分为短语，
+效果等同于子串匹配；其他文字按字母数字分词，词尾加 * 为前缀查询
+每条索引行的 owner 列为所属用户的标记，用户过滤在索引内完成
+"""
+
+import re
+
+from django.db import connections
+
+from .timeline import TIMELINE_SOURCES, describe
+
+TABLE = 'records_search_index'
+
+# 类型 -> (标题字段, 正文字段)，标题字段在排序中权重更高
+SEARCH_FIELDS = {
+    'medical': (('hospital', 'doctor', 'department'), ('chief_complaint', 'diagnosis', 'treatment', 'notes')),
+    'medication': (('drug_name',), ('dosage',)),
+    'vaccination': (('vaccine_type', 'institution'), ('batch_number',)),
+    'physical': (('blood_pressure',), ()),
+}
+KINDS = sorted(SEARCH_FIELDS)
+
+# bm25 列权重：owner、title、body
+RANK_WEIGHTS = (0.0, 4.0, 1.0)
+
+_CJK = '぀-ヿ㐀-䶿一-鿿豈-﫿가-힯'
+# 连续的中日韩字符，或其他字母数字串
+_TOKEN = re.compile(f'([{_CJK}]+)|([^\\W_{_CJK}]+)')
+
+
+def is_available(using='default'):
+    """FTS5 虚拟表只在 SQLite 上创建"""
+    return connections[using].vendor == 'sqlite'
+
+
+def tokenize(text):
+    """
+    写入索引的分词：汉字串切分为二元组，末字单独成词，单字查询以前缀匹配任意位置
+    返回以空格连接的词串，交给 unicode61 分词器
+    """
+    tokens = []
+    for cjk, word in _TOKEN.findall(text or ''):
+        if word:
+            tokens.append(word.lower())
+            continue
+        tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+        tokens.append(cjk[-1])
+    return ' '.join(tokens)
+
+
+def _quote(token):
+    return '"' + token.replace('"', '""') + '"'
+
+
+def parse_query(query):
+    """
+    把用户输入转换为 FTS5 表达式，空格分隔的各词之间为 AND
+    汉字串转换为二元组短语；单个汉字与带 * 的词为前缀查询
+    没有可检索的词时返回None
+    """
+    parts = []
+    for term in query.split():
+        prefix = term.endswith('*')
+        matches = _TOKEN.findall(term)
+        for index, (cjk, word) in enumerate(matches):
+            last = index == len(matches) - 1
+            if word:
+                parts.append(_quote(word.lower()) + ('*' if prefix and last else ''))
+            elif len(cjk) == 1:
+                parts.append(_quote(cjk) + '*')
+            else:
+                parts.append(_quote(' '.join(cjk[i:i + 2] for i in range(len(cjk) - 1))))
+    return ' AND '.join(parts) or None
+
+
+def _field_text(instance, name):
+    field = instance._meta.get_field(name)
+    value = getattr(instance, name)
+    if value is None:
+        return ''
+    if field.choices:
+        # 选项字段按显示名称检索
+        return str(dict(field.flatchoices).get(value, value))
+    return str(value)
+
+
+def document(kind, instance):
+    """生成一条索引行：(rowid, owner, title, body, kind, record_id, happened_on, summary)"""
+    _, date_field, title_field, detail_field = TIMELINE_SOURCES[kind]
+    title_fields, body_fields = SEARCH_FIELDS[kind]
+    summary = describe(kind, str(getattr(instance, title_field)), str(getattr(instance, detail_field)))
+    title = ' '.join(_field_text(instance, name) for name in title_fields)
+    # 描述文本中的“就医”“接种”“体检”等词同样可以检索
+    body = ' '.join([summary, *(_field_text(instance, name) for name in body_fields)])
+    # 通过 objects.create 传入的日期可能仍是字符串或带时间
+    happened_on = instance._meta.get_field(date_field).to_python(getattr(instance, date_field))
+    return (
+        rowid(kind, instance.pk),
+        f'u{instance.user_id}',
+        tokenize(title),
+        tokenize(body),
+        kind,
+        instance.pk,
+        happened_on.isoformat() if happened_on else None,
+        summary,
+    )
+
+
+def rowid(kind, pk):
+    """类型与主键编码为虚拟表的 rowid，更新和删除按 rowid 定位"""
+    return pk * len(KINDS) + KINDS.index(kind)
+
+
+def index_records(kind, instances, using='default'):
+    """写入或更新索引行"""
+    rows = [document(kind, instance) for instance in instances]
+    if not rows or not is_available(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {TABLE} WHERE rowid = %s', [row[:1] for row in rows])
+        cursor.executemany(
+            f'INSERT INTO {TABLE} (rowid, owner, title, body, kind, record_id, happened_on, summary) '
+            f'VALUES (%s, %s, %s, %s, %s, %s, %s, %s)',
+            rows,
+        )
+
+
+def remove_record(kind, pk, using='default'):
+    if not is_available(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE} WHERE rowid = %s', [rowid(kind, pk)])
+
+
+def rebuild(get_model=None, batch_size=1000, using='default'):
+    """
+    清空并重建整个索引，返回写入的行数
+    get_model 用于迁移中传入历史模型，默认使用当前模型
+    """
+    if not is_available(using):
+        return 0
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE}')
+    count = 0
+    for kind in KINDS:
+        model = TIMELINE_SOURCES[kind][0]
+        if get_model is not None:
+            model = get_model(model._meta.app_label, model.__name__)
+        batch = []
+        for instance in model._base_manager.using(using).order_by('pk').iterator(chunk_size=batch_size):
+            batch.append(instance)
+            if len(batch) >= batch_size:
+                index_records(kind, batch, using)
+                count += len(batch)
+                batch = []
+        index_records(kind, batch, using)
+        count += len(batch)
+    with connections[using].cursor() as cursor:
+        # 合并增量写入产生的索引段
+        cursor.execute(f"INSERT INTO {TABLE} ({TABLE}) VALUES ('optimize')")
+    return count
+
+
+def search(user_id, query, kinds=None, limit=20, offset=0, using='default'):
+    """
+    检索用户的记录，按 bm25 相关度排序
+    返回条目列表，每项含类型、ID、日期、描述与相关度得分（越小越相关）
+    """
+    expression = parse_query(query)
+    if expression is None or not is_available(using):
+        return []
+    kinds = sorted(kinds or KINDS)
+    weights = ', '.join(str(weight) for weight in RANK_WEIGHTS)
+    sql = (
+        f'SELECT kind, record_id, happened_on, summary, bm25({TABLE}, {weights}) AS score '
+        f'FROM {TABLE} WHERE {TABLE} MATCH %s AND kind IN ({", ".join(["%s"] * len(kinds))}) '
+        f'ORDER BY score, rowid DESC LIMIT %s OFFSET %s'
+    )
+    match = f'owner : {_quote(f"u{user_id}")} AND {{title body}} : ({expression})'
+    with connections[using].cursor() as cursor:
+        cursor.execute(sql, [match, *kinds, limit, offset])
+        rows = cursor.fetchall()
+    return [
+        {'type': kind, 'id': pk, 'date': day, 'description': summary, 'score': round(score, 4)}
+        for kind, pk, day, summary, score in rows
+    ]
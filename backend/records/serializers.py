@@ -1,16 +1,50 @@
 from rest_framework import serializers
+from django.urls import reverse
 from django.utils import timezone
 from .models import (
     MedicalRecord,
     MedicationRecord,
     VaccinationRecord,
     PhysicalExam,
-    MedicalAttachment
+    MedicalAttachment,
+    compute_bmi,
+    parse_blood_pressure
 )
 from users.serializers import UserProfileSerializer
 from django.utils.translation import gettext_lazy as _
 
-class MedicationRecordSerializer(serializers.ModelSerializer):
+
+class SparseFieldsetMixin:
+    """
+    稀疏字段集
+    GET请求的 ?fields=a,b 只输出列出的字段；Meta.expandable_fields 中的嵌套字段
+    只在 fields 或 ?expand= 中列出时输出。两个参数都未传时输出全部字段
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sparse = False
+        request = self.context.get('request')
+        if request is None or request.method != 'GET':
+            return
+        params = request.query_params
+        if 'fields' not in params and 'expand' not in params:
+            return
+        requested = {name for name in params.get('fields', '').split(',') if name}
+        expand = {name for name in params.get('expand', '').split(',') if name}
+        expandable = set(getattr(self.Meta, 'expandable_fields', ()))
+        unknown = requested - set(self.fields)
+        if unknown:
+            raise serializers.ValidationError({'fields': f"未知字段：{', '.join(sorted(unknown))}"})
+        if expand - expandable:
+            raise serializers.ValidationError({'expand': f"可展开字段：{', '.join(sorted(expandable)) or '无'}"})
+        keep = (requested or set(self.fields) - expandable) | expand
+        for name in list(self.fields):
+            if name not in keep:
+                self.fields.pop(name)
+        self.sparse = True
+
+class MedicationRecordSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """
     用药记录序列化器
     处理药物信息的创建和更新
@@ -30,6 +64,7 @@ class MedicationRecordSerializer(serializers.ModelSerializer):
         model = MedicationRecord
         fields = '__all__'
         read_only_fields = ('user', 'created_at', 'updated_at')
+        column_dependencies = {'remaining_days': ('end_date',)}
 
     def get_remaining_days(self, obj):
         """计算剩余用药天数"""
@@ -38,6 +73,12 @@ class MedicationRecordSerializer(serializers.ModelSerializer):
             return max(delta.days, 0)
         return None
 
+    @staticmethod
+    def compile_remaining_days(context):
+        """编译序列化路径使用：当天日期只取一次"""
+        today = timezone.now().date()
+        return lambda end_date: max((end_date - today).days, 0) if end_date else None
+
     def validate(self, data):
         """验证日期逻辑"""
         # 结束日期不能早于开始日期
@@ -53,14 +94,14 @@ class MedicationRecordSerializer(serializers.ModelSerializer):
         return data
 
 
-class MedicalAttachmentSerializer(serializers.ModelSerializer):
+class MedicalAttachmentSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """就医记录附件序列化器"""
     class Meta:
         model = MedicalAttachment
         fields = '__all__'
-        read_only_fields = ('user', 'created_at', 'updated_at')
+        read_only_fields = ('user', 'blob', 'created_at', 'updated_at')
 
-class MedicalRecordSerializer(serializers.ModelSerializer):
+class MedicalRecordSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """就医记录序列化器"""
     attachments = MedicalAttachmentSerializer(many=True, read_only=True)
     department_display = serializers.CharField(source='get_department_display', read_only=True)
@@ -69,13 +110,15 @@ class MedicalRecordSerializer(serializers.ModelSerializer):
         model = MedicalRecord
         fields = '__all__'
         read_only_fields = ('user', 'created_at', 'updated_at')
+        expandable_fields = ('attachments',)
+        column_dependencies = {'department_display': ('department',)}
 
     def create(self, validated_data):
         validated_data['user'] = self.context['request'].user
         return super().create(validated_data)
 
 
-class VaccinationRecordSerializer(serializers.ModelSerializer):
+class VaccinationRecordSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """
     疫苗接种记录序列化器
     处理疫苗数据的验证和展示
@@ -92,6 +135,8 @@ class VaccinationRecordSerializer(serializers.ModelSerializer):
         model = VaccinationRecord
         fields = '__all__'
         read_only_fields = ('user', 'created_at', 'updated_at')
+        expandable_fields = ('user',)
+        column_dependencies = {'vaccine_type_display': ('vaccine_type',)}
 
     def validate_dose_number(self, value):
         """验证剂次数值合理性"""
@@ -120,7 +165,7 @@ class VaccinationRecordSerializer(serializers.ModelSerializer):
         validated_data['user'] = request.user
         return super().create(validated_data)
 
-class PhysicalExamSerializer(serializers.ModelSerializer):
+class PhysicalExamSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """
     体检报告序列化器
     处理体检数据的序列化和BMI计算
@@ -130,10 +175,8 @@ class PhysicalExamSerializer(serializers.ModelSerializer):
     bmi = serializers.SerializerMethodField(
         help_text=_('体质指数（自动计算）')
     )
-    # 文件处理
-    report_url = serializers.FileField(
-        source='report_pdf',
-        read_only=True,
+    # 文件处理：报告以密文保存，report_pdf 与 report_url 都指向鉴权后解密读取的下载接口
+    report_url = serializers.SerializerMethodField(
         help_text=_('体检报告下载URL')
     )
     user = UserProfileSerializer(read_only=True)
@@ -142,21 +185,44 @@ class PhysicalExamSerializer(serializers.ModelSerializer):
         model = PhysicalExam
         fields = '__all__'
         read_only_fields = ('user', 'created_at', 'updated_at')
+        expandable_fields = ('user',)
+        column_dependencies = {'bmi': ('height', 'weight'), 'report_url': ('id', 'report_pdf')}
 
     def get_bmi(self, obj):
         """从模型方法获取BMI值"""
         return obj.calculate_bmi()
 
+    @staticmethod
+    def compile_bmi(context):
+        """编译序列化路径使用：直接由身高、体重列计算"""
+        return compute_bmi
+
+    def get_report_url(self, obj):
+        """报告下载接口的地址，没有报告时为None"""
+        return self.compile_report_url(self.context)(obj.pk, obj.report_pdf.name)
+
+    @staticmethod
+    def compile_report_url(context):
+        """编译序列化路径使用：由主键和文件名列生成下载地址"""
+        request = context.get('request')
+
+        def report_url(pk, name):
+            if not name:
+                return None
+            url = reverse('records:physicalexam-download', args=[pk])
+            return request.build_absolute_uri(url) if request is not None else url
+        return report_url
+
     def validate_blood_pressure(self, value):
         """验证血压格式"""
         if not '/' in value:
             raise serializers.ValidationError("血压格式错误，应为'收缩压/舒张压'")
-        try:
-            systolic, diastolic = map(int, value.split('/'))
-            if not (60 <= systolic <= 200 and 40 <= diastolic <= 120):
-                raise serializers.ValidationError("血压数值超出正常范围")
-        except ValueError:
+        # 与保存时写入收缩压、舒张压列使用同一解析规则
+        systolic, diastolic = parse_blood_pressure(value)
+        if systolic is None:
             raise serializers.ValidationError("血压必须是数字")
+        if not (60 <= systolic <= 200 and 40 <= diastolic <= 120):
+            raise serializers.ValidationError("血压数值超出正常范围")
         return value
 
     def validate_exam_date(self, value):
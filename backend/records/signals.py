@@ -0,0 +1,280 @@
+"""
+健康档案信号处理器
+在模型保存、删除时维护派生数据
+"""
+
+from collections import Counter, namedtuple
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from users.models import CustomUser, UserDataKey
+
+from . import search, suggestions
+from .autocomplete import drug_autocomplete
+from .datakeys import shred_notifier
+from .responsecache import response_cache
+from .models import (
+    HealthSummary,
+    MedicalAttachment,
+    MedicalRecord,
+    MedicationRecord,
+    NameSuggestion,
+    PhysicalExam,
+    VaccinationRecord,
+)
+from .timeline import TIMELINE_SOURCES
+
+
+@receiver(post_delete, sender=MedicalAttachment)
+def release_attachment_content(sender, instance, **kwargs):
+    """附件删除（含随就医记录级联删除）后释放其内容引用"""
+    if instance.blob_id:
+        instance.blob.release()
+    elif instance.file:
+        # 去重之前上传的附件独占文件，直接删除
+        instance.file.delete(save=False)
+
+
+@receiver(post_delete, sender=UserDataKey)
+def shred_data_key(sender, instance, **kwargs):
+    """
+    数据密钥删除后所有进程丢弃缓存的密钥和已解密内容，用户文件随即不可读
+    提交后再通知一次：提交前其他进程仍可能读到该密钥并重新缓存
+    """
+    shred_notifier.shred()
+    transaction.on_commit(shred_notifier.shred)
+
+
+# 记录对健康汇总的贡献，保存前后各取一次，差值即为增量
+SummaryState = namedtuple('SummaryState', 'pk user_id value')
+
+
+def _medical_value(instance):
+    return instance.department
+
+
+def _vaccination_value(instance):
+    return instance.next_due_date is not None
+
+
+ExamValue = namedtuple('ExamValue', 'exam_date abnormal')
+
+
+def _exam_value(instance):
+    # 通过 objects.create 传入的日期可能仍是字符串；findings 在模型保存时已判定
+    exam_date = PhysicalExam._meta.get_field('exam_date').to_python(instance.exam_date)
+    return ExamValue(exam_date, instance.findings > 0)
+
+
+def _update_medical(summary, before, after):
+    counts = summary.department_counts
+    for state, sign in ((before, -1), (after, 1)):
+        if state:
+            summary.medical_total += sign
+            counts[state.value] = counts.get(state.value, 0) + sign
+            if not counts[state.value]:
+                del counts[state.value]
+
+
+def _update_vaccination(summary, before, after):
+    for state, sign in ((before, -1), (after, 1)):
+        if state:
+            summary.vaccination_total += sign
+            summary.pending_doses += sign * state.value
+
+
+def _update_medication(summary, before, after):
+    # 是否正在服用取决于当天日期，按用户的(user, end_date)索引重新统计
+    summary.refresh_medications()
+
+
+def _update_exam(summary, before, after):
+    summary.exam_total += (after is not None) - (before is not None)
+    for state, sign in ((before, -1), (after, 1)):
+        if state:
+            summary.abnormal_exams += sign * state.value.abnormal
+    # 删除最近一次体检时外键已被 SET_NULL 置空，同样需要重新查找
+    if before and summary.latest_exam_id in (before.pk, None):
+        summary.refresh_latest_exam()
+    elif after and (summary.latest_exam_date is None
+                    or (after.value.exam_date, after.pk) > (summary.latest_exam_date, summary.latest_exam_id)):
+        summary.latest_exam_id, summary.latest_exam_date = after.pk, after.value.exam_date
+
+
+SUMMARY_SOURCES = {
+    MedicalRecord: (('user_id', 'department'), _medical_value, _update_medical),
+    MedicationRecord: (('user_id',), lambda instance: None, _update_medication),
+    VaccinationRecord: (('user_id', 'next_due_date'), _vaccination_value, _update_vaccination),
+    PhysicalExam: (('user_id', 'exam_date', 'findings'), _exam_value, _update_exam),
+}
+
+
+def _state(sender, instance):
+    value = SUMMARY_SOURCES[sender][1]
+    return SummaryState(instance.pk, instance.user_id, value(instance))
+
+
+def _apply(sender, before, after):
+    """在事务内锁定相关用户的汇总行并应用增量；汇总刚重建时已包含本次变更"""
+    update = SUMMARY_SOURCES[sender][2]
+    for user_id in {state.user_id for state in (before, after) if state}:
+        with transaction.atomic():
+            summary, rebuilt = HealthSummary.for_user(user_id, lock=True)
+            if rebuilt:
+                continue
+            update(
+                summary,
+                before if before and before.user_id == user_id else None,
+                after if after and after.user_id == user_id else None,
+            )
+            summary.save()
+
+
+def remember_summary_state(sender, instance, raw=False, **kwargs):
+    """保存前读取旧值，用于计算增量"""
+    instance._summary_before = None
+    if raw or instance._state.adding or instance.pk is None:
+        return
+    fields = SUMMARY_SOURCES[sender][0]
+    old = sender.objects.filter(pk=instance.pk).only(*fields).first()
+    if old is not None:
+        instance._summary_before = _state(sender, old)
+
+
+def update_summary_on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    _apply(sender, getattr(instance, '_summary_before', None), _state(sender, instance))
+
+
+def update_summary_on_delete(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, CustomUser):
+        # 删除用户时汇总随之级联删除，无需维护
+        return
+    _apply(sender, _state(sender, instance), None)
+
+
+for model in SUMMARY_SOURCES:
+    pre_save.connect(remember_summary_state, sender=model, dispatch_uid=f'summary_pre_save_{model.__name__}')
+    post_save.connect(update_summary_on_save, sender=model, dispatch_uid=f'summary_post_save_{model.__name__}')
+    post_delete.connect(update_summary_on_delete, sender=model, dispatch_uid=f'summary_post_delete_{model.__name__}')
+
+
+def _invalidate(user_id):
+    """
+    递增用户的响应缓存代数：立即递增使本事务内的后续读取不命中旧结果，
+    提交后再递增一次，丢弃并发请求在提交前按旧数据算出的结果
+    """
+    response_cache.invalidate(user_id)
+    transaction.on_commit(lambda: response_cache.invalidate(user_id))
+
+
+def _attachment_owner(instance):
+    try:
+        return instance.record.user_id
+    except MedicalRecord.DoesNotExist:
+        # 随就医记录级联删除时由记录自身的删除信号处理
+        return None
+
+
+# 模型 -> 取记录所属用户ID的函数
+RESPONSE_CACHE_SOURCES = {
+    MedicalRecord: lambda instance: instance.user_id,
+    MedicationRecord: lambda instance: instance.user_id,
+    VaccinationRecord: lambda instance: instance.user_id,
+    PhysicalExam: lambda instance: instance.user_id,
+    MedicalAttachment: _attachment_owner,
+    # 用户档案出现在报告中；新建用户时递增，避免复用的主键命中旧结果
+    CustomUser: lambda instance: instance.pk,
+}
+
+
+def invalidate_response_cache(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    user_id = RESPONSE_CACHE_SOURCES[sender](instance)
+    if user_id is not None:
+        _invalidate(user_id)
+
+
+for model in RESPONSE_CACHE_SOURCES:
+    post_save.connect(invalidate_response_cache, sender=model,
+                      dispatch_uid=f'response_cache_post_save_{model.__name__}')
+    post_delete.connect(invalidate_response_cache, sender=model,
+                        dispatch_uid=f'response_cache_post_delete_{model.__name__}')
+
+
+# 模型 -> 全文检索索引中的类型
+SEARCH_SOURCES = {model: kind for kind, (model, *_) in TIMELINE_SOURCES.items()}
+
+
+def update_search_index(sender, instance, raw=False, using='default', **kwargs):
+    """索引与记录在同一数据库事务中写入，回滚时一并撤销"""
+    if raw:
+        return
+    search.index_records(SEARCH_SOURCES[sender], [instance], using)
+
+
+def remove_from_search_index(sender, instance, using='default', **kwargs):
+    search.remove_record(SEARCH_SOURCES[sender], instance.pk, using)
+
+
+for model in SEARCH_SOURCES:
+    post_save.connect(update_search_index, sender=model, dispatch_uid=f'search_post_save_{model.__name__}')
+    post_delete.connect(remove_from_search_index, sender=model, dispatch_uid=f'search_post_delete_{model.__name__}')
+
+
+def remember_suggestion_names(sender, instance, raw=False, **kwargs):
+    """保存前读取旧名称，用于计算联想词条的增减"""
+    instance._suggestion_before = []
+    if raw or instance._state.adding or instance.pk is None:
+        return
+    fields = [attname for _, attname in suggestions.SUGGESTION_SOURCES[sender]]
+    old = sender.objects.filter(pk=instance.pk).only(*fields).first()
+    if old is not None:
+        instance._suggestion_before = suggestions.source_names(sender, old)
+
+
+def _update_drug_autocomplete(field, name, uses, users):
+    if field == NameSuggestion.Field.DRUG:
+        # 事务提交后再更新本进程的药品补全索引，回滚的名称不会出现在联想中
+        transaction.on_commit(lambda: drug_autocomplete.update(name, uses, users))
+
+
+def _record_suggestion(user_id, field, name, delta):
+    _update_drug_autocomplete(field, name, *suggestions.record_use(user_id, field, name, delta))
+
+
+def update_suggestions_on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    changes = Counter(suggestions.source_names(sender, instance))
+    changes.subtract(getattr(instance, '_suggestion_before', []))
+    for (field, name), delta in changes.items():
+        if delta:
+            _record_suggestion(instance.user_id, field, name, delta)
+
+
+def update_suggestions_on_delete(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, CustomUser):
+        # 用户删除前已由 forget_user 扣除全站汇总
+        return
+    for field, name in suggestions.source_names(sender, instance):
+        _record_suggestion(instance.user_id, field, name, -1)
+
+
+@receiver(pre_delete, sender=CustomUser)
+def forget_user_suggestions(sender, instance, **kwargs):
+    for change in suggestions.forget_user(instance.pk):
+        _update_drug_autocomplete(*change)
+
+
+for model in suggestions.SUGGESTION_SOURCES:
+    pre_save.connect(remember_suggestion_names, sender=model,
+                     dispatch_uid=f'suggestions_pre_save_{model.__name__}')
+    post_save.connect(update_suggestions_on_save, sender=model,
+                      dispatch_uid=f'suggestions_post_save_{model.__name__}')
+    post_delete.connect(update_suggestions_on_delete, sender=model,
+                        dispatch_uid=f'suggestions_post_delete_{model.__name__}')
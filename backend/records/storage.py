@@ -3,21 +3,92 @@
 用于安全存储敏感文件
 """
 
+from django.core.files import File
 from django.core.files.storage import FileSystemStorage
 from django.conf import settings
-from cryptography.fernet import Fernet
+from django.urls import reverse
+from django.utils.module_loading import import_string
+from cryptography.fernet import Fernet, MultiFernet
+import io
 import os
-import base64
-from pathlib import Path
+import tempfile
+import threading
+import structlog
 
-class EncryptedFileStorage(FileSystemStorage):
+from .encryption import (
+    DEFAULT_MIN_GAIN,
+    EncryptedBlockFile,
+    EncryptingWriter,
+    Header,
+    is_chunked,
+    iter_decrypted,
+    Keyring,
+    MAGIC,
+    plaintext_size,
+    VERSION_BLOCKS,
+)
+from .uploadhandlers import EncryptedUploadedFile
+from .contentcache import decrypted_content_cache
+from .datakeys import EnvelopeKeyring, shred_notifier
+from .s3storage import S3Storage
+
+logger = structlog.get_logger(__name__)
+
+# 解密结果超过该大小时落盘到临时文件，避免大文件占用内存
+SPOOL_MAX_SIZE = 1024 * 1024
+
+DEFAULT_COMPRESSION = {
+    'ENABLED': True,
+    'LEVEL': 6,
+    'MIN_GAIN': DEFAULT_MIN_GAIN,
+}
+
+
+class WriteStats:
+    """累计的加密写入统计，用于评估压缩收益与CPU开销"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.files = 0
+        self.compressed_files = 0
+        self.bytes_in = 0
+        self.bytes_stored = 0
+        self.cpu_ms = 0.0
+
+    def record(self, stats):
+        with self._lock:
+            self.files += 1
+            self.compressed_files += stats['codec'] != 'none'
+            self.bytes_in += stats['size']
+            self.bytes_stored += stats['stored_size']
+            self.cpu_ms += stats['cpu_ms']
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'files': self.files,
+                'compressed_files': self.compressed_files,
+                'bytes_in': self.bytes_in,
+                'bytes_stored': self.bytes_stored,
+                'ratio': round(self.bytes_stored / self.bytes_in, 4) if self.bytes_in else None,
+                'cpu_ms': round(self.cpu_ms, 3),
+            }
+
+
+write_stats = WriteStats()
+
+
+class EncryptedStorageMixin:
     """
-    加密文件存储类
-    使用Fernet对称加密算法加密文件内容
+    加密存储的公共逻辑，与底层存储无关
+    新文件先按需压缩，再以分块AES-GCM格式加密为二进制密文，旧的Fernet加密文件仍可读取
+    子类实现 _locate(name)、_open_ciphertext(name, meta) 与 _cache_path(name)
     """
-    
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+
+    def _init_keys(self):
         # 从环境变量获取或生成加密密钥
         key = os.getenv('FILE_ENCRYPTION_KEY')
         if not key:
@@ -25,46 +96,146 @@ class EncryptedFileStorage(FileSystemStorage):
             os.environ['FILE_ENCRYPTION_KEY'] = key.decode()
         else:
             key = key.encode()
-        self.fernet = Fernet(key)
-        
+        # 密钥轮换期间旧密钥仅用于读取，逗号分隔
+        old_keys = [k.strip().encode() for k in os.getenv('FILE_ENCRYPTION_OLD_KEYS', '').split(',') if k.strip()]
+        self.fernet = MultiFernet([Fernet(k) for k in [key] + old_keys])
+        # 主密钥用于包装用户数据密钥，以及加密没有所属用户的文件
+        self.keyring = EnvelopeKeyring(Keyring([key] + old_keys), self.fernet)
+        self.cipher = self.keyring.primary
+
+    def _locate(self, name):
+        """
+        返回(解密内容缓存键, 密文大小, 元数据)
+        缓存键在文件被覆盖后必须改变，元数据原样传给 _open_ciphertext
+        """
+        raise NotImplementedError
+
+    def _open_ciphertext(self, name, meta=None):
+        """打开可定位的密文文件对象"""
+        raise NotImplementedError
+
+    def _cache_path(self, name):
+        """解密内容缓存键的首项，用于按文件丢弃缓存"""
+        raise NotImplementedError
+
+    def open_writer(self, fileobj, cipher=None):
+        """创建按当前压缩配置写入密文的加密写入器，默认使用主密钥"""
+        options = {**DEFAULT_COMPRESSION, **getattr(settings, 'ENCRYPTED_STORAGE_COMPRESSION', {})}
+        return EncryptingWriter(
+            cipher or self.cipher,
+            fileobj,
+            compress_level=options['LEVEL'] if options['ENABLED'] else None,
+            min_gain=options['MIN_GAIN'],
+        )
+
     def _save(self, name, content):
         """
-        重写保存方法，在保存前加密文件内容
-        """
-        # 读取文件内容
-        content.seek(0)
-        file_content = content.read()
-        
-        # 加密内容
-        encrypted_content = self.fernet.encrypt(file_content)
-        
-        # 构建加密文件路径
-        encrypted_name = name + '.encrypted'
-        
-        # 创建目标目录（如果不存在）
-        path = Path(self.path(encrypted_name)).parent
-        path.mkdir(parents=True, exist_ok=True)
-        
-        # 保存加密文件
-        with open(self.path(encrypted_name), 'wb') as f:
-            f.write(encrypted_content)
-            
-        return encrypted_name
-        
+        重写保存方法，逐块压缩加密后再交给底层存储
+        已用本存储可识别的密钥加密的上传文件直接保存密文，不再重复读取
+        """
+        if not (isinstance(content, EncryptedUploadedFile) and self.keyring.knows(content.key_id)):
+            content = EncryptedUploadedFile.encrypt(self, content)
+        try:
+            name = super()._save(name + '.encrypted', content)
+        finally:
+            content.close()
+        if content.encryption_stats:
+            write_stats.record(content.encryption_stats)
+            logger.info("encrypted_file_saved", name=name, **content.encryption_stats)
+        return name
+
+    def encrypt_for(self, owner_id, content):
+        """
+        按所属用户的数据密钥加密内容
+        已用该密钥加密的上传文件原样返回，用其他密钥加密的先解密再重新加密
+        """
+        cipher = self.keyring.cipher_for_user(owner_id)
+        if isinstance(content, EncryptedUploadedFile):
+            if content.key_id == cipher.key_id:
+                return content
+            content.file.seek(0)
+            content = File(EncryptedBlockFile(content.file, self.keyring), content.name)
+        return EncryptedUploadedFile.encrypt(self, content, cipher)
+
     def _open(self, name, mode='rb'):
         """
         重写打开方法，在读取时解密文件内容
+        较小的文件整体解密后放入解密内容缓存，重复打开时直接命中
+        超出缓存上限的新格式文件只在读取时解密覆盖到的数据块
         """
-        # 读取加密文件
-        with open(self.path(name), 'rb') as f:
-            encrypted_content = f.read()
-            
-        # 解密内容
-        decrypted_content = self.fernet.decrypt(encrypted_content)
-        
-        # 创建类文件对象
-        import io
-        return io.BytesIO(decrypted_content)
+        # 其他进程擦除过数据密钥时先丢弃本进程的缓存
+        shred_notifier.sync()
+        key, size, meta = self._locate(name)
+        cached = decrypted_content_cache.get(key)
+        if cached is not None:
+            return File(cached, name)
+        f = self._open_ciphertext(name, meta)
+        try:
+            # 压缩文件的明文可能远大于密文，按索引头记录的明文大小判断；
+            # 其他格式不压缩，密文大小即为明文大小的上限
+            expected = plaintext_size(f)
+        except Exception:
+            f.close()
+            raise
+        if not decrypted_content_cache.accepts(size if expected is None else expected):
+            return self._open_uncached(name, meta, f)
+        with f:
+            buffer = self._decrypt_all(f)
+        return File(decrypted_content_cache.put(key, buffer), name)
+
+    def _decrypt_all(self, f):
+        """将整个文件解密到可清零的缓冲区"""
+        buffer = bytearray()
+        for chunk in self._iter_plaintext(f):
+            buffer += chunk
+        return buffer
+
+    def _iter_plaintext(self, f):
+        """按文件格式逐块产出明文"""
+        is_new_format = is_chunked(f.read(len(MAGIC)))
+        f.seek(0)
+        if is_new_format:
+            yield from iter_decrypted(self.keyring, f)
+        else:
+            # 旧版Fernet格式没有密钥ID，只能依次尝试各密钥
+            yield self.fernet.decrypt(f.read())
+
+    def key_id_of(self, name):
+        """返回文件头记录的密钥ID，旧版Fernet文件返回None"""
+        with self._open_ciphertext(name) as f:
+            if not is_chunked(f.read(len(MAGIC))):
+                return None
+            f.seek(0)
+            return Header.read(f).key_id
+
+    def _open_uncached(self, name, meta=None, f=None):
+        """不经过缓存打开文件，f 为已打开的密文文件对象"""
+        if f is None:
+            f = self._open_ciphertext(name, meta)
+        try:
+            preamble = f.read(len(MAGIC) + 1)
+            if not is_chunked(preamble):
+                # 旧版Fernet整文件加密格式
+                f.seek(0)
+                with f:
+                    return File(io.BytesIO(self.fernet.decrypt(f.read())), name)
+            if preamble[-1] == VERSION_BLOCKS:
+                return File(EncryptedBlockFile(f, self.keyring), name)
+            f.seek(0)
+            with f:
+                decrypted = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, dir=settings.FILE_UPLOAD_TEMP_DIR)
+                for chunk in iter_decrypted(self.keyring, f):
+                    decrypted.write(chunk)
+        except Exception:
+            f.close()
+            raise
+        decrypted.seek(0)
+        return File(decrypted, name)
+
+    def delete(self, name):
+        """删除文件并丢弃其解密缓存"""
+        super().delete(name)
+        decrypted_content_cache.discard(self._cache_path(name))
 
     def get_available_name(self, name, max_length=None):
         """
@@ -72,6 +243,9 @@ class EncryptedFileStorage(FileSystemStorage):
         """
         if name.endswith('.encrypted'):
             name = name[:-10]  # 移除.encrypted后缀
+            if max_length is not None:
+                max_length -= 10
+            return super().get_available_name(name, max_length) + '.encrypted'
         return super().get_available_name(name, max_length)
 
     def exists(self, name):
@@ -93,7 +267,94 @@ class EncryptedFileStorage(FileSystemStorage):
     def url(self, name):
         """
         重写URL生成方法，移除加密文件扩展名
+        存储中只有密文，地址指向鉴权后解密读取的文件下载接口
         """
         if name.endswith('.encrypted'):
             name = name[:-10]
-        return super().url(name) 
\ No newline at end of file
+        return reverse('records:encrypted-file', kwargs={'name': name})
+
+
+class EncryptedFileStorage(EncryptedStorageMixin, FileSystemStorage):
+    """
+    加密文件存储类
+    密文保存在本地 MEDIA_ROOT 下
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._init_keys()
+
+    def _locate(self, name):
+        path = self.path(name)
+        stat = os.stat(path)
+        return (path, stat.st_mtime_ns, stat.st_size), stat.st_size, None
+
+    def _open_ciphertext(self, name, meta=None):
+        return open(self.path(name), 'rb')
+
+    def _cache_path(self, name):
+        return self.path(name)
+
+    def reencrypt_file(self, name):
+        """
+        用当前主密钥重新加密文件，写入同目录临时文件后原子替换
+        已使用主密钥或用户数据密钥（只需重新包装数据密钥）时返回False；
+        读取期间文件被修改或删除时放弃替换并返回False
+        """
+        key_id = self.key_id_of(name)
+        if key_id == self.cipher.key_id or (key_id is not None and key_id not in self.keyring.master):
+            return False
+        path = self.path(name)
+        before = os.stat(path)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.rotate-')
+        try:
+            with os.fdopen(fd, 'w+b') as out, open(path, 'rb') as f:
+                writer = self.open_writer(out)
+                for chunk in self._iter_plaintext(f):
+                    writer.write(chunk)
+                writer.close()
+                out.flush()
+                os.fsync(out.fileno())
+            os.chmod(tmp_path, before.st_mode & 0o7777)
+            try:
+                after = os.stat(path)
+            except FileNotFoundError:
+                after = None
+            if after is None or (after.st_mtime_ns, after.st_size) != (before.st_mtime_ns, before.st_size):
+                os.unlink(tmp_path)
+                return False
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return True
+
+
+class EncryptedS3Storage(EncryptedStorageMixin, S3Storage):
+    """
+    S3兼容对象存储上的加密存储
+    加密语义与 EncryptedFileStorage 相同，多个Web节点共享同一存储桶
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._init_keys()
+
+    def _locate(self, name):
+        head = self.head(name)
+        if head is None:
+            raise FileNotFoundError(name)
+        # 对象被覆盖后ETag改变，旧的缓存内容自然失效
+        return (self._cache_path(name), head['ETag'], head['ContentLength']), head['ContentLength'], head
+
+    def _open_ciphertext(self, name, meta=None):
+        return self.open_reader(name, head=meta)
+
+    def _cache_path(self, name):
+        return f's3://{self.bucket}/{self._key(name)}'
+
+
+def get_encrypted_storage():
+    """按 ENCRYPTED_FILE_STORAGE 配置创建加密存储（本地文件系统或对象存储）"""
+    return import_string(settings.ENCRYPTED_FILE_STORAGE)()
@@ -0,0 +1,202 @@
+"""
+名称联想模块
+医院、医生、药品名称按用户与全站分别计数，保存时预先计算全拼与首字母，
+输入 “xhyy”、“xiehe” 或 “协和” 都能联想到 “协和医院”
+前缀查询转换为索引上的范围条件 (键 >= 前缀 AND 键 < 前缀 + U+10FFFF)，
+不依赖数据库对 LIKE 的索引优化
+"""
+
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q
+from pypinyin import Style, lazy_pinyin
+
+from .models import MedicalRecord, MedicationRecord, NameSuggestion
+
+DEFAULT_NAME_SUGGESTIONS = {
+    'LIMIT': 10,
+    'MAX_LIMIT': 50,
+    # 全站联想只展示至少被这么多用户用过的名称，避免暴露个别用户的就医信息
+    'GLOBAL_MIN_USERS': 2,
+    # 一两个字母的前缀匹配大量全站词条，排序代价高；全站排名变化缓慢，结果缓存一段时间
+    'SHORT_PREFIX_LENGTH': 2,
+    'GLOBAL_CACHE_TIMEOUT': 60,
+}
+
+# 模型 -> ((词条类型, 字段名), ...)
+SUGGESTION_SOURCES = {
+    MedicalRecord: ((NameSuggestion.Field.HOSPITAL, 'hospital'), (NameSuggestion.Field.DOCTOR, 'doctor')),
+    MedicationRecord: ((NameSuggestion.Field.DRUG, 'drug_name'),),
+}
+
+_NON_KEY = re.compile('[^a-z0-9]')
+_HANZI = re.compile('[㐀-鿿豈-﫿]')
+# 前缀范围查询的上界，大于任何合法字符
+_MAX_CHAR = '\U0010ffff'
+
+
+def suggestion_setting(name):
+    configured = getattr(settings, 'NAME_SUGGESTIONS', {})
+    return configured.get(name, DEFAULT_NAME_SUGGESTIONS[name])
+
+
+def name_keys(name):
+    """返回(全拼, 首字母)；非汉字部分保留小写字母与数字"""
+    syllables = [_NON_KEY.sub('', syllable.lower()) for syllable in lazy_pinyin(name, style=Style.NORMAL)]
+    syllables = [syllable for syllable in syllables if syllable]
+    return ''.join(syllables), ''.join(syllable[0] for syllable in syllables)
+
+
+def source_names(sender, instance):
+    """记录贡献的(词条类型, 名称)列表，未填写时的默认值（如“未知医院”）不计入"""
+    names = []
+    for field, attname in SUGGESTION_SOURCES[sender]:
+        value = (getattr(instance, attname) or '').strip()
+        if value and value != sender._meta.get_field(attname).default:
+            names.append((field, value))
+    return names
+
+
+def _adjust(user_id, field, name, uses, users):
+    """调整一个词条的使用次数与人数，返回调整前的(使用次数, 使用人数)；次数降为0时删除词条"""
+    entries = NameSuggestion.objects.select_for_update().filter(user_id=user_id, field=field, name=name)
+    entry = entries.first()
+    if entry is None:
+        if uses <= 0:
+            return 0, 0
+        pinyin, initials = name_keys(name)
+        try:
+            with transaction.atomic():
+                NameSuggestion.objects.create(user_id=user_id, field=field, name=name, pinyin=pinyin,
+                                              initials=initials, uses=uses, users=max(users, 1))
+            return 0, 0
+        except IntegrityError:
+            # 并发请求已创建该词条
+            entry = entries.get()
+    if entry.uses + uses <= 0:
+        entry.delete()
+    else:
+        entries.update(uses=F('uses') + uses, users=F('users') + users)
+    return entry.uses, entry.users
+
+
+def record_use(user_id, field, name, delta):
+    """
+    用户的一个名称使用次数变化 delta，同时更新全站汇总的次数与人数
+    返回全站汇总更新后的(使用次数, 使用人数)
+    """
+    with transaction.atomic():
+        before = _adjust(user_id, field, name, delta, 0)[0]
+        after = max(before + delta, 0)
+        users = (after > 0) - (before > 0)
+        total, total_users = _adjust(None, field, name, delta, users)
+    return max(total + delta, 0), max(total_users + users, 0)
+
+
+def forget_user(user_id):
+    """
+    用户删除前从全站汇总中扣除其贡献，用户自己的词条随用户级联删除
+    返回全站汇总更新后的 [(词条类型, 名称, 使用次数, 使用人数)]
+    """
+    changes = []
+    with transaction.atomic():
+        for field, name, uses in NameSuggestion.objects.filter(user_id=user_id).values_list('field', 'name', 'uses'):
+            total, total_users = _adjust(None, field, name, -uses, -1)
+            changes.append((field, name, max(total - uses, 0), max(total_users - 1, 0)))
+    return changes
+
+
+def normalize_query(query):
+    """查询对应的前缀：含汉字时为名称本身，否则为小写字母数字"""
+    query = query.strip()
+    return query if _HANZI.search(query) else _NON_KEY.sub('', query.lower())
+
+
+def _prefix(column, prefix):
+    return Q(**{f'{column}__gte': prefix, f'{column}__lt': prefix + _MAX_CHAR})
+
+
+def matching(queryset, query):
+    """含汉字时按名称前缀匹配，否则按全拼或首字母前缀匹配"""
+    key = normalize_query(query)
+    if _HANZI.search(key):
+        return queryset.filter(_prefix('name', key))
+    if not key:
+        return queryset.none()
+    return queryset.filter(_prefix('pinyin', key) | _prefix('initials', key))
+
+
+def popular_names(field, query, count):
+    """全站使用人数达到下限的名称，按使用次数倒序取前 count 个"""
+    entries = NameSuggestion.objects.filter(
+        field=field, user__isnull=True, users__gte=suggestion_setting('GLOBAL_MIN_USERS'))
+    return list(matching(entries, query).order_by('-uses', 'name').values('name', 'uses')[:count])
+
+
+def suggest(user_id, field, query, limit):
+    """
+    返回用户自己用过的与全站常用的名称，各按使用次数倒序取前 limit 个
+    全站结果不重复用户已有的名称
+    """
+    entries = NameSuggestion.objects.filter(field=field, user_id=user_id)
+    mine = list(matching(entries, query).order_by('-uses', 'name').values('name', 'uses')[:limit])
+    # 多取出与用户结果等量的名称，去重后仍有 limit 个
+    count = limit + len(mine)
+    key = normalize_query(query)
+    if field == NameSuggestion.Field.DRUG:
+        # 药品名称由进程内的前缀索引回答，不查询数据库；延迟导入避免循环依赖
+        from .autocomplete import drug_autocomplete
+        popular = drug_autocomplete.lookup(query, count)
+    elif len(key) <= suggestion_setting('SHORT_PREFIX_LENGTH'):
+        # 缓存最大可能需要的数量，不同 limit 共用
+        count = 2 * suggestion_setting('MAX_LIMIT')
+        cache_key = f'suggestions:global:{field}:{key}'
+        popular = cache.get(cache_key)
+        if popular is None:
+            popular = popular_names(field, query, count)
+            cache.set(cache_key, popular, suggestion_setting('GLOBAL_CACHE_TIMEOUT'))
+    else:
+        popular = popular_names(field, query, count)
+    names = {entry['name'] for entry in mine}
+    return {'user': mine, 'global': [entry for entry in popular if entry['name'] not in names][:limit]}
+
+
+def rebuild(get_model=None):
+    """
+    清空并根据明细表重建全部词条，返回词条数
+    get_model 用于迁移中传入历史模型，默认使用当前模型
+    """
+    def resolve(model):
+        return get_model(model._meta.app_label, model.__name__) if get_model else model
+
+    per_user = Counter()
+    for sender, fields in SUGGESTION_SOURCES.items():
+        for field, attname in fields:
+            default = sender._meta.get_field(attname).default
+            rows = resolve(sender).objects.order_by().values_list('user_id', attname).annotate(uses=Count('pk'))
+            for user_id, value, uses in rows:
+                name = (value or '').strip()
+                if name and name != default:
+                    per_user[user_id, str(field), name] += uses
+    totals, users = Counter(), Counter()
+    for (_, field, name), uses in per_user.items():
+        totals[field, name] += uses
+        users[field, name] += 1
+    keys = {name: name_keys(name) for _, name in totals}
+
+    Suggestion = resolve(NameSuggestion)
+    Suggestion.objects.all().delete()
+    entries = [
+        Suggestion(user_id=user_id, field=field, name=name, pinyin=keys[name][0], initials=keys[name][1], uses=uses)
+        for (user_id, field, name), uses in per_user.items()
+    ] + [
+        Suggestion(user_id=None, field=field, name=name, pinyin=keys[name][0], initials=keys[name][1],
+                   uses=uses, users=users[field, name])
+        for (field, name), uses in totals.items()
+    ]
+    Suggestion.objects.bulk_create(entries, batch_size=1000)
+    return len(entries)
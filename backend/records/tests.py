@@ -1,13 +1,78 @@
-from django.test import TestCase
+import gc
+import hashlib
+import importlib
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import weakref
+from datetime import date, timedelta
+from unittest import mock
+from botocore.exceptions import ClientError
+from cryptography.fernet import Fernet
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
-from rest_framework.test import APIClient
+from django.urls import URLResolver, resolve, reverse
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from backend.middleware import QueryBudgetExceeded, QueryBudgetMiddleware, QueryRecorder
+from backend.sharedcache import SharedMemoryCache
+from users import urls as users_urls
+from users.models import UserDataKey
+from . import urls as records_urls
 from .models import (
     MedicalRecord,
     MedicationRecord,
     VaccinationRecord,
-    PhysicalExam
+    PhysicalExam,
+    MedicalAttachment,
+    AttachmentBlob,
+    HealthSummary,
+    NameSuggestion,
+    parse_blood_pressure,
+)
+from .storage import EncryptedFileStorage, EncryptedS3Storage
+from .s3storage import S3Storage
+from .scrub import StorageScrubber, TokenBucket
+from .datakeys import DataKeyCache, ShredNotifier, data_key_cache
+from . import findings, search
+from .pagination import encode_cursor
+from .prefetch import plan_for
+from .responsecache import ResponseCache
+from .suggestions import name_keys, normalize_query
+from .autocomplete import PrefixIndex, drug_autocomplete
+from .serializers import (
+    MedicalRecordSerializer, MedicationRecordSerializer, PhysicalExamSerializer, VaccinationRecordSerializer,
+)
+from .views import BaseRecordViewSet
+from .compiled import compile_serializer
+from .contentcache import DecryptedContentCache, decrypted_content_cache
+from .encryption import (
+    CODEC_NONE,
+    CODEC_ZLIB,
+    DecryptionError,
+    DEFAULT_BLOCK_SIZE,
+    EncryptingWriter,
+    FileCipher,
+    Header,
+    MAGIC,
 )
 
 User = get_user_model()
@@ -247,3 +312,1988 @@ class FileUploadTests(TestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertIn('Unsupported file type', str(response.data))
 
+
+class EncryptedStorageTests(TestCase):
+    """
+    加密存储测试类
+    验证分块流式加密上传与旧格式兼容
+    """
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.storage = PhysicalExam._meta.get_field('report_pdf').storage
+        self.user = User.objects.create_user(username='storageuser')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def test_save_and_open_chunked(self):
+        """测试保存后磁盘上为分块密文，读取得到原文"""
+        content = os.urandom(300 * 1024)
+        name = self.storage.save('physical_exams/report.pdf', ContentFile(content))
+        self.assertTrue(name.endswith('.encrypted'))
+        with open(self.storage.path(name), 'rb') as f:
+            self.assertEqual(f.read(len(MAGIC)), MAGIC)
+        with self.storage.open(name) as f:
+            self.assertEqual(f.read(), content)
+
+    def test_legacy_fernet_file_readable(self):
+        """测试旧版Fernet加密文件仍可读取"""
+        os.makedirs(os.path.join(self.media_root, 'physical_exams'))
+        path = os.path.join(self.media_root, 'physical_exams', 'old.pdf.encrypted')
+        with open(path, 'wb') as f:
+            f.write(self.storage.fernet.encrypt(b'legacy report'))
+        with self.storage.open('physical_exams/old.pdf.encrypted') as f:
+            self.assertEqual(f.read(), b'legacy report')
+
+    def test_truncated_file_rejected(self):
+        """测试被截断的密文无法通过认证"""
+        name = self.storage.save('physical_exams/cut.pdf', ContentFile(b'x' * 1000))
+        path = self.storage.path(name)
+        with open(path, 'r+b') as f:
+            f.truncate(os.path.getsize(path) - 20)
+        with self.assertRaises(DecryptionError):
+            self.storage.open(name)
+
+    def test_streaming_upload(self):
+        """测试上传处理器在接收时完成加密"""
+        pdf = b'%PDF-1.4 ' + os.urandom(200 * 1024)
+        response = self.client.post('/api/records/physical-exam/', {
+            'exam_date': '2024-01-01',
+            'height': '175.0',
+            'weight': '70.0',
+            'blood_pressure': '120/80',
+            'heart_rate': 70,
+            'report_pdf': SimpleUploadedFile('report.pdf', pdf, content_type='application/pdf'),
+        }, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        exam = PhysicalExam.objects.get(id=response.data['id'])
+        with exam.report_pdf.open('rb') as f:
+            self.assertEqual(f.read(), pdf)
+
+    @override_settings(ENCRYPTED_UPLOAD_MAX_SIZE=1024)
+    def test_streaming_upload_size_limit(self):
+        """测试超过大小限制的上传在接收阶段被拒绝"""
+        response = self.client.post('/api/records/physical-exam/', {
+            'exam_date': '2024-01-01',
+            'height': '175.0',
+            'weight': '70.0',
+            'blood_pressure': '120/80',
+            'heart_rate': 70,
+            'report_pdf': SimpleUploadedFile('report.pdf', b'x' * 4096, content_type='application/pdf'),
+        }, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(PhysicalExam.objects.count(), 0)
+
+@override_settings(DECRYPTED_CONTENT_CACHE={'MAX_BYTES': 0})
+class RangeDownloadTests(TestCase):
+    """
+    分段下载测试类
+    验证可随机读取的加密格式与Range响应（关闭解密缓存）
+    """
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.user = User.objects.create_user(username='rangeuser')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.content = os.urandom(5 * DEFAULT_BLOCK_SIZE + 123)
+        self.exam = PhysicalExam.objects.create(
+            user=self.user,
+            exam_date='2024-01-01',
+            height=175,
+            weight=70,
+            blood_pressure='120/80',
+            heart_rate=70,
+            report_pdf=ContentFile(self.content, name='report.pdf'),
+        )
+        self.url = f'/api/records/physical-exam/{self.exam.id}/download/'
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def test_random_access_read(self):
+        """测试随机定位读取跨块数据"""
+        with self.exam.report_pdf.storage.open(self.exam.report_pdf.name) as f:
+            self.assertEqual(f.size, len(self.content))
+            f.seek(DEFAULT_BLOCK_SIZE - 10)
+            self.assertEqual(f.read(100), self.content[DEFAULT_BLOCK_SIZE - 10:DEFAULT_BLOCK_SIZE + 90])
+
+    def test_partial_content_decrypts_covering_blocks(self):
+        """测试Range请求只解密覆盖范围的数据块"""
+        start = 3 * DEFAULT_BLOCK_SIZE + 5
+        with mock.patch.object(FileCipher, 'decrypt_block', autospec=True,
+                               side_effect=FileCipher.decrypt_block) as decrypt:
+            response = self.client.get(self.url, HTTP_RANGE=f'bytes={start}-{start + 99}')
+            body = b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(body, self.content[start:start + 100])
+        self.assertEqual(response['Content-Range'], f'bytes {start}-{start + 99}/{len(self.content)}')
+        self.assertEqual(decrypt.call_count, 1)
+
+    def test_full_and_unsatisfiable_ranges(self):
+        """测试无Range返回完整文件，越界Range返回416"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-10')
+        self.assertEqual(b''.join(response.streaming_content), self.content[-10:])
+
+    def test_tampered_block_rejected(self):
+        """测试篡改的数据块在读取时被发现"""
+        path = self.exam.report_pdf.path
+        # 第2块密文位于文件头与前两块（各含16字节认证标签）之后
+        offset = 2 * (DEFAULT_BLOCK_SIZE + 16) + 100
+        with open(path, 'r+b') as f:
+            f.seek(offset)
+            byte = f.read(1)
+            f.seek(offset)
+            f.write(bytes([byte[0] ^ 0xFF]))
+        with self.exam.report_pdf.storage.open(self.exam.report_pdf.name) as f:
+            self.assertEqual(f.read(10), self.content[:10])
+            f.seek(2 * DEFAULT_BLOCK_SIZE)
+            with self.assertRaises(DecryptionError):
+                f.read(10)
+
+    def test_other_users_report_not_found(self):
+        """测试其他用户无法下载、查看或修改不属于自己的体检报告与就医记录"""
+        other = APIClient()
+        other.force_authenticate(user=User.objects.create_user(username='rangeother'))
+        self.assertEqual(other.get(self.url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(other.get(f'/api/records/physical-exam/{self.exam.id}/').status_code,
+                         status.HTTP_404_NOT_FOUND)
+        record = MedicalRecord.objects.create(user=self.user, visit_date='2024-01-01')
+        self.assertEqual(other.get(f'/api/records/medical/{record.id}/').status_code,
+                         status.HTTP_404_NOT_FOUND)
+        self.assertEqual(other.get('/api/records/physical-exam/').data['results'], [])
+
+    # 会话不写入仓库目录下的文件会话存储
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies')
+    def test_storage_url_and_admin_download(self):
+        """测试加密文件地址经鉴权读取，管理员可在后台下载任意用户的报告"""
+        url = self.exam.report_pdf.url
+        self.assertEqual(url, f"/api/records/files/{self.exam.report_pdf.name.removesuffix('.encrypted')}")
+        self.assertEqual(b''.join(self.client.get(url).streaming_content), self.content)
+        other = APIClient()
+        other.force_authenticate(user=User.objects.create_user(username='rangeother'))
+        self.assertEqual(other.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+        staff = Client()
+        staff.force_login(User.objects.create_superuser(username='rangeadmin', password='adminpass123'))
+        self.assertEqual(b''.join(staff.get(url).streaming_content), self.content)
+        response = staff.get(f'/admin/records/physicalexam/{self.exam.id}/report/')
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertContains(staff.get('/admin/records/physicalexam/'), f'/admin/records/physicalexam/{self.exam.id}/report/')
+        self.assertContains(staff.get(f'/admin/records/physicalexam/{self.exam.id}/change/'), url)
+
+class DecryptedContentCacheTests(TestCase):
+    """
+    解密内容缓存测试类
+    验证命中、淘汰与清零行为
+    """
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.storage = PhysicalExam._meta.get_field('report_pdf').storage
+        decrypted_content_cache.clear()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+        decrypted_content_cache.clear()
+
+    def test_reopen_hits_cache(self):
+        """测试重复打开同一文件命中缓存且不再解密"""
+        name = self.storage.save('physical_exams/cached.pdf', ContentFile(b'report' * 1000))
+        with self.storage.open(name) as f:
+            self.assertEqual(f.read(), b'report' * 1000)
+        with mock.patch.object(FileCipher, 'decrypt_block') as decrypt:
+            with self.storage.open(name) as f:
+                self.assertEqual(f.read(), b'report' * 1000)
+            decrypt.assert_not_called()
+        stats = decrypted_content_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_rewritten_file_misses(self):
+        """测试文件被覆盖后按修改时间和大小失效"""
+        name = self.storage.save('physical_exams/changed.pdf', ContentFile(b'old'))
+        self.storage.open(name).close()
+        path = self.storage.path(name)
+        replacement = self.storage.save('physical_exams/tmp.pdf', ContentFile(b'new content'))
+        os.replace(self.storage.path(replacement), path)
+        with self.storage.open(name) as f:
+            self.assertEqual(f.read(), b'new content')
+        self.assertEqual(decrypted_content_cache.stats()['entries'], 1)
+
+    def test_lru_eviction_and_zeroing(self):
+        """测试超出字节预算时淘汰最久未用条目并清零缓冲区"""
+        cache = DecryptedContentCache(max_bytes=10, max_entry_bytes=10, zero_on_evict=True)
+        first = bytearray(b'aaaa')
+        cache.put(('a', 0, 4), first).close()
+        cache.put(('b', 0, 4), bytearray(b'bbbb')).close()
+        cache.get(('a', 0, 4)).close()
+        cache.put(('c', 0, 4), bytearray(b'cccc')).close()
+        self.assertIsNone(cache.get(('b', 0, 4)))
+        self.assertEqual(cache.stats()['evictions'], 1)
+        reader = cache.get(('a', 0, 4))
+        cache.discard('a')
+        # 仍有读取器持有时不清零，最后一个读取器关闭后清零
+        self.assertEqual(reader.read(), b'aaaa')
+        reader.close()
+        self.assertEqual(first, bytearray(4))
+
+    def test_compressed_file_judged_by_plaintext_size(self):
+        """测试压缩文件按明文大小判断能否进入缓存，密文较小时也不整体解密"""
+        name = self.storage.save('physical_exams/large.pdf', ContentFile(b'a' * 100000))
+        self.assertLess(self.storage.size(name), 4096)
+        with override_settings(DECRYPTED_CONTENT_CACHE={'MAX_ENTRY_BYTES': 4096}):
+            with mock.patch.object(type(self.storage), '_decrypt_all') as decrypt_all:
+                with self.storage.open(name) as f:
+                    self.assertEqual(f.read(), b'a' * 100000)
+                decrypt_all.assert_not_called()
+        self.assertEqual(decrypted_content_cache.stats()['entries'], 0)
+
+class AttachmentDeduplicationTests(TestCase):
+    """
+    附件去重测试类
+    验证相同内容只存储一份并按引用计数删除
+    """
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.user = User.objects.create_user(username='dedupuser')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.first = MedicalRecord.objects.create(user=self.user)
+        self.second = MedicalRecord.objects.create(user=self.user)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def upload(self, record, content=b'discharge summary'):
+        return self.client.post(
+            f'/api/records/attachments/{record.id}/upload_attachment/',
+            {'file': SimpleUploadedFile('summary.pdf', content)},
+            format='multipart'
+        )
+
+    def test_same_content_stored_once(self):
+        """测试重复上传相同内容时复用已存储的文件"""
+        self.assertEqual(self.upload(self.first).status_code, status.HTTP_201_CREATED)
+        with mock.patch('django.core.files.storage.FileSystemStorage._save') as save:
+            response = self.upload(self.second)
+            save.assert_not_called()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        blob = AttachmentBlob.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+        self.assertEqual(blob.digest, hashlib.sha256(b'discharge summary').hexdigest())
+        self.assertEqual(MedicalAttachment.objects.filter(blob=blob).count(), 2)
+
+    def test_delete_releases_reference(self):
+        """测试删除附件只释放引用，最后一个引用删除时移除文件"""
+        first_id = self.upload(self.first).data['id']
+        second_id = self.upload(self.second).data['id']
+        path = AttachmentBlob.objects.get().file.path
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(
+                f'/api/records/attachments/{self.first.id}/delete_attachment/?attachment_id={first_id}')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(AttachmentBlob.objects.get().ref_count, 1)
+        self.assertTrue(os.path.exists(path))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(
+                f'/api/records/attachments/{self.second.id}/delete_attachment/?attachment_id={second_id}')
+        self.assertFalse(AttachmentBlob.objects.exists())
+        self.assertFalse(os.path.exists(path))
+
+@override_settings(DECRYPTED_CONTENT_CACHE={'MAX_BYTES': 0})
+class CompressionTests(TestCase):
+    """
+    压缩加密测试类
+    验证按收益选择编码与压缩文件的随机读取
+    """
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.storage = PhysicalExam._meta.get_field('report_pdf').storage
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def read_header(self, name):
+        with open(self.storage.path(name), 'rb') as f:
+            return Header.read(f)
+
+    def test_compressible_content(self):
+        """测试文本类内容压缩后加密，且可随机读取"""
+        content = ''.join(f'第{i}行 血常规 正常\n' for i in range(20000)).encode()
+        name = self.storage.save('physical_exams/text.pdf', ContentFile(content))
+        self.assertEqual(self.read_header(name).codec, CODEC_ZLIB)
+        self.assertLess(os.path.getsize(self.storage.path(name)), len(content) // 4)
+        with self.storage.open(name) as f:
+            f.seek(len(content) // 2)
+            self.assertEqual(f.read(1000), content[len(content) // 2:len(content) // 2 + 1000])
+            f.seek(0)
+            self.assertEqual(f.read(), content)
+
+    def test_incompressible_content_skipped(self):
+        """测试首块压缩收益低时不压缩，密文只比明文多出块认证开销"""
+        content = os.urandom(3 * DEFAULT_BLOCK_SIZE)
+        name = self.storage.save('physical_exams/random.pdf', ContentFile(content))
+        self.assertEqual(self.read_header(name).codec, CODEC_NONE)
+        self.assertLess(os.path.getsize(self.storage.path(name)), len(content) + 200)
+        with self.storage.open(name) as f:
+            self.assertEqual(f.read(), content)
+
+    def test_writer_stats(self):
+        """测试写入器记录压缩率与CPU耗时"""
+        writer = EncryptingWriter(self.storage.cipher, io.BytesIO(), compress_level=6)
+        writer.write(b'a' * 100000)
+        writer.close()
+        stats = writer.stats()
+        self.assertEqual(stats['codec'], 'zlib')
+        self.assertLess(stats['ratio'], 0.1)
+        self.assertGreaterEqual(stats['cpu_ms'], 0)
+
+
+class KeyRotationTests(TestCase):
+    """
+    密钥轮换测试类
+    验证多密钥读取、原子重新加密与断点续跑
+    """
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.old_key = Fernet.generate_key().decode()
+        self.new_key = Fernet.generate_key().decode()
+        with mock.patch.dict(os.environ, {'FILE_ENCRYPTION_KEY': self.old_key, 'FILE_ENCRYPTION_OLD_KEYS': ''}):
+            old_storage = EncryptedFileStorage(location=self.media_root)
+        self.names = [
+            old_storage.save(f'physical_exams/2024/01/report{i}.pdf', ContentFile(f'report {i}'.encode() * 1000))
+            for i in range(3)
+        ]
+        self.env = mock.patch.dict(os.environ, {
+            'FILE_ENCRYPTION_KEY': self.new_key,
+            'FILE_ENCRYPTION_OLD_KEYS': self.old_key,
+        })
+        self.env.start()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.storage = EncryptedFileStorage(location=self.media_root)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.env.stop()
+        decrypted_content_cache.clear()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def test_old_key_files_readable_during_rotation(self):
+        """测试轮换期间旧密钥加密的文件按密钥ID读取"""
+        with self.storage.open(self.names[0]) as f:
+            self.assertEqual(f.read(), b'report 0' * 1000)
+        self.assertNotEqual(self.storage.key_id_of(self.names[0]), self.storage.cipher.key_id)
+
+    def test_unknown_key_rejected(self):
+        """测试缺少对应密钥时无法读取"""
+        with mock.patch.dict(os.environ, {'FILE_ENCRYPTION_OLD_KEYS': ''}):
+            storage = EncryptedFileStorage(location=self.media_root)
+        with self.assertRaises(DecryptionError):
+            storage.open(self.names[0])
+
+    def test_rotate_all_files(self):
+        """测试命令将所有文件重新加密为新密钥"""
+        call_command('rotate_encryption_key', workers=2, stdout=io.StringIO())
+        for i, name in enumerate(self.names):
+            self.assertEqual(self.storage.key_id_of(name), self.storage.cipher.key_id)
+            with self.storage.open(name) as f:
+                self.assertEqual(f.read(), f'report {i}'.encode() * 1000)
+        leftovers = os.listdir(os.path.dirname(self.storage.path(self.names[0])))
+        self.assertFalse([name for name in leftovers if name.startswith('.rotate-')])
+        # 再次运行时所有文件已记录在检查点中
+        out = io.StringIO()
+        call_command('rotate_encryption_key', workers=1, stdout=out)
+        self.assertIn('待处理 0 个文件', out.getvalue())
+
+    def test_resume_from_checkpoint(self):
+        """测试中断后按检查点跳过已完成的文件"""
+        checkpoint = os.path.join(self.media_root, 'rotation.log')
+        with open(checkpoint, 'w', encoding='utf-8') as f:
+            f.write('{"name": "%s", "status": "rotated", "error": null}\n' % self.names[0])
+            f.write('{"name": "%s", "sta' % self.names[1])
+        call_command('rotate_encryption_key', workers=1, checkpoint=checkpoint, stdout=io.StringIO())
+        self.assertNotEqual(self.storage.key_id_of(self.names[0]), self.storage.cipher.key_id)
+        self.assertEqual(self.storage.key_id_of(self.names[1]), self.storage.cipher.key_id)
+        self.assertEqual(self.storage.key_id_of(self.names[2]), self.storage.cipher.key_id)
+
+
+class EnvelopeEncryptionTests(TestCase):
+    """
+    用户数据密钥测试类
+    验证按用户加密、密钥缓存、密码学擦除与主密钥轮换
+    """
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.storage = PhysicalExam._meta.get_field('report_pdf').storage
+        self.user = User.objects.create_user(username='envelopeuser')
+        self.exam = PhysicalExam.objects.create(
+            user=self.user,
+            exam_date='2024-01-01',
+            height=175,
+            weight=70,
+            blood_pressure='120/80',
+            heart_rate=70,
+            report_pdf=ContentFile(b'%PDF-1.4 private', name='report.pdf'),
+        )
+
+    def tearDown(self):
+        self.settings_override.disable()
+        decrypted_content_cache.clear()
+        data_key_cache.clear()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def test_report_encrypted_with_user_data_key(self):
+        """测试报告使用所属用户的数据密钥加密"""
+        data_key = UserDataKey.objects.get(user=self.user)
+        key_id = self.storage.key_id_of(self.exam.report_pdf.name)
+        self.assertEqual(key_id.hex(), data_key.key_id)
+        self.assertNotEqual(key_id, self.storage.cipher.key_id)
+        self.assertFalse(self.storage.reencrypt_file(self.exam.report_pdf.name))
+
+    def test_hot_read_skips_unwrap(self):
+        """测试缓存命中时读取不再查询和解包数据密钥"""
+        data_key_cache.clear()
+        with override_settings(DECRYPTED_CONTENT_CACHE={'MAX_BYTES': 0}):
+            with self.assertNumQueries(1):
+                self.assertEqual(self.storage.open(self.exam.report_pdf.name).read(), b'%PDF-1.4 private')
+            with self.assertNumQueries(0):
+                self.assertEqual(self.storage.open(self.exam.report_pdf.name).read(), b'%PDF-1.4 private')
+        self.assertEqual(data_key_cache.stats()['hits'], 1)
+
+    def test_delete_data_key_shreds_files(self):
+        """测试删除数据密钥后文件立即不可读"""
+        self.storage.open(self.exam.report_pdf.name).close()
+        UserDataKey.objects.filter(user=self.user).delete()
+        with self.assertRaises(DecryptionError):
+            self.storage.open(self.exam.report_pdf.name)
+
+    def test_shred_in_other_process_clears_local_caches(self):
+        """测试其他进程删除数据密钥后，本进程下次打开文件时丢弃缓存的密钥与解密内容"""
+        self.storage.open(self.exam.report_pdf.name).close()
+        self.assertEqual(data_key_cache.stats()['entries'], 1)
+        # 模拟其他进程：删除行不触发本进程的信号，只递增共享的擦除代数
+        keys = UserDataKey.objects.filter(user=self.user)
+        keys._raw_delete(keys.db)
+        ShredNotifier().cache.incr(ShredNotifier.KEY)
+        with self.assertRaises(DecryptionError):
+            self.storage.open(self.exam.report_pdf.name)
+        self.assertEqual(data_key_cache.stats()['entries'], 0)
+
+    def test_rotation_rewraps_only_data_keys(self):
+        """测试轮换主密钥时只重新包装数据密钥，文件保持不变"""
+        path = self.exam.report_pdf.path
+        with open(path, 'rb') as f:
+            before = f.read()
+        old_key = os.environ['FILE_ENCRYPTION_KEY']
+        new_key = Fernet.generate_key().decode()
+        with mock.patch.dict(os.environ, {'FILE_ENCRYPTION_KEY': new_key, 'FILE_ENCRYPTION_OLD_KEYS': old_key}):
+            self.assertEqual(EncryptedFileStorage().keyring.rewrap_all(), 1)
+        data_key_cache.clear()
+        with mock.patch.dict(os.environ, {'FILE_ENCRYPTION_KEY': new_key, 'FILE_ENCRYPTION_OLD_KEYS': ''}):
+            storage = EncryptedFileStorage(location=self.media_root)
+            with override_settings(DECRYPTED_CONTENT_CACHE={'MAX_BYTES': 0}):
+                self.assertEqual(storage.open(self.exam.report_pdf.name).read(), b'%PDF-1.4 private')
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), before)
+
+    def test_data_key_cache_ttl_and_lru(self):
+        """测试数据密钥缓存的过期与LRU淘汰"""
+        now = [0]
+        cache = DataKeyCache(max_entries=2, ttl=10, clock=lambda: now[0])
+        cache.put(b'a', 'A')
+        cache.put(b'b', 'B')
+        self.assertEqual(cache.get(b'a'), 'A')
+        cache.put(b'c', 'C')
+        self.assertIsNone(cache.get(b'b'))
+        now[0] = 11
+        self.assertIsNone(cache.get(b'a'))
+        stats = cache.stats()
+        self.assertEqual((stats['evictions'], stats['expirations']), (1, 1))
+
+
+class FakeS3Client:
+    """进程内的S3客户端替身，只实现存储用到的接口"""
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self.calls = []
+        self.fail_part = None
+        self._lock = threading.Lock()
+
+    def _record(self, name):
+        with self._lock:
+            self.calls.append(name)
+
+    def _missing(self, operation):
+        return ClientError({'Error': {'Code': '404'}}, operation)
+
+    def put_object(self, Bucket, Key, Body):
+        self._record('put_object')
+        self.objects[(Bucket, Key)] = Body.read()
+
+    def head_object(self, Bucket, Key):
+        self._record('head_object')
+        data = self.objects.get((Bucket, Key))
+        if data is None:
+            raise self._missing('HeadObject')
+        return {'ContentLength': len(data), 'ETag': '"%s"' % hashlib.md5(data).hexdigest()}
+
+    def get_object(self, Bucket, Key, Range=None, IfMatch=None):
+        self._record('get_object')
+        data = self.objects.get((Bucket, Key))
+        if data is None:
+            raise self._missing('GetObject')
+        if IfMatch and IfMatch != self.head_object(Bucket, Key)['ETag']:
+            raise ClientError({'Error': {'Code': 'PreconditionFailed'}}, 'GetObject')
+        if Range:
+            start, end = map(int, Range[len('bytes='):].split('-'))
+            data = data[start:end + 1]
+        return {'Body': io.BytesIO(data)}
+
+    def delete_object(self, Bucket, Key):
+        self._record('delete_object')
+        self.objects.pop((Bucket, Key), None)
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn):
+        return f"https://s3.example.com/{Params['Bucket']}/{Params['Key']}?method={ClientMethod}&expires={ExpiresIn}"
+
+    def create_multipart_upload(self, Bucket, Key):
+        self._record('create_multipart_upload')
+        upload_id = f'upload-{len(self.uploads)}'
+        self.uploads[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self._record('upload_part')
+        if PartNumber == self.fail_part:
+            raise ClientError({'Error': {'Code': 'InternalError'}}, 'UploadPart')
+        self.uploads[UploadId][PartNumber] = Body
+        return {'ETag': f'"part-{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self._record('complete_multipart_upload')
+        parts = self.uploads.pop(UploadId)
+        self.objects[(Bucket, Key)] = b''.join(parts[part['PartNumber']] for part in MultipartUpload['Parts'])
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self._record('abort_multipart_upload')
+        self.uploads.pop(UploadId, None)
+
+
+class S3StorageTests(TestCase):
+    """
+    对象存储测试类
+    使用进程内S3替身验证加密语义、分段上传与Range读取
+    """
+    def setUp(self):
+        self.client_stub = FakeS3Client()
+        self.storage = EncryptedS3Storage(
+            options={
+                'BUCKET': 'health',
+                'LOCATION': 'media',
+                'MULTIPART_THRESHOLD': 512 * 1024,
+                'PART_SIZE': 256 * 1024,
+                'READ_AHEAD': 128 * 1024,
+            },
+            client=self.client_stub,
+        )
+
+    def tearDown(self):
+        decrypted_content_cache.clear()
+
+    def test_save_and_open(self):
+        """测试对象以密文保存，upload_to路径原样作为对象键"""
+        name = self.storage.save('physical_exams/2024/01/report.pdf', ContentFile(b'%PDF-1.4 s3 report'))
+        self.assertEqual(name, 'physical_exams/2024/01/report.pdf.encrypted')
+        stored = self.client_stub.objects[('health', 'media/physical_exams/2024/01/report.pdf.encrypted')]
+        self.assertEqual(stored[:len(MAGIC)], MAGIC)
+        self.assertTrue(self.storage.exists('physical_exams/2024/01/report.pdf'))
+        with self.storage.open(name) as f:
+            self.assertEqual(f.read(), b'%PDF-1.4 s3 report')
+        self.storage.delete(name)
+        self.assertFalse(self.storage.exists(name))
+
+    def test_multipart_upload_and_ranged_read(self):
+        """测试大文件分段上传，读取时只获取覆盖到的范围"""
+        content = os.urandom(1536 * 1024)
+        name = self.storage.save('physical_exams/big.pdf', ContentFile(content))
+        self.assertGreaterEqual(self.client_stub.calls.count('upload_part'), 6)
+        self.assertNotIn('put_object', self.client_stub.calls)
+        with override_settings(DECRYPTED_CONTENT_CACHE={'MAX_BYTES': 0}):
+            self.client_stub.calls.clear()
+            with self.storage.open(name) as f:
+                f.seek(1024 * 1024)
+                self.assertEqual(f.read(100), content[1024 * 1024:1024 * 1024 + 100])
+        self.assertLessEqual(self.client_stub.calls.count('get_object'), 3)
+        with self.storage.open(name) as f:
+            self.assertEqual(f.read(), content)
+
+    def test_failed_multipart_upload_aborted(self):
+        """测试分段上传失败时放弃未完成的上传"""
+        self.client_stub.fail_part = 2
+        with self.assertRaises(ClientError):
+            self.storage.save('physical_exams/fail.pdf', ContentFile(os.urandom(1024 * 1024)))
+        self.assertIn('abort_multipart_upload', self.client_stub.calls)
+        self.assertEqual(self.client_stub.uploads, {})
+        self.assertFalse(self.storage.exists('physical_exams/fail.pdf'))
+
+    def test_url(self):
+        """测试普通对象返回预签名地址，加密对象没有直接访问地址"""
+        plain = S3Storage(options={'BUCKET': 'health', 'LOCATION': 'media', 'URL_EXPIRES': 60}, client=self.client_stub)
+        self.assertEqual(plain.url('exports/a.csv'),
+                         'https://s3.example.com/health/media/exports/a.csv?method=get_object&expires=60')
+        self.assertEqual(self.storage.url('physical_exams/report.pdf.encrypted'), '/api/records/files/physical_exams/report.pdf')
+
+
+class StorageScrubTests(TestCase):
+    """
+    存储巡检测试类
+    验证损坏、孤立文件、悬空引用与大小不符的检测
+    """
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.user = User.objects.create_user(username='scrubuser')
+        self.exam = PhysicalExam.objects.create(
+            user=self.user,
+            exam_date='2024-01-01',
+            height=175,
+            weight=70,
+            blood_pressure='120/80',
+            heart_rate=70,
+            report_pdf=ContentFile(os.urandom(200 * 1024), name='report.pdf'),
+        )
+        record = MedicalRecord.objects.create(
+            user=self.user, hospital='h', department='d', doctor='doc', diagnosis='x', visit_date='2024-01-01')
+        blob = AttachmentBlob.acquire(ContentFile(b'attachment', name='a.txt'))
+        self.attachment = MedicalAttachment.objects.create(
+            record=record, name='a.txt', blob=blob, file=blob.file.name, size=blob.size)
+        self.storage = PhysicalExam._meta.get_field('report_pdf').storage
+
+    def tearDown(self):
+        self.settings_override.disable()
+        decrypted_content_cache.clear()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def scrub(self, **kwargs):
+        return StorageScrubber(self.storage, default_storage, workers=2, **kwargs).run()
+
+    def test_clean_tree(self):
+        """测试完好的存储没有问题"""
+        report = self.scrub()
+        self.assertEqual(report['scanned'], 2)
+        for key in ('corrupt', 'size_mismatch', 'orphans', 'dangling'):
+            self.assertEqual(report[key], [], key)
+
+    def test_detects_problems(self):
+        """测试检测篡改、孤立文件和悬空引用"""
+        with open(self.exam.report_pdf.path, 'r+b') as f:
+            f.seek(100 * 1024)
+            byte = f.read(1)
+            f.seek(100 * 1024)
+            f.write(bytes([byte[0] ^ 1]))
+        with open(os.path.join(self.media_root, 'physical_exams', 'stray.pdf.encrypted'), 'wb') as f:
+            f.write(b'stray')
+        os.remove(self.attachment.blob.file.path)
+        report = self.scrub()
+        self.assertEqual([item['name'] for item in report['corrupt']], [self.exam.report_pdf.name])
+        self.assertEqual(report['orphans'], ['physical_exams/stray.pdf.encrypted'])
+        self.assertEqual({item['model'] for item in report['dangling']}, {'AttachmentBlob'})
+
+    def test_detects_size_mismatch(self):
+        """测试附件内容与记录的大小不一致"""
+        AttachmentBlob.objects.update(size=1)
+        report = self.scrub()
+        self.assertEqual(report['size_mismatch'][0]['actual'], len(b'attachment'))
+
+    def test_token_bucket_throttles(self):
+        """测试令牌桶按速率限制读取"""
+        now = [0.0]
+        waits = []
+        bucket = TokenBucket(rate=100, clock=lambda: now[0], sleep=waits.append)
+        bucket.consume(100)
+        bucket.consume(50)
+        self.assertEqual(waits, [0.5])
+
+
+class StorageBenchmarkTests(TestCase):
+    """存储基准测试命令的冒烟测试"""
+
+    def setUp(self):
+        self.output = tempfile.NamedTemporaryFile(suffix='.json', delete=False).name
+
+    def tearDown(self):
+        os.remove(self.output)
+
+    def run_benchmark(self, **options):
+        call_command('benchmark_storage', sizes='10K', concurrency='1,2', modes='thread',
+                     iterations=1, output=self.output, stderr=io.StringIO(), **options)
+        with open(self.output, encoding='utf-8') as f:
+            return json.load(f)
+
+    def test_report_covers_all_operations(self):
+        """测试报告包含各操作与冷热缓存的结果"""
+        report = self.run_benchmark()
+        keys = {(item['op'], item['cache'], item['concurrency']) for item in report['results']}
+        self.assertIn(('open', 'cold', 2), keys)
+        self.assertIn(('open', 'warm', 1), keys)
+        self.assertIn(('exists', 'warm', 1), keys)
+        self.assertGreater(report['peak_rss_kb']['self'], 0)
+
+    def test_regression_against_baseline(self):
+        """测试结果明显差于基线时报告退化"""
+        report = self.run_benchmark()
+        for item in report['results']:
+            item['p95_ms'] = item['p95_ms'] / 1000
+            item['ops_per_sec'] = item['ops_per_sec'] * 1000
+        baseline = tempfile.NamedTemporaryFile('w', suffix='.json', delete=False)
+        with baseline:
+            json.dump(report, baseline)
+        try:
+            with self.assertRaises(CommandError):
+                self.run_benchmark(baseline=baseline.name)
+        finally:
+            os.remove(baseline.name)
+
+
+class HealthSummaryTests(TestCase):
+    """
+    健康汇总测试类
+    验证记录增删改时汇总的增量维护与总览接口
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='summaryuser', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def summary(self):
+        return HealthSummary.objects.get(pk=self.user.pk)
+
+    def add_exam(self, exam_date):
+        return PhysicalExam.objects.create(
+            user=self.user, exam_date=exam_date, height=175, weight=70, blood_pressure='120/80', heart_rate=70)
+
+    def test_incremental_counts(self):
+        """测试创建、修改、删除记录时计数随之变化，并与重建结果一致"""
+        record = MedicalRecord.objects.create(user=self.user, department='internal', visit_date='2024-01-01')
+        MedicalRecord.objects.create(user=self.user, department='surgery', visit_date='2024-02-01')
+        vaccination = VaccinationRecord.objects.create(
+            user=self.user, vaccine_type='COVID', dose_number=1, vaccination_date='2024-01-01',
+            next_due_date='2024-03-01')
+        self.assertEqual(self.summary().department_counts, {'internal': 1, 'surgery': 1})
+        self.assertEqual(self.summary().pending_doses, 1)
+
+        record.department = 'surgery'
+        record.save()
+        vaccination.next_due_date = None
+        vaccination.save()
+        summary = self.summary()
+        self.assertEqual(summary.department_counts, {'surgery': 2})
+        self.assertEqual((summary.medical_total, summary.pending_doses), (2, 0))
+
+        record.delete()
+        vaccination.delete()
+        summary = self.summary()
+        self.assertEqual((summary.medical_total, summary.vaccination_total), (1, 0))
+        rebuilt = HealthSummary.rebuild(self.user.pk)
+        self.assertEqual(rebuilt.department_counts, summary.department_counts)
+
+    def test_latest_exam(self):
+        """测试删除最近一次体检后回退到上一次，latest 接口返回最近一次"""
+        older = self.add_exam('2024-01-01')
+        newer = self.add_exam('2024-06-01')
+        self.add_exam('2023-06-01')
+        self.assertEqual(self.summary().latest_exam_id, newer.pk)
+        response = self.client.get('/api/records/physical-exam/latest/')
+        self.assertEqual(response.data['id'], newer.pk)
+
+        newer.delete()
+        summary = self.summary()
+        self.assertEqual((summary.exam_total, summary.latest_exam_id), (2, older.pk))
+
+    def test_abnormal_exams(self):
+        """测试保存、删除改变异常判定时异常体检数随之变化，并与重建结果一致"""
+        exam = self.add_exam('2024-01-01')
+        self.assertEqual(self.summary().abnormal_exams, 0)
+        exam.blood_pressure = '150/95'
+        exam.save()
+        self.assertEqual(self.summary().abnormal_exams, 1)
+        other = self.add_exam('2024-02-01')
+        other.blood_pressure = '85/55'
+        other.save(update_fields=['blood_pressure'])
+        self.assertEqual(self.summary().abnormal_exams, 2)
+        other.delete()
+        self.assertEqual(self.summary().abnormal_exams, 1)
+        response = self.client.get('/api/records/health-overview/statistics/')
+        self.assertEqual(response.data['physical_exams']['abnormal'], 1)
+        exam.blood_pressure = '120/80'
+        exam.save()
+        self.assertEqual(self.summary().abnormal_exams, 0)
+        self.assertEqual(HealthSummary.rebuild(self.user.pk).abnormal_exams, 0)
+
+    def test_abnormal_exams_migration_backfill(self):
+        """测试迁移按异常判定回填已有汇总的异常体检数"""
+        migration = importlib.import_module('records.migrations.0012_health_summary_abnormal_exams')
+        PhysicalExam.objects.create(
+            user=self.user, exam_date='2024-01-01', height=175, weight=70, blood_pressure='150/95', heart_rate=70)
+        self.add_exam('2024-02-01')
+        HealthSummary.objects.update(abnormal_exams=0)
+        historical = MigrationExecutor(connection).loader.project_state(
+            ('records', '0012_health_summary_abnormal_exams')).apps
+        migration.fill_abnormal_exams(historical, connection.schema_editor())
+        self.assertEqual(self.summary().abnormal_exams, 1)
+
+    def test_active_medications_expire(self):
+        """测试正在服用的药物过了结束日期后不再计入"""
+        today = date.today()
+        record = MedicalRecord.objects.create(user=self.user, visit_date=today)
+        MedicationRecord.objects.create(
+            medical_record=record, drug_name='Aspirin', dosage='100mg', start_date=today, end_date=today)
+        MedicationRecord.objects.create(
+            medical_record=record, drug_name='Metformin', dosage='500mg', start_date=today)
+        summary = self.summary()
+        self.assertEqual((summary.medication_total, summary.active_medications), (2, 2))
+        self.assertTrue(summary.is_stale(today + timedelta(days=1)))
+
+        HealthSummary.objects.filter(pk=self.user.pk).update(active_medications_until=today - timedelta(days=1))
+        self.assertEqual(HealthSummary.current(self.user.pk).active_medications, 2)
+
+    def test_overview_queries(self):
+        """测试总览接口读取汇总一行、每类最近记录各一次查询（另有一条ETag指纹查询）"""
+        MedicalRecord.objects.create(user=self.user, visit_date='2024-01-01')
+        exams = [self.add_exam(f'2024-0{month}-01') for month in range(1, 8)]
+        with self.assertNumQueries(6):
+            response = self.client.get('/api/records/health-overview/statistics/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['medical_records']['total'], 1)
+        self.assertEqual(response.data['physical_exams']['total'], 7)
+        recent = response.data['physical_exams']['recent']
+        self.assertEqual([item['id'] for item in recent], [exam.pk for exam in exams[:1:-1]])
+        self.assertEqual(len(response.data['medical_records']['recent']), 1)
+        self.assertEqual(response.data['vaccination_records']['recent'], [])
+
+    def test_rebuild_command(self):
+        """测试重建命令修正被篡改的汇总"""
+        MedicalRecord.objects.create(user=self.user, visit_date='2024-01-01')
+        HealthSummary.objects.filter(pk=self.user.pk).update(medical_total=99, department_counts={})
+        call_command('rebuild_health_summaries', user_ids=[self.user.pk], stdout=io.StringIO())
+        summary = self.summary()
+        self.assertEqual(summary.medical_total, 1)
+        self.assertEqual(summary.department_counts, {'internal': 1})
+
+
+class TimelineTests(TestCase):
+    """
+    健康时间线测试类
+    验证四类记录合并排序与游标翻页
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='timelineuser', password='testpass123')
+        other = User.objects.create_user(username='otheruser', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        for day in range(1, 6):
+            visit_date = f'2024-01-0{day}'
+            record = MedicalRecord.objects.create(user=self.user, hospital='协和', visit_date=visit_date)
+            MedicationRecord.objects.create(
+                medical_record=record, drug_name='Aspirin', dosage='100mg', start_date=visit_date)
+            VaccinationRecord.objects.create(
+                user=self.user, vaccine_type='FL', dose_number=day, vaccination_date=visit_date)
+            PhysicalExam.objects.create(
+                user=self.user, exam_date=visit_date, height=175, weight=70, blood_pressure='120/80', heart_rate=70)
+        MedicalRecord.objects.create(user=other, visit_date='2024-01-03')
+
+    def fetch_all(self, url):
+        items = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            items.extend(response.data['results'])
+            url = response.data['next']
+        return items
+
+    def test_pages_cover_all_records_in_order(self):
+        """测试逐页翻完后记录不重复、不遗漏且按日期倒序"""
+        items = self.fetch_all('/api/records/health-overview/timeline/?page_size=3')
+        self.assertEqual(len(items), 20)
+        self.assertEqual(len({(item['type'], item['id']) for item in items}), 20)
+        dates = [item['date'] for item in items]
+        self.assertEqual(dates, sorted(dates, reverse=True))
+        self.assertEqual(items[0]['description'], '接种流感疫苗第5剂')
+
+    def test_filter_by_type(self):
+        """测试按记录类型筛选"""
+        items = self.fetch_all('/api/records/health-overview/timeline/?types=medical,physical')
+        self.assertEqual({item['type'] for item in items}, {'medical', 'physical'})
+        self.assertEqual(len(items), 10)
+
+    def test_page_query_count_is_constant(self):
+        """测试每页只执行一次合并查询（另有一条ETag指纹查询）"""
+        response = self.client.get('/api/records/health-overview/timeline/?page_size=2')
+        with self.assertNumQueries(2):
+            self.client.get(response.data['next'])
+
+    def test_invalid_cursor(self):
+        """测试无效游标返回400"""
+        response = self.client.get('/api/records/health-overview/timeline/?cursor=bm90LWpzb24')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(RECORD_PAGINATION={'PAGE_SIZE': 2, 'MAX_PAGE_SIZE': 3})
+class KeysetPaginationTests(TestCase):
+    """
+    记录列表分页测试类
+    验证同日记录按ID稳定排序，以及翻页期间插入新记录不产生重复
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='pageuser', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        for day in ('2024-01-01', '2024-01-02', '2024-01-02', '2024-01-02', '2024-01-03'):
+            VaccinationRecord.objects.create(
+                user=self.user, vaccine_type='FL', dose_number=VaccinationRecord.objects.count() + 1,
+                vaccination_date=day)
+
+    def test_pages_are_stable_under_inserts(self):
+        """测试翻页期间插入更新的记录不影响后续页"""
+        expected = list(VaccinationRecord.objects.order_by('-vaccination_date', '-id').values_list('id', flat=True))
+        response = self.client.get('/api/records/vaccination/')
+        seen = [item['id'] for item in response.data['results']]
+        self.assertEqual(len(seen), 2)
+        VaccinationRecord.objects.create(user=self.user, vaccine_type='FL', dose_number=9, vaccination_date='2024-02-01')
+        url = response.data['next']
+        while url:
+            response = self.client.get(url)
+            seen.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(seen, expected)
+
+    def test_page_size_is_capped(self):
+        """测试 page_size 不超过配置的上限"""
+        response = self.client.get('/api/records/vaccination/?page_size=50')
+        self.assertEqual(len(response.data['results']), 3)
+
+    def test_invalid_cursor(self):
+        """测试游标字段数不符时返回400"""
+        response = self.client.get(f'/api/records/vaccination/?cursor={encode_cursor(["2024-01-01"])}')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class PrefetchPlanTests(TestCase):
+    """
+    预取规划测试类
+    验证列表接口的查询次数不随记录数增长
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='prefetchuser', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def add_records(self, count):
+        start = VaccinationRecord.objects.count()
+        for i in range(start, start + count):
+            record = MedicalRecord.objects.create(user=self.user, visit_date='2024-01-01')
+            MedicalAttachment.objects.create(record=record, name=f'{i}.txt', file=f'medical_records/{i}.txt', size=1)
+            VaccinationRecord.objects.create(
+                user=self.user, vaccine_type='FL', dose_number=i + 1, vaccination_date='2024-01-01')
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(queries)
+
+    def test_list_queries_do_not_grow(self):
+        """测试嵌套附件与用户的列表接口查询次数固定"""
+        for url in ('/api/records/medical/', '/api/records/vaccination/'):
+            self.add_records(1)
+            single = self.count_queries(url)
+            self.add_records(8)
+            self.assertEqual(self.count_queries(url), single, url)
+
+    def test_plan(self):
+        """测试根据嵌套字段生成的预取计划"""
+        self.assertEqual(plan_for(VaccinationRecordSerializer(), VaccinationRecord).select, ['user'])
+        plan = plan_for(MedicalRecordSerializer(), MedicalRecord)
+        self.assertEqual([path for path, _, _ in plan.prefetch], ['attachments'])
+
+
+@override_settings(QUERY_BUDGET={'ENABLED': False})
+class QueryScalingTests(TestCase):
+    """
+    查询次数回归测试
+    在两种数据量下请求 records 与 users 的所有GET路由，查询次数随数据量增长即失败
+    """
+    SIZES = (2, 6)
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='scalinguser', password='testpass123')
+        self.client = APIClient(raise_request_exception=False)
+        self.client.force_authenticate(user=self.user)
+        self.seeded = 0
+
+    def seed(self, count):
+        """为当前用户补足每类记录各count条"""
+        for i in range(self.seeded, count):
+            visit_date = f'2024-01-{i + 1:02d}'
+            record = MedicalRecord.objects.create(user=self.user, hospital='协和', visit_date=visit_date)
+            MedicalAttachment.objects.create(record=record, name=f'{i}.txt', file=f'medical_records/{i}.txt', size=1)
+            MedicationRecord.objects.create(
+                medical_record=record, drug_name='Aspirin', dosage='100mg', start_date=visit_date)
+            VaccinationRecord.objects.create(
+                user=self.user, vaccine_type='FL', dose_number=i + 1, vaccination_date=visit_date)
+            PhysicalExam.objects.create(
+                user=self.user, exam_date=visit_date, height=175, weight=70, blood_pressure='120/80', heart_rate=70)
+        self.seeded = count
+
+    def routes(self):
+        """遍历两个应用的URL配置，返回(路由名, 路径)"""
+        def walk(namespace, patterns):
+            for entry in patterns:
+                if isinstance(entry, URLResolver):
+                    yield from walk(namespace, entry.url_patterns)
+                elif entry.name and 'format' not in entry.pattern.regex.groupindex:
+                    yield f'{namespace}:{entry.name}', entry
+
+        for namespace, module in (('records', records_urls), ('users', users_urls)):
+            for name, entry in walk(namespace, module.urlpatterns):
+                kwargs = {}
+                if 'pk' in entry.pattern.regex.groupindex:
+                    model = entry.callback.cls.queryset.model
+                    kwargs['pk'] = model.objects.order_by('pk').values_list('pk', flat=True).first()
+                if 'name' in entry.pattern.regex.groupindex:
+                    kwargs['name'] = 'missing.pdf'
+                yield name, reverse(name, kwargs=kwargs)
+
+    def measure(self):
+        """返回 {路由名: (查询次数, 预算)}，只统计成功的GET请求"""
+        counts = {}
+        for name, path in self.routes():
+            recorder = QueryRecorder()
+            with recorder.record():
+                response = self.client.get(path)
+            if response.status_code == status.HTTP_200_OK:
+                match = resolve(path)
+                action = (getattr(match.func, 'actions', None) or {}).get('get', 'get')
+                budget = getattr(getattr(match.func, 'cls', None), 'query_budgets', {}).get(action)
+                counts[name] = (recorder.summary()['count'], budget)
+        return counts
+
+    def test_query_count_independent_of_size(self):
+        """测试每个路由的查询次数与数据量无关且不超过声明的预算"""
+        self.seed(self.SIZES[0])
+        small = self.measure()
+        self.seed(self.SIZES[1])
+        large = self.measure()
+        self.assertGreaterEqual(len(small), 10)
+        growing = {name: (small[name][0], count) for name, (count, _) in large.items()
+                   if name in small and count != small[name][0]}
+        self.assertEqual(growing, {})
+        over_budget = {name: (count, budget) for name, (count, budget) in large.items()
+                       if budget is not None and count > budget}
+        self.assertEqual(over_budget, {})
+
+
+class QueryBudgetMiddlewareTests(TestCase):
+    """查询预算中间件测试"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='budgetuser', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        VaccinationRecord.objects.create(user=self.user, vaccine_type='FL', dose_number=1, vaccination_date='2024-01-01')
+
+    def test_exceeding_budget_raises(self):
+        """测试超出预算时在开启RAISE的情况下抛出异常"""
+        budgets = {'ENABLED': True, 'RAISE': True, 'BUDGETS': {'VaccinationRecordViewSet.list': 0}}
+        with override_settings(QUERY_BUDGET=budgets):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get('/api/records/vaccination/')
+        with override_settings(QUERY_BUDGET={**budgets, 'RAISE': False}):
+            response = self.client.get('/api/records/vaccination/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_test_runner_enforces_budgets(self):
+        """测试预算由测试运行器开启并抛出异常，不依赖命令行参数"""
+        self.assertTrue(settings.QUERY_BUDGET['ENABLED'])
+        self.assertTrue(settings.QUERY_BUDGET['RAISE'])
+        with override_settings(QUERY_BUDGET={}):
+            self.assertFalse(QueryBudgetMiddleware(None).options()['ENABLED'])
+
+    def test_recorder_reports_duplicates(self):
+        """测试记录器统计重复语句"""
+        recorder = QueryRecorder()
+        with recorder.record():
+            for _ in range(3):
+                list(VaccinationRecord.objects.filter(pk=self.user.pk))
+        summary = recorder.summary()
+        self.assertEqual(summary['count'], 3)
+        self.assertEqual(list(summary['duplicates'].values()), [3])
+
+
+class SparseFieldsetTests(TestCase):
+    """
+    稀疏字段集测试类
+    验证 fields/expand 参数控制输出字段、读取的列与嵌套查询
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='sparseuser', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        record = MedicalRecord.objects.create(
+            user=self.user, hospital='协和', visit_date='2024-01-01', diagnosis='很长的诊断' * 100)
+        MedicalAttachment.objects.create(record=record, name='a.txt', file='medical_records/a.txt', size=1)
+
+    def get(self, query):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/api/records/medical/?{query}')
+        # 第一条为ETag指纹查询
+        return response, [query['sql'] for query in queries][1:]
+
+    def test_fields_limit_columns(self):
+        """测试只输出并只读取请求的字段"""
+        response, queries = self.get('fields=id,hospital,department_display')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.data['results'][0]), {'id', 'hospital', 'department_display'})
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('diagnosis', queries[0])
+
+    def test_expand_nested(self):
+        """测试嵌套附件只在展开时查询"""
+        response, queries = self.get('expand=attachments')
+        self.assertEqual(len(response.data['results'][0]['attachments']), 1)
+        self.assertIn('diagnosis', response.data['results'][0])
+        self.assertEqual(len(queries), 2)
+        response, queries = self.get('fields=id,diagnosis')
+        self.assertNotIn('attachments', response.data['results'][0])
+        self.assertEqual(len(queries), 1)
+
+    def test_unknown_field(self):
+        """测试未知字段与不可展开字段返回400"""
+        self.assertEqual(self.get('fields=nope')[0].status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.get('expand=hospital')[0].status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class CompiledSerializerTests(TestCase):
+    """
+    编译序列化测试类
+    验证列表接口的编译路径与DRF序列化输出完全一致
+    """
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.user = User.objects.create_user(username='compileduser', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        record = MedicalRecord.objects.create(
+            user=self.user, hospital='协和', visit_date='2024-01-01', department='surgery', diagnosis='骨折')
+        MedicalRecord.objects.create(user=self.user, visit_date='2024-02-01')
+        MedicalAttachment.objects.create(record=record, name='a.txt', file='medical_records/a.txt', size=1)
+        MedicationRecord.objects.create(
+            user=self.user, medical_record=record, drug_name='布洛芬', dosage='1片',
+            start_date=date.today() - timedelta(days=3), end_date=date.today() + timedelta(days=4))
+        MedicationRecord.objects.create(
+            user=self.user, medical_record=record, drug_name='阿莫西林', dosage='2粒', start_date=date.today())
+        VaccinationRecord.objects.create(
+            user=self.user, vaccine_type=VaccinationRecord.VaccineType.values[0],
+            dose_number=1, vaccination_date='2024-03-01')
+        PhysicalExam.objects.create(
+            user=self.user, exam_date='2024-04-01', height='172.5', weight='65.35',
+            blood_pressure='120/80', heart_rate=70,
+            report_pdf=ContentFile(b'%PDF-1.4', name='report.pdf'))
+        PhysicalExam.objects.create(
+            user=self.user, exam_date='2024-05-01', height='160', weight='50',
+            blood_pressure='118/76', heart_rate=66)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def assert_parity(self, url):
+        compiled = self.client.get(url)
+        with mock.patch.object(BaseRecordViewSet, 'compiled_list', False):
+            expected = self.client.get(url)
+        self.assertEqual(compiled.status_code, status.HTTP_200_OK)
+        self.assertEqual(compiled.json(), expected.json())
+        return compiled.json()
+
+    def test_parity(self):
+        """测试各记录列表的输出与DRF序列化一致"""
+        for kind in ('medical', 'medication', 'vaccination', 'physical-exam'):
+            with self.subTest(kind=kind):
+                self.assertEqual(len(self.assert_parity(f'/api/records/{kind}/')['results']), 2 - (kind == 'vaccination'))
+        exams = self.assert_parity('/api/records/physical-exam/')['results']
+        self.assertEqual([exam['bmi'] for exam in exams], [19.5, 22.0])
+        self.assertEqual(exams[1]['report_url'], f'http://testserver/api/records/physical-exam/{exams[1]["id"]}/download/')
+        self.assertIsNone(exams[0]['report_url'])
+        report = PhysicalExam.objects.get(pk=exams[1]['id']).report_pdf
+        self.assertEqual(exams[1]['report_pdf'], f'http://testserver{report.url}')
+        for serializer_class in (MedicalRecordSerializer, PhysicalExamSerializer):
+            model = serializer_class.Meta.model
+            self.assertIsNotNone(compile_serializer(serializer_class(), model))
+
+    def test_parity_with_sparse_fields_and_cursor(self):
+        """测试稀疏字段、展开与翻页同样走编译路径且输出一致"""
+        self.assert_parity('/api/records/medical/?fields=id,department_display&page_size=1')
+        data = self.assert_parity('/api/records/physical-exam/?expand=user&page_size=1')
+        self.assertEqual(data['results'][0]['user']['id'], self.user.id)
+        self.assert_parity(data['next'])
+
+    @mock.patch.dict('records.compiled._compiled', clear=True)
+    def test_compiled_serializer_shared_without_request(self):
+        """测试编译结果按序列化器类共用且不持有首次请求"""
+        request = Request(APIRequestFactory().get('/'))
+        compiled = compile_serializer(MedicationRecordSerializer(context={'request': request}), MedicationRecord)
+        request_ref = weakref.ref(request)
+        del request
+        gc.collect()
+        self.assertIsNone(request_ref())
+        self.assertIs(compile_serializer(MedicationRecordSerializer(), MedicationRecord), compiled)
+
+    @mock.patch.dict('records.compiled._compiled', clear=True)
+    def test_compile_function_receives_render_context(self):
+        """测试 compile_<字段名> 在每次渲染时以当次的 context 调用"""
+        compile_function = mock.Mock(return_value=lambda end_date: 7)
+        with mock.patch.object(MedicationRecordSerializer, 'compile_remaining_days', staticmethod(compile_function)):
+            compiled = compile_serializer(MedicationRecordSerializer(), MedicationRecord)
+            rows = MedicationRecord.objects.values_list(*compiled.columns)
+            for _ in range(2):
+                context = {'request': Request(APIRequestFactory().get('/'))}
+                self.assertEqual({data['remaining_days'] for data in compiled.render(rows, context)}, {7})
+                compile_function.assert_called_with(context)
+        self.assertEqual(compile_function.call_count, 2)
+
+    def test_benchmark_command(self):
+        """测试基准命令校验输出一致并报告加速比"""
+        output = io.StringIO()
+        call_command('benchmark_serializers', rows=20, stdout=output)
+        report = json.loads(output.getvalue())
+        self.assertTrue(all(result['identical'] for result in report['results']))
+        self.assertFalse(User.objects.filter(username='benchmark-serializers').exists())
+
+
+class ConditionalGetTests(TestCase):
+    """
+    条件请求测试类
+    验证ETag随记录集合变化，If-None-Match 命中时返回304且不执行列表查询
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='etaguser', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.record = MedicalRecord.objects.create(user=self.user, hospital='协和', visit_date='2024-01-01')
+        self.vaccination = VaccinationRecord.objects.create(
+            user=self.user, vaccine_type=VaccinationRecord.VaccineType.values[0],
+            dose_number=1, vaccination_date='2024-03-01')
+
+    def get(self, url, etag=None):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, **headers)
+        return response, len(queries)
+
+    def test_not_modified(self):
+        """测试ETag未变时返回304，只执行一次指纹查询"""
+        for url in ('/api/records/vaccination/', f'/api/records/vaccination/{self.vaccination.pk}/',
+                    '/api/records/medical/statistics/', '/api/records/health-overview/timeline/'):
+            with self.subTest(url=url):
+                response, _ = self.get(url)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                etag = response['ETag']
+                response, count = self.get(url, f'W/{etag}, "other"')
+                self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+                self.assertEqual(response['ETag'], etag)
+                self.assertEqual(response.content, b'')
+                self.assertEqual(count, 1)
+
+    def test_etag_changes_with_collection(self):
+        """测试新增、修改、删除记录以及不同查询参数产生不同的ETag"""
+        url = '/api/records/vaccination/'
+        etags = [self.get(url)[0]['ETag']]
+        self.vaccination.institution = '社区医院'
+        self.vaccination.save()
+        etags.append(self.get(url)[0]['ETag'])
+        other = VaccinationRecord.objects.create(
+            user=self.user, vaccine_type=VaccinationRecord.VaccineType.values[0],
+            dose_number=2, vaccination_date='2024-04-01')
+        etags.append(self.get(url)[0]['ETag'])
+        other.delete()
+        etags.append(self.get(url)[0]['ETag'])
+        etags.append(self.get(url + '?fields=id')[0]['ETag'])
+        # 删除新增的记录后集合恢复原状，ETag与删除前一致
+        self.assertEqual(etags[3], etags[1])
+        self.assertEqual(len(set(etags)), 4)
+        response, _ = self.get(url, etags[-2])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_nested_data_changes_etag(self):
+        """测试附件与用户档案变化使包含它们的列表ETag失效"""
+        url = '/api/records/medical/?expand=attachments'
+        etag = self.get(url)[0]['ETag']
+        MedicalAttachment.objects.create(record=self.record, name='a.txt', file='medical_records/a.txt', size=1)
+        response, _ = self.get(url, etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results'][0]['attachments']), 1)
+
+        url = '/api/records/vaccination/?expand=user'
+        etag = self.get(url)[0]['ETag']
+        self.user.phone = '13800000000'
+        self.user.save()
+        self.assertEqual(self.get(url, etag)[0].status_code, status.HTTP_200_OK)
+
+
+class ResponseCacheTests(TestCase):
+    """
+    响应缓存测试类
+    验证按用户代数失效、并发未命中合并计算与统计信息
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='cacheuser', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.cache = ResponseCache()
+
+    def test_statistics_cached_until_write(self):
+        """测试命中时不读取汇总，写入记录后立即返回新结果"""
+        MedicalRecord.objects.create(user=self.user, visit_date='2024-01-01')
+        self.client.get('/api/records/health-overview/statistics/')
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/records/health-overview/statistics/')
+        self.assertEqual(response.data['medical_records']['total'], 1)
+        MedicalRecord.objects.create(user=self.user, visit_date='2024-02-01')
+        response = self.client.get('/api/records/health-overview/statistics/')
+        self.assertEqual(response.data['medical_records']['total'], 2)
+
+    def test_report_invalidated_by_owner_and_hidden_from_others(self):
+        """测试体检报告的缓存随所有者修改失效，其他用户不能读取"""
+        exam = PhysicalExam.objects.create(user=self.user, exam_date='2024-01-01', height=170, weight=65,
+                                           blood_pressure='120/80', heart_rate=70)
+        url = f'/api/records/physical-exam/{exam.pk}/report/'
+        self.assertEqual(self.client.get(url).data['abnormal_items'], [])
+        exam.blood_pressure = '150/95'
+        exam.save()
+        self.assertEqual([item['name'] for item in self.client.get(url).data['abnormal_items']], ['高血压'])
+        other = APIClient()
+        other.force_authenticate(user=User.objects.create_user(username='cachereportother'))
+        self.assertEqual(other.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_users_isolated(self):
+        """测试一个用户的写入不影响其他用户的代数"""
+        other = User.objects.create_user(username='cacheother')
+        before = self.cache.generation(other.pk)
+        MedicalRecord.objects.create(user=self.user, visit_date='2024-01-01')
+        self.assertEqual(self.cache.generation(other.pk), before)
+        self.assertNotEqual(self.cache.key(self.user.pk, 'a'), self.cache.key(other.pk, 'a'))
+
+    def test_concurrent_misses_coalesce(self):
+        """测试同一键的并发未命中只计算一次"""
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return {'value': 42}
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            self.cache.get_or_compute(self.user.pk, 'slow', compute))) for _ in range(5)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        while self.cache.misses < 5:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'value': 42}] * 5)
+        stats = self.cache.stats()
+        self.assertEqual((stats['computations'], stats['coalesced']), (1, 4))
+        self.assertEqual(self.cache.get_or_compute(self.user.pk, 'slow', compute), {'value': 42})
+        self.assertEqual(self.cache.stats()['hit_ratio'], round(5 / 6, 4))
+
+    def test_error_responses_not_cached(self):
+        """测试错误响应不写入缓存"""
+        self.assertEqual(self.cache.get_or_compute(self.user.pk, 'error', lambda: None), None)
+        self.assertEqual(self.cache.get_or_compute(self.user.pk, 'error', lambda: 'ok'), 'ok')
+        self.assertEqual(self.cache.stats()['computations'], 2)
+
+
+def _shared_cache_incr(location, times):
+    cache = SharedMemoryCache(location, {'OPTIONS': {'SIZE': 1024 * 1024}})
+    for _ in range(times):
+        cache.incr('counter')
+
+
+class SharedMemoryCacheTests(TestCase):
+    """
+    共享内存缓存测试类
+    验证基本读写、过期、组内淘汰以及跨进程可见与原子递增
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.location = os.path.join(self.directory, 'cache')
+        self.cache = self._cache()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _cache(self, **options):
+        return SharedMemoryCache(self.location, {'OPTIONS': {'SIZE': 1024 * 1024, **options}})
+
+    def test_basic_operations(self):
+        """测试读写、add、incr、touch与删除"""
+        self.cache.set('a', {'value': 1})
+        self.assertEqual(self.cache.get('a'), {'value': 1})
+        self.assertFalse(self.cache.add('a', 2))
+        self.assertTrue(self.cache.add('n', 1))
+        self.assertEqual(self.cache.incr('n', 5), 6)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+        self.assertTrue(self.cache.touch('a', None))
+        self.assertTrue(self.cache.delete('a'))
+        self.assertIsNone(self.cache.get('a'))
+        self.cache.set('b', 1)
+        self.cache.clear()
+        self.assertIsNone(self.cache.get('b'))
+
+    def test_expiry_and_oversize(self):
+        """测试过期条目不返回，较大的值压缩存放，压缩后仍超过槽位大小的新值使旧值失效并计数"""
+        self.cache.set('a', 1, timeout=0.05)
+        time.sleep(0.1)
+        self.assertIsNone(self.cache.get('a'))
+        trends = {'dates': ['2024-01-01'] * 2000, 'systolic_pressure': [120] * 2000}
+        self.cache.set('trends', trends)
+        self.assertEqual(self.cache.get('trends'), trends)
+        self.cache.set('b', 1)
+        self.cache.set('b', os.urandom(32768))
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.stats()['oversize'], 1)
+
+    def test_location_must_be_private(self):
+        """测试拒绝未指定目录、他人可访问的目录、符号链接与权限不符的映射文件"""
+        with self.assertRaises(ImproperlyConfigured):
+            SharedMemoryCache('', {})
+        shared = os.path.join(self.directory, 'shared')
+        os.mkdir(shared)
+        os.chmod(shared, 0o755)
+        with self.assertRaises(ImproperlyConfigured):
+            SharedMemoryCache(shared, {}).get('a')
+        private = os.path.join(self.directory, 'private')
+        os.mkdir(private, 0o700)
+        target = os.path.join(self.directory, 'target')
+        with open(target, 'wb') as f:
+            f.write(b'keep')
+        os.symlink(target, os.path.join(private, 'cache.bin'))
+        with self.assertRaises(OSError):
+            SharedMemoryCache(private, {'OPTIONS': {'SIZE': 1024 * 1024}}).get('a')
+        with open(target, 'rb') as f:
+            self.assertEqual(f.read(), b'keep')
+        os.remove(os.path.join(private, 'cache.bin'))
+        with open(os.path.join(private, 'cache.bin'), 'wb'):
+            pass
+        os.chmod(os.path.join(private, 'cache.bin'), 0o644)
+        with self.assertRaises(ImproperlyConfigured):
+            SharedMemoryCache(private, {'OPTIONS': {'SIZE': 1024 * 1024}}).get('a')
+
+    def test_layout_mismatch_refused(self):
+        """测试已有文件的布局与配置不一致时拒绝使用，不截断其他进程可能正在映射的文件"""
+        self.cache.set('a', 1)
+        path = os.path.join(self.location, 'cache.bin')
+        size = os.path.getsize(path)
+        other = SharedMemoryCache(self.location, {'OPTIONS': {'SIZE': 2 * 1024 * 1024}})
+        with mock.patch.dict('backend.sharedcache._tables', clear=True):
+            with self.assertRaises(ImproperlyConfigured):
+                other.get('a')
+        self.assertEqual(os.path.getsize(path), size)
+        self.assertEqual(self.cache.get('a'), 1)
+
+    def test_lru_eviction(self):
+        """测试组满时淘汰最久未访问的条目"""
+        cache = self._cache(SIZE=16384 * 4, WAYS=4)
+        for i in range(4):
+            cache.set(f'k{i}', i)
+        cache.get('k0')
+        cache.set('k4', 4)
+        self.assertIsNone(cache.get('k1'))
+        self.assertEqual([cache.get(f'k{i}') for i in (0, 2, 3, 4)], [0, 2, 3, 4])
+
+    def test_cross_process_incr(self):
+        """测试多个进程并发递增不丢失更新，写入对父进程立即可见"""
+        self.cache.set('counter', 0)
+        context = multiprocessing.get_context('fork')
+        processes = [context.Process(target=_shared_cache_incr, args=(self.location, 200)) for _ in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(30)
+        self.assertEqual([process.exitcode for process in processes], [0] * 4)
+        self.assertEqual(self.cache.get('counter'), 800)
+
+    def test_benchmark_command(self):
+        """测试基准命令：共享缓存跨进程全部命中且递增无丢失，LocMemCache 进程间不可见"""
+        output = io.StringIO()
+        call_command('benchmark_cache', backends='locmem,shared', concurrency='2',
+                     operations=50, stdout=output, stderr=io.StringIO())
+        results = {(result['backend'], result['op']): result
+                   for result in json.loads(output.getvalue())['results']}
+        self.assertEqual(results[('shared', 'get')]['hit_ratio'], 1.0)
+        self.assertEqual(results[('shared', 'incr')]['lost_increments'], 0)
+        self.assertEqual(results[('locmem', 'get')]['hit_ratio'], 0.0)
+
+
+class RecordSearchTests(TestCase):
+    """
+    全文检索测试类
+    验证中文子串匹配、前缀查询、用户隔离、信号增量维护与索引重建
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='searchuser', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.record = MedicalRecord.objects.create(
+            user=self.user, hospital='北京协和医院', diagnosis='高血压二级，伴头痛', notes='Aspirin allergy')
+
+    def search(self, q, **params):
+        response = self.client.get('/api/records/search/', {'q': q, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [(item['type'], item['id']) for item in response.data['results']]
+
+    def test_cjk_and_prefix_queries(self):
+        """测试中文按子串匹配，单字与带 * 的词按前缀匹配，多个词同时匹配"""
+        expected = [('medical', self.record.pk)]
+        for q in ('高血压', '血压', '血', '协和 头痛', 'aspir*', 'ASPIRIN'):
+            self.assertEqual(self.search(q), expected, q)
+        for q in ('低血压', 'aspir', '协和 发热'):
+            self.assertEqual(self.search(q), [], q)
+
+    def test_index_follows_writes(self):
+        """测试新增、修改、删除记录后索引立即更新，其他用户的记录不会出现"""
+        other = User.objects.create_user(username='searchother')
+        MedicalRecord.objects.create(user=other, diagnosis='高血压')
+        medication = MedicationRecord.objects.create(
+            user=self.user, medical_record=self.record, drug_name='阿司匹林肠溶片', dosage='100mg', start_date='2024-01-01')
+        self.assertEqual(self.search('阿司匹林'), [('medication', medication.pk)])
+        self.assertEqual(self.search('高血压', types='medication'), [])
+        self.record.diagnosis = '糖尿病'
+        self.record.save()
+        self.assertEqual(self.search('高血压'), [])
+        self.assertEqual(self.search('糖尿病'), [('medical', self.record.pk)])
+        self.record.delete()
+        self.assertEqual(self.search('糖尿病'), [])
+
+    def test_ranking_and_paging(self):
+        """测试标题字段匹配排在正文之前，offset 翻页"""
+        title_match = MedicalRecord.objects.create(user=self.user, hospital='头痛专科医院')
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/records/search/', {'q': '头痛', 'page_size': 1})
+        self.assertEqual(response.data['results'][0]['id'], title_match.pk)
+        self.assertIn('offset=1', response.data['next'])
+        self.assertEqual(self.search('头痛', page_size=1, offset=1), [('medical', self.record.pk)])
+
+    def test_invalid_parameters(self):
+        """测试缺少检索词或类型无效时返回400"""
+        self.assertEqual(self.client.get('/api/records/search/', {'q': ' ,'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/records/search/', {'q': '血', 'types': 'x'}).status_code, 400)
+
+    def test_migration_matches_rebuild(self):
+        """测试迁移中的索引快照与当前的重建结果一致，且只使用历史模型"""
+        migration = importlib.import_module('records.migrations.0008_search_index')
+        MedicationRecord.objects.create(user=self.user, medical_record=self.record, drug_name='阿司匹林',
+                                        dosage='100mg', start_date='2024-01-01')
+        VaccinationRecord.objects.create(user=self.user, vaccine_type='CV', vaccination_date='2024-01-01',
+                                         institution='朝阳区疾控中心', dose_number=1)
+
+        def rows():
+            with connection.cursor() as cursor:
+                cursor.execute(f'SELECT rowid, owner, title, body, kind, record_id, happened_on, summary '
+                               f'FROM {search.TABLE} ORDER BY rowid')
+                return cursor.fetchall()
+
+        search.rebuild()
+        expected = rows()
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {search.TABLE}')
+        historical = MigrationExecutor(connection).loader.project_state(('records', '0008_search_index')).apps
+        migration.fill_search_index(historical, connection)
+        self.assertEqual(rows(), expected)
+
+    def test_rebuild_command(self):
+        """测试批量导入不触发信号，重建命令补全索引"""
+        VaccinationRecord.objects.bulk_create([
+            VaccinationRecord(user=self.user, vaccine_type='CV', vaccination_date='2024-01-01',
+                              institution='朝阳区疾控中心', dose_number=1),
+        ])
+        self.assertEqual(self.search('疾控'), [])
+        output = io.StringIO()
+        call_command('rebuild_search_index', stdout=output)
+        self.assertIn('2', output.getvalue())
+        self.assertEqual(len(self.search('疾控')), 1)
+        self.assertEqual(self.search('高血压'), [('medical', self.record.pk)])
+
+
+class NameSuggestionTests(TestCase):
+    """
+    名称联想测试类
+    验证拼音、首字母与汉字前缀联想，按用户与全站计数，以及记录变更后的增量维护
+    """
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='pinyinuser', password='testpass123')
+        self.other = User.objects.create_user(username='pinyinother')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.record = MedicalRecord.objects.create(user=self.user, hospital='协和医院', doctor='张三')
+
+    def suggest(self, field, q, **params):
+        response = self.client.get('/api/records/suggestions/', {'field': field, 'q': q, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return {scope: [entry['name'] for entry in entries] for scope, entries in response.data.items()}
+
+    def test_name_keys(self):
+        """测试全拼与首字母，非汉字部分保留字母数字"""
+        self.assertEqual(name_keys('协和医院'), ('xieheyiyuan', 'xhyy'))
+        self.assertEqual(name_keys('Aspirin 100mg'), ('aspirin100mg', 'a'))
+
+    def test_pinyin_initials_and_hanzi_prefixes(self):
+        """测试首字母、全拼、汉字前缀都能联想到用户用过的名称，默认值不计入"""
+        for q in ('xhyy', 'xiehe', 'XH', '协和'):
+            self.assertEqual(self.suggest('hospital', q)['user'], ['协和医院'], q)
+        self.assertEqual(self.suggest('doctor', 'zs')['user'], ['张三'])
+        self.assertEqual(self.suggest('hospital', 'hx')['user'], [])
+        MedicalRecord.objects.create(user=self.user)
+        self.assertEqual(self.suggest('hospital', 'wz')['user'], [])
+
+    def test_user_and_global_ranking(self):
+        """测试按使用次数排序，全站结果需达到使用人数下限且不重复用户已有的名称"""
+        MedicalRecord.objects.create(user=self.other, hospital='协和医院')
+        MedicalRecord.objects.create(user=self.other, hospital='协和眼科医院')
+        MedicalRecord.objects.create(user=self.user, hospital='协和眼科医院')
+        MedicalRecord.objects.create(user=self.user, hospital='协和眼科医院')
+        third = User.objects.create_user(username='pinyinthird')
+        MedicalRecord.objects.create(user=third, hospital='西城医院')
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/records/suggestions/', {'field': 'hospital', 'q': 'xiehe'})
+        self.assertEqual(response.data['user'], [{'name': '协和眼科医院', 'uses': 2}, {'name': '协和医院', 'uses': 1}])
+        self.assertEqual(response.data['global'], [])
+        other = APIClient()
+        other.force_authenticate(user=third)
+        response = other.get('/api/records/suggestions/', {'field': 'hospital', 'q': 'xhy'})
+        self.assertEqual(response.data['global'], [{'name': '协和眼科医院', 'uses': 3}, {'name': '协和医院', 'uses': 2}])
+
+    def test_counts_follow_writes(self):
+        """测试修改、删除记录以及删除用户后词条计数随之更新"""
+        MedicalRecord.objects.create(user=self.other, hospital='协和医院')
+        self.record.hospital = '同仁医院'
+        self.record.save()
+        self.assertEqual(self.suggest('hospital', 'xh')['user'], [])
+        self.assertEqual(self.suggest('hospital', 'tryy')['user'], ['同仁医院'])
+        global_entry = NameSuggestion.objects.get(user=None, field='hospital', name='协和医院')
+        self.assertEqual((global_entry.uses, global_entry.users), (1, 1))
+        self.record.delete()
+        self.assertFalse(NameSuggestion.objects.filter(name__in=['同仁医院', '张三']).exists())
+        self.other.delete()
+        self.assertFalse(NameSuggestion.objects.exists())
+
+    def test_record_filter_accepts_pinyin(self):
+        """测试就医记录的医院筛选支持拼音首字母"""
+        response = self.client.get('/api/records/medical/', {'hospital': 'xhyy'})
+        self.assertEqual([item['id'] for item in response.data['results']], [self.record.pk])
+
+    def test_rebuild_command(self):
+        """测试重建结果与增量维护一致"""
+        MedicalRecord.objects.create(user=self.other, hospital='协和医院', doctor='张三')
+        MedicationRecord.objects.create(user=self.user, medical_record=self.record, drug_name='阿司匹林',
+                                        dosage='100mg', start_date='2024-01-01')
+        fields = ('user_id', 'field', 'name', 'pinyin', 'initials', 'uses', 'users')
+        expected = sorted(NameSuggestion.objects.values_list(*fields), key=str)
+        call_command('rebuild_name_suggestions', stdout=io.StringIO())
+        self.assertEqual(sorted(NameSuggestion.objects.values_list(*fields), key=str), expected)
+        # 迁移中的快照只使用历史模型，结果同样一致
+        migration = importlib.import_module('records.migrations.0009_name_suggestions')
+        NameSuggestion.objects.all().delete()
+        historical = MigrationExecutor(connection).loader.project_state(('records', '0009_name_suggestions')).apps
+        migration.fill_name_suggestions(historical, connection.schema_editor())
+        self.assertEqual(sorted(NameSuggestion.objects.values_list(*fields), key=str), expected)
+
+
+class DrugAutocompleteTests(TestCase):
+    """
+    药品名称补全测试类
+    验证内存前缀索引与逐一比较的结果一致、增量更新，以及联想接口不查询全站词条
+    """
+    def setUp(self):
+        cache.clear()
+        drug_autocomplete.clear()
+        self.user = User.objects.create_user(username='druguser', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def expected(self, counts, key, limit):
+        matched = [name for name in counts
+                   if any(k.startswith(key) for k in PrefixIndex._compute_keys(name))]
+        return sorted(((name, counts[name]) for name in matched), key=lambda item: (-item[1], item[0]))[:limit]
+
+    def test_lookup_matches_brute_force(self):
+        """测试预先计算的前缀与直接扫描的前缀都按使用次数返回前 K 个"""
+        names = ['阿莫西林胶囊', '阿莫西林颗粒', '阿司匹林肠溶片', '布洛芬缓释胶囊', '奥美拉唑', 'Aspirin', '氨溴索']
+        counts = {name: (i * 7) % 5 + 1 for i, name in enumerate(names)}
+        index = PrefixIndex(counts, top_k=3, scan_limit=2)
+        self.assertTrue(index.top)
+        for query in ('a', 'am', 'amx', 'amoxilin', 'as', 'asp', '阿', '阿莫西林', 'bl', 'x', 'ASP'):
+            key = normalize_query(query)
+            self.assertEqual(index.lookup(key, 3), self.expected(counts, key, 3), query)
+            self.assertEqual(index.lookup(key, 5), self.expected(counts, key, 5), query)
+
+    def test_incremental_update(self):
+        """测试新增名称、次数变化与移除后查询结果随之更新"""
+        counts = {'阿莫西林胶囊': 5, '阿莫西林颗粒': 3, '阿司匹林': 4}
+        index = PrefixIndex(counts, top_k=2, scan_limit=1)
+        index.update('阿莫西林分散片', 9)
+        self.assertEqual(index.lookup('amx', 2), [('阿莫西林分散片', 9), ('阿莫西林胶囊', 5)])
+        index.update('阿莫西林颗粒', 10)
+        self.assertEqual(index.lookup('a', 1), [('阿莫西林颗粒', 10)])
+        index.update('阿莫西林颗粒', None)
+        self.assertEqual(index.lookup('amoxilinke', 2), [])
+        index.update('阿莫西林颗粒', 1)
+        self.assertEqual(index.lookup('amoxilinke', 2), [('阿莫西林颗粒', 1)])
+        self.assertEqual(index.entries[0].count('amxlkl'), 1)
+
+    def test_endpoint_serves_global_drugs_from_memory(self):
+        """测试全站药品联想来自内存索引，提交后增量更新，使用人数不足的名称不出现"""
+        others = [User.objects.create_user(username=f'drugother{i}') for i in range(2)]
+        for other in others:
+            record = MedicalRecord.objects.create(user=other)
+            MedicationRecord.objects.create(user=other, medical_record=record, drug_name='阿莫西林胶囊',
+                                            dosage='0.5g', start_date='2024-01-01')
+        record = MedicalRecord.objects.create(user=others[0])
+        MedicationRecord.objects.create(user=others[0], medical_record=record, drug_name='阿莫西林颗粒',
+                                        dosage='0.5g', start_date='2024-01-01')
+        params = {'field': 'drug', 'q': 'amx'}
+        self.assertEqual(self.client.get('/api/records/suggestions/', params).data['global'],
+                         [{'name': '阿莫西林胶囊', 'uses': 2}])
+        with self.captureOnCommitCallbacks(execute=True):
+            record = MedicalRecord.objects.create(user=others[1])
+            MedicationRecord.objects.create(user=others[1], medical_record=record, drug_name='阿莫西林颗粒',
+                                            dosage='0.5g', start_date='2024-01-01')
+        # 只查询用户自己的词条
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/records/suggestions/', params)
+        self.assertEqual(response.data['global'], [{'name': '阿莫西林胶囊', 'uses': 2}, {'name': '阿莫西林颗粒', 'uses': 2}])
+
+    def test_benchmark_command(self):
+        """测试基准命令校验内存索引与数据库查询结果一致"""
+        output = io.StringIO()
+        call_command('benchmark_autocomplete', names=200, lookups=50, stdout=output)
+        report = json.loads(output.getvalue())
+        self.assertTrue(report['identical'])
+        self.assertFalse(NameSuggestion.objects.exists())
+
+
+class BloodPressureTests(TestCase):
+    """
+    结构化血压测试类
+    验证保存时写入收缩压、舒张压列，迁移回填，以及按列筛选与统计
+    """
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='bpuser', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def create_exam(self, blood_pressure, user=None, exam_date='2024-01-01'):
+        return PhysicalExam.objects.create(user=user or self.user, exam_date=exam_date, height=170, weight=65,
+                                           blood_pressure=blood_pressure, heart_rate=70)
+
+    def test_columns_written_on_save(self):
+        """测试创建与按 update_fields 更新时同步写入两列，格式错误时为空"""
+        exam = self.create_exam(' 150 / 95 ')
+        self.assertEqual((exam.systolic, exam.diastolic), (150, 95))
+        exam.blood_pressure = '118/76'
+        exam.save(update_fields=['blood_pressure'])
+        exam.refresh_from_db()
+        self.assertEqual((exam.systolic, exam.diastolic), (118, 76))
+        self.assertEqual(exam.blood_pressure_level(), 'normal')
+        self.assertEqual(parse_blood_pressure('120-80'), (None, None))
+        self.assertIsNone(self.create_exam('未测').systolic)
+
+    def test_serializer_validation_unchanged(self):
+        """测试序列化器只校验格式与数值范围，与改用统一解析前接受的取值相同"""
+        serializer = PhysicalExamSerializer()
+        for value in ('120/80', ' 150 / 95 ', '90/95'):
+            self.assertEqual(serializer.validate_blood_pressure(value), value)
+        for value in ('120-80', 'a/b', '250/80'):
+            with self.assertRaises(ValidationError):
+                serializer.validate_blood_pressure(value)
+
+    def test_migration_backfill(self):
+        """测试迁移分批解析已有记录的血压字符串"""
+        migration = importlib.import_module('records.migrations.0010_blood_pressure_columns')
+        exams = [self.create_exam(value) for value in ('150/95', '85/55', 'bad')]
+        PhysicalExam.objects.update(systolic=None, diastolic=None)
+        with mock.patch.object(migration, 'BATCH_SIZE', 2):
+            historical = MigrationExecutor(connection).loader.project_state(
+                ('records', '0010_blood_pressure_columns')).apps
+            migration.fill_blood_pressure(historical, connection.schema_editor())
+        values = PhysicalExam.objects.order_by('pk').values_list('systolic', 'diastolic')
+        self.assertEqual(list(values), [(150, 95), (85, 55), (None, None)])
+        self.assertEqual(len(exams), 3)
+
+    def test_filter_and_statistics(self):
+        """测试按血压分级筛选，统计默认只包含当前用户的记录"""
+        for value in ('150/95', '130/95', '85/55', '120/80', '未测'):
+            self.create_exam(value)
+        response = self.client.get('/api/records/physical-exam/', {'bloodPressure': 'high'})
+        self.assertEqual(sorted(item['blood_pressure'] for item in response.data['results']), ['130/95', '150/95'])
+        response = self.client.get('/api/records/physical-exam/', {'bloodPressure': 'low'})
+        self.assertEqual([item['blood_pressure'] for item in response.data['results']], ['85/55'])
+        self.assertEqual(self.client.get('/api/records/physical-exam/', {'bloodPressure': 'x'}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+        self.create_exam('160/100', user=User.objects.create_user(username='bpother'))
+
+        response = self.client.get('/api/records/physical-exam/blood_pressure/')
+        self.assertEqual({key: response.data[key] for key in ('total', 'high', 'low', 'normal', 'max_systolic')},
+                         {'total': 4, 'high': 2, 'low': 1, 'normal': 1, 'max_systolic': 150})
+        self.assertEqual(response.data['avg_diastolic'], 81.2)
+        # 普通用户不能查看全站数据
+        response = self.client.get('/api/records/physical-exam/blood_pressure/', {'scope': 'all'})
+        self.assertEqual(response.data['total'], 4)
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get('/api/records/physical-exam/blood_pressure/', {'scope': 'all'})
+        self.assertEqual(response.data['total'], 5)
+
+    def test_health_trends(self):
+        """测试健康趋势返回结构化的收缩压、舒张压"""
+        self.create_exam('150/95', exam_date='2024-02-01')
+        self.create_exam('120/80', exam_date='2024-01-01')
+        response = self.client.get('/api/records/health-overview/health_trends/')
+        self.assertEqual(response.data['systolic_pressure'], [120, 150])
+        self.assertEqual(response.data['diastolic_pressure'], [80, 95])
+
+
+class ExamFindingsTests(TestCase):
+    """
+    体检异常项目测试类
+    验证保存时按规则表写入位图与严重程度、迁移回填，以及报告与筛选只解码位图
+    """
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='findinguser', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def create_exam(self, user=None, **values):
+        fields = {'exam_date': '2024-01-01', 'height': 170, 'weight': 65, 'blood_pressure': '120/80',
+                  'heart_rate': 70, **values}
+        return PhysicalExam.objects.create(user=user or self.user, **fields)
+
+    def test_rules_evaluated_on_save(self):
+        """测试同组规则只取第一个命中的，严重程度取最高，update_fields 更新后重新判定"""
+        exam = self.create_exam(blood_pressure='150/95', weight=90, cholesterol='5.6')
+        self.assertEqual([rule.code for rule in findings.decode(exam.findings)],
+                         ['blood_pressure_high', 'obesity', 'cholesterol_high'])
+        self.assertEqual(exam.severity, PhysicalExam.Severity.MODERATE)
+        exam.blood_pressure, exam.weight, exam.cholesterol = '85/55', 65, None
+        exam.save(update_fields=['blood_pressure', 'weight', 'cholesterol'])
+        exam.refresh_from_db()
+        self.assertEqual([rule.code for rule in findings.decode(exam.findings)], ['blood_pressure_low'])
+        self.assertEqual(exam.severity, PhysicalExam.Severity.MILD)
+        self.assertEqual(self.create_exam().findings, 0)
+
+    def test_threshold_boundaries(self):
+        """测试恰好等于阈值的指标不算异常，超出一个最小单位即命中"""
+        cases = [
+            ({'blood_glucose': '6.1'}, []), ({'blood_glucose': '6.2'}, ['glucose_high']),
+            ({'blood_glucose': '3.9'}, []), ({'blood_glucose': '3.8'}, ['glucose_low']),
+            ({'cholesterol': '5.2'}, []), ({'cholesterol': '5.3'}, ['cholesterol_high']),
+            ({'blood_pressure': '140/90'}, []), ({'blood_pressure': '141/90'}, ['blood_pressure_high']),
+            ({'blood_pressure': '90/60'}, []), ({'blood_pressure': '90/59'}, ['blood_pressure_low']),
+        ]
+        for values, expected in cases:
+            exam = self.create_exam(**values)
+            exam.refresh_from_db()
+            self.assertEqual([rule.code for rule in findings.decode(exam.findings)], expected, values)
+
+    def test_migration_backfill(self):
+        """测试迁移分批判定已有记录"""
+        migration = importlib.import_module('records.migrations.0011_exam_findings')
+        self.create_exam(blood_glucose='7.0')
+        self.create_exam(weight=75)
+        self.create_exam()
+        PhysicalExam.objects.update(findings=0, severity=0)
+        with mock.patch.object(migration, 'BATCH_SIZE', 2):
+            historical = MigrationExecutor(connection).loader.project_state(('records', '0011_exam_findings')).apps
+            migration.fill_findings(historical, connection.schema_editor())
+        rows = list(PhysicalExam.objects.order_by('pk').values_list('findings', 'severity'))
+        self.assertEqual(rows, [(1 << findings.RULES_BY_CODE['glucose_high'].bit, 2),
+                                (1 << findings.RULES_BY_CODE['overweight'].bit, 1), (0, 0)])
+        # 迁移中的规则快照与当前规则表一致
+        self.assertEqual(migration.RULES, tuple((rule.bit, rule.group, rule.severity, rule.conditions)
+                                                for rule in findings.RULES))
+
+    def test_report_and_filters(self):
+        """测试报告解码位图，按异常项目筛选与统计使用位图列"""
+        exam = self.create_exam(blood_pressure='150/95', blood_glucose='3.5')
+        self.create_exam(cholesterol='6.0')
+        self.create_exam()
+        response = self.client.get(f'/api/records/physical-exam/{exam.pk}/report/')
+        self.assertEqual([(item['name'], item['severity']) for item in response.data['abnormal_items']],
+                         [('高血压', 'moderate'), ('血糖偏低', 'mild')])
+        self.assertIn('150/95', response.data['abnormal_items'][0]['description'])
+
+        response = self.client.get('/api/records/physical-exam/', {'finding': 'cholesterol_high'})
+        self.assertEqual([item['cholesterol'] for item in response.data['results']], ['6.0'])
+        self.assertEqual(self.client.get('/api/records/physical-exam/', {'finding': 'x'}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        # 其他用户的体检只在管理员统计全站时计入
+        self.create_exam(user=User.objects.create_user(username='findingother'), cholesterol='6.0')
+        response = self.client.get('/api/records/physical-exam/statistics/')
+        self.assertEqual((response.data['total'], response.data['abnormal_count'],
+                          response.data['cholesterol_high_count'], response.data['obesity_count']), (3, 2, 1, 0))
+        self.assertEqual(self.client.get('/api/records/physical-exam/statistics/', {'scope': 'all'}).data['total'], 3)
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get('/api/records/physical-exam/statistics/', {'scope': 'all'})
+        self.assertEqual((response.data['total'], response.data['cholesterol_high_count']), (4, 2))
+
+    def test_abnormal_organs(self):
+        """测试异常器官来自最近一次体检的位图"""
+        self.create_exam(exam_date='2024-01-01', blood_pressure='150/95')
+        self.create_exam(exam_date='2024-02-01', blood_pressure='85/55', weight=90)
+        response = self.client.get('/api/records/health-overview/abnormal_organs/')
+        self.assertEqual([(organ['id'], organ['status']) for organ in response.data['abnormal_organs']],
+                         [(2, 'warning'), (3, 'danger')])
+        self.assertIn('31.1', response.data['abnormal_organs'][1]['description'])
@@ -0,0 +1,118 @@
+"""
+健康时间线模块
+四类记录在数据库中以 UNION ALL 合并，按 (日期, 类型, ID) 倒序排序
+每类记录走各自的 (user, 日期) 索引，翻页位置直接下推到各分支的 WHERE 条件
+"""
+
+import datetime
+
+from django.db import connection
+from django.db.models import CharField, F, Q, Value
+from django.db.models.functions import Cast
+from rest_framework.exceptions import ValidationError
+
+from .models import MedicalRecord, MedicationRecord, PhysicalExam, VaccinationRecord
+
+# 类型 -> (模型, 日期字段, 标题字段, 详情字段)
+TIMELINE_SOURCES = {
+    'medical': (MedicalRecord, 'visit_date', 'hospital', 'department'),
+    'medication': (MedicationRecord, 'start_date', 'drug_name', 'dosage'),
+    'physical': (PhysicalExam, 'exam_date', 'blood_pressure', 'heart_rate'),
+    'vaccination': (VaccinationRecord, 'vaccination_date', 'vaccine_type', 'dose_number'),
+}
+
+DEPARTMENTS = dict(MedicalRecord.DEPARTMENT_CHOICES)
+VACCINES = dict(VaccinationRecord.VaccineType.choices)
+
+
+def describe(kind, title, detail):
+    """生成时间线条目的描述，只对当前页的数据执行"""
+    if kind == 'medical':
+        return f'就医于{title}{DEPARTMENTS.get(detail, detail)}'
+    if kind == 'medication':
+        return f'开始服用{title}（{detail}）'
+    if kind == 'vaccination':
+        return f'接种{VACCINES.get(title, title)}第{detail}剂'
+    return f'进行体检，血压{title}，心率{detail}'
+
+
+def parse_position(position):
+    """校验游标中的 [日期, 类型, ID]"""
+    try:
+        day, kind, pk = position
+        day = datetime.date.fromisoformat(day)
+        pk = int(pk)
+    except (TypeError, ValueError):
+        raise ValidationError({'cursor': '无效的分页游标'})
+    if kind not in TIMELINE_SOURCES:
+        raise ValidationError({'cursor': '无效的分页游标'})
+    return day, kind, pk
+
+
+def _after(kind, date_field, position):
+    """本类型中排在游标之后的记录；同一天内类型也参与排序，可以提前比较"""
+    if position is None:
+        return Q()
+    day, cursor_kind, pk = position
+    earlier = Q(**{f'{date_field}__lt': day})
+    same_day = Q(**{date_field: day})
+    if kind < cursor_kind:
+        return earlier | same_day
+    if kind == cursor_kind:
+        return earlier | (same_day & Q(pk__lt=pk))
+    return earlier
+
+
+def timeline_page(user, position=None, size=20, kinds=None):
+    """
+    查询一页时间线，返回(条目列表, 下一页位置)
+    没有更多记录时下一页位置为None
+    """
+    limit = size + 1
+    branches = []
+    for kind in sorted(kinds or TIMELINE_SOURCES):
+        model, date_field, title, detail = TIMELINE_SOURCES[kind]
+        queryset = (
+            model.objects.filter(user=user)
+            .filter(_after(kind, date_field, position))
+            .annotate(
+                happened_on=F(date_field),
+                kind=Value(kind, output_field=CharField()),
+                row_id=F('pk'),
+                title=Cast(title, CharField()),
+                detail=Cast(detail, CharField()),
+            )
+            .values_list('happened_on', 'kind', 'row_id', 'title', 'detail')
+        )
+        if connection.features.supports_slicing_ordering_in_compound:
+            # 各分支先按索引取够一页，合并时最多比较 4 * limit 行
+            queryset = queryset.order_by('-happened_on', '-row_id')[:limit]
+        else:
+            # SQLite 不支持分支内排序，由外层 ORDER BY ... LIMIT 对有序分支做归并
+            queryset = queryset.order_by()
+        branches.append(queryset)
+    union = branches[0].union(*branches[1:], all=True) if len(branches) > 1 else branches[0]
+    rows = list(union.order_by('-happened_on', '-kind', '-row_id')[:limit])
+
+    items = [
+        {'type': kind, 'id': pk, 'date': day, 'description': describe(kind, title, detail)}
+        for day, kind, pk, title, detail in rows[:size]
+    ]
+    next_position = None
+    if len(rows) > size:
+        last = items[-1]
+        next_position = [last['date'].isoformat(), last['type'], last['id']]
+    return items, next_position
+
+
+def recent_records(user, size=5):
+    """各类记录最近的 size 条，条目格式与时间线相同；每类一次按 (user, 日期) 索引的查询"""
+    recent = {}
+    for kind, (model, date_field, title, detail) in TIMELINE_SOURCES.items():
+        rows = (model.objects.filter(user=user).order_by(f'-{date_field}', '-pk')
+                .values_list('pk', date_field, title, detail)[:size])
+        recent[kind] = [
+            {'type': kind, 'id': pk, 'date': day, 'description': describe(kind, title_value, detail_value)}
+            for pk, day, title_value, detail_value in rows
+        ]
+    return recent
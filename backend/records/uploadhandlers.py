@@ -0,0 +1,156 @@
+"""
+上传处理器
+在请求体到达时逐块校验大小、计算哈希并加密，上传文件的明文从不整体驻留内存
+"""
+
+import hashlib
+import tempfile
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import (
+    FileUploadHandler,
+    MemoryFileUploadHandler,
+    StopFutureHandlers,
+    TemporaryFileUploadHandler,
+)
+from django.http.multipartparser import MultiPartParserError
+
+DEFAULT_MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+
+
+class EncryptedUploadedFile(UploadedFile):
+    """
+    已加密的上传文件
+    file 中保存的是密文，size 和 sha256 对应明文
+    能识别该密钥ID的加密存储会直接保存该密文，不再重复加密
+    """
+
+    def __init__(self, name, content_type, charset, content_type_extra, key_id):
+        file = tempfile.NamedTemporaryFile(
+            suffix='.upload.encrypted',
+            dir=settings.FILE_UPLOAD_TEMP_DIR,
+        )
+        super().__init__(file, name, content_type, 0, charset, content_type_extra)
+        self.key_id = key_id
+        self.sha256 = None
+        self.encryption_stats = None
+
+    def temporary_file_path(self):
+        """返回密文临时文件路径"""
+        return self.file.name
+
+    def close(self):
+        try:
+            return self.file.close()
+        except FileNotFoundError:
+            # 临时文件已被存储层移动到最终位置
+            pass
+
+    @classmethod
+    def encrypt(cls, storage, content, cipher=None):
+        """将任意Django文件对象逐块加密为 EncryptedUploadedFile，默认使用存储的主密钥"""
+        cipher = cipher or storage.cipher
+        encrypted = cls(content.name, None, None, None, cipher.key_id)
+        writer = storage.open_writer(encrypted.file, cipher)
+        for chunk in content.chunks():
+            writer.write(chunk)
+        encrypted.finish(writer)
+        return encrypted
+
+    def finish(self, writer):
+        """结束写入并记录明文大小、摘要及压缩加密统计"""
+        writer.close()
+        self.file.flush()
+        self.file.seek(0)
+        self.size = writer.size
+        self.sha256 = writer.sha256.hexdigest()
+        self.encryption_stats = writer.stats()
+
+
+class EncryptingUploadHandler(FileUploadHandler):
+    """
+    流式加密上传处理器
+    每收到一个数据块就立即加密写入临时文件，加密与网络传输重叠进行
+    文件使用当前登录用户的数据密钥加密
+    """
+
+    def __init__(self, request=None, storage=None, field_names=None, max_size=None):
+        super().__init__(request)
+        self.storage = storage
+        self.field_names = set(field_names or ())
+        self.max_size = max_size or getattr(settings, 'ENCRYPTED_UPLOAD_MAX_SIZE', DEFAULT_MAX_UPLOAD_SIZE)
+        self.active = False
+        self.writer = None
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        self.active = not self.field_names or field_name in self.field_names
+        if not self.active:
+            return
+        if self.content_length and self.content_length > self.max_size:
+            raise MultiPartParserError(self._size_error())
+        user = getattr(self.request, 'user', None)
+        cipher = self.storage.keyring.cipher_for_user(user.pk if user is not None and user.is_authenticated else None)
+        self.file = EncryptedUploadedFile(
+            self.file_name,
+            self.content_type,
+            self.charset,
+            self.content_type_extra,
+            cipher.key_id,
+        )
+        self.writer = self.storage.open_writer(self.file.file, cipher)
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.active:
+            return raw_data
+        if self.writer.size + len(raw_data) > self.max_size:
+            self.upload_interrupted()
+            raise MultiPartParserError(self._size_error())
+        self.writer.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if not self.active:
+            return None
+        self.active = False
+        self.file.finish(self.writer)
+        return self.file
+
+    def upload_interrupted(self):
+        if self.active and self.file is not None:
+            self.active = False
+            self.file.close()
+
+    def _size_error(self):
+        return f"文件大小不能超过{self.max_size // (1024 * 1024)}MB"
+
+
+class DigestMixin:
+    """在接收数据块的同时计算SHA-256摘要，结果记录在上传文件的 sha256 属性上"""
+
+    def new_file(self, *args, **kwargs):
+        # 父类激活时会抛出 StopFutureHandlers，需先初始化摘要
+        self.digest = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        remaining = super().receive_data_chunk(raw_data, start)
+        if remaining is None:
+            self.digest.update(raw_data)
+        return remaining
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.sha256 = self.digest.hexdigest()
+        return file
+
+
+class DigestMemoryFileUploadHandler(DigestMixin, MemoryFileUploadHandler):
+    """计算摘要的内存上传处理器"""
+
+
+class DigestTemporaryFileUploadHandler(DigestMixin, TemporaryFileUploadHandler):
+    """计算摘要的临时文件上传处理器"""
@@ -9,7 +9,10 @@ from .views import (
     MedicalAttachmentViewSet,
     RecordListView,
     RecordCreateView,
-    HealthOverviewAPI
+    HealthOverviewAPI,
+    RecordSearchAPI,
+    NameSuggestionAPI,
+    EncryptedFileAPI,
 )
 
 router = DefaultRouter()
@@ -19,6 +22,8 @@ router.register(r'vaccination', VaccinationRecordViewSet)
 router.register(r'physical-exam', PhysicalExamViewSet)
 router.register(r'attachments', MedicalAttachmentViewSet)
 router.register(r'health-overview', HealthOverviewAPI, basename='health-overview')
+router.register(r'search', RecordSearchAPI, basename='search')
+router.register(r'suggestions', NameSuggestionAPI, basename='suggestions')
 
 app_name = 'records'
 
@@ -29,4 +34,6 @@ urlpatterns = [
     path('create/', RecordCreateView.as_view(), name='record_create'),
     # 添加健康概览特定接口的直接访问路径
     path('abnormal-organs/', HealthOverviewAPI.as_view({'get': 'abnormal_organs'}), name='abnormal-organs'),
+    # 加密存储的文件地址
+    path('files/<path:name>', EncryptedFileAPI.as_view(), name='encrypted-file'),
 ]
@@ -2,10 +2,24 @@ from rest_framework import viewsets, mixins, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
 from rest_framework.exceptions import ValidationError
-from django.core.files.storage import default_storage
+from rest_framework.utils.urls import replace_query_param
 from django.views.generic import ListView, CreateView
-from .models import MedicalRecord, MedicationRecord, VaccinationRecord, PhysicalExam, MedicalAttachment
+from .models import (
+    AttachmentBlob,
+    HealthSummary,
+    MedicalRecord,
+    MedicationRecord,
+    VaccinationRecord,
+    PhysicalExam,
+    MedicalAttachment,
+    NameSuggestion,
+    blood_pressure_filter,
+    parse_blood_pressure,
+)
 from .serializers import (
     MedicalRecordSerializer,
     MedicationRecordSerializer,
@@ -14,9 +28,24 @@ from .serializers import (
     MedicalAttachmentSerializer
 )
 from .permissions import IsOwnerOrStaff
+from users.serializers import UserProfileSerializer
+from .compiled import CompiledListMixin
+from .conditional import ConditionalGetMixin
+from .prefetch import PrefetchPlannerMixin
+from .responsecache import cached_response
+from .pagination import KeysetPagination, decode_cursor, encode_cursor, get_page_size
+from .timeline import TIMELINE_SOURCES, parse_position, recent_records, timeline_page
+from . import findings, search, suggestions
+from .uploadhandlers import (
+    DigestMemoryFileUploadHandler,
+    DigestTemporaryFileUploadHandler,
+    EncryptingUploadHandler,
+)
+from .downloads import PassthroughRenderer, ranged_file_response, report_file_response
 from rest_framework.parsers import MultiPartParser, FormParser
-from django.db.models import Q, Count
-from django.shortcuts import render
+from django.db.models import Avg, Count, Max, Min, Q
+from django.http import Http404
+from django.shortcuts import get_object_or_404, render
 from django.utils import timezone
 from datetime import date
 
@@ -27,14 +56,22 @@ def calculate_age(birth_date):
     today = date.today()
     return today.year - birth_date.year - ((today.month, today.day) < (birth_date.month, birth_date.day))
 
-class BaseRecordViewSet(viewsets.ModelViewSet):
+class BaseRecordViewSet(ConditionalGetMixin, CompiledListMixin, PrefetchPlannerMixin, viewsets.ModelViewSet):
     """所有记录视图集的基类"""
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    etag_actions = ('list', 'retrieve')
 
     def get_queryset(self):
         """只返回当前用户的记录"""
         return self.queryset.filter(user=self.request.user)
 
+    def get_etag_extra(self, request):
+        """可展开的用户档案即当前用户，档案修改后ETag随之变化"""
+        if 'user' in getattr(self.serializer_class.Meta, 'expandable_fields', ()):
+            return [UserProfileSerializer(request.user).data]
+        return []
+
     def perform_create(self, serializer):
         """创建记录时自动关联当前用户"""
         serializer.save(user=self.request.user)
@@ -43,10 +80,13 @@ class MedicalRecordViewSet(BaseRecordViewSet):
     """就医记录视图集"""
     queryset = MedicalRecord.objects.all()
     serializer_class = MedicalRecordSerializer
+    ordering = ('-visit_date', '-id')
+    query_budgets = {'list': 4, 'retrieve': 4, 'statistics': 3}
+    etag_actions = ('list', 'retrieve', 'statistics')
 
     def get_queryset(self):
         """获取当前用户的就医记录"""
-        queryset = self.queryset
+        queryset = super().get_queryset()
         
         # 筛选条件
         hospital = self.request.query_params.get('hospital', None)
@@ -55,7 +95,10 @@ class MedicalRecordViewSet(BaseRecordViewSet):
         end_date = self.request.query_params.get('endDate', None)
 
         if hospital:
-            queryset = queryset.filter(hospital__icontains=hospital)
+            # 拼音或首字母（如 xhyy）通过联想词条匹配用户用过的医院名称
+            names = suggestions.matching(
+                NameSuggestion.objects.filter(user=self.request.user, field=NameSuggestion.Field.HOSPITAL), hospital)
+            queryset = queryset.filter(Q(hospital__icontains=hospital) | Q(hospital__in=names.values('name')))
         if department:
             queryset = queryset.filter(department=department)
         if start_date:
@@ -65,6 +108,12 @@ class MedicalRecordViewSet(BaseRecordViewSet):
 
         return queryset.order_by('-visit_date')
 
+    def get_etag_sources(self):
+        """列表可展开附件，附件的增删改同样改变ETag"""
+        queryset = self.get_queryset()
+        attachments = MedicalAttachment.objects.filter(record__in=queryset.values('pk'))
+        return [(queryset, 'updated_at'), (attachments, 'updated_at')]
+
     @action(detail=False, methods=['get'])
     def statistics(self, request):
         """获取就医记录统计信息"""
@@ -79,13 +128,16 @@ class MedicationRecordViewSet(BaseRecordViewSet):
     """用药记录视图集"""
     queryset = MedicationRecord.objects.all()
     serializer_class = MedicationRecordSerializer
+    ordering = ('-start_date', '-id')
+    query_budgets = {'list': 3, 'retrieve': 3, 'statistics': 3}
+    etag_actions = ('list', 'retrieve', 'statistics')
 
     @action(detail=False, methods=['get'])
     def statistics(self, request):
         """获取用药记录统计信息"""
         stats = self.get_queryset().aggregate(
             total=Count('id'),
-            active_medications=Count('id', filter=Q(is_long_term=True))
+            active_medications=Count('id', filter=Q(end_date__isnull=True) | Q(end_date__gte=timezone.localdate()))
         )
         return Response(stats)
 
@@ -93,13 +145,16 @@ class VaccinationRecordViewSet(BaseRecordViewSet):
     """疫苗接种记录视图集"""
     queryset = VaccinationRecord.objects.all()
     serializer_class = VaccinationRecordSerializer
+    ordering = ('-vaccination_date', '-id')
+    query_budgets = {'list': 3, 'retrieve': 3, 'statistics': 3}
+    etag_actions = ('list', 'retrieve', 'statistics')
 
     @action(detail=False, methods=['get'])
     def statistics(self, request):
         """获取疫苗接种统计信息"""
         stats = self.get_queryset().aggregate(
             total=Count('id'),
-            pending_next_dose=Count('id', filter=Q(next_dose_date__isnull=False))
+            pending_next_dose=Count('id', filter=Q(next_due_date__isnull=False))
         )
         return Response(stats)
 
@@ -107,37 +162,98 @@ class PhysicalExamViewSet(BaseRecordViewSet):
     """体检记录视图集"""
     queryset = PhysicalExam.objects.all()
     serializer_class = PhysicalExamSerializer
+    ordering = ('-exam_date', '-id')
+    query_budgets = {'list': 3, 'retrieve': 3, 'latest': 4, 'report': 2, 'blood_pressure': 3, 'statistics': 3}
+    etag_actions = ('list', 'retrieve', 'latest')
     parser_classes = (MultiPartParser, FormParser)
 
+    def initialize_request(self, request, *args, **kwargs):
+        """在解析请求体之前注册流式加密上传处理器"""
+        report_field = PhysicalExam._meta.get_field('report_pdf')
+        request.upload_handlers.insert(0, EncryptingUploadHandler(
+            request,
+            storage=report_field.storage,
+            field_names=[report_field.name],
+        ))
+        return super().initialize_request(request, *args, **kwargs)
+
     def get_queryset(self):
-        """获取用户的体检报告"""
-        return self.queryset
+        """获取当前用户的体检报告"""
+        queryset = super().get_queryset()
+
+        # 按血压分级筛选（high/low/normal），使用收缩压、舒张压列上的索引
+        level = self.request.query_params.get('bloodPressure', None)
+        if level:
+            if level not in ('high', 'low', 'normal'):
+                raise ValidationError({'bloodPressure': '只支持 high、low、normal'})
+            queryset = queryset.filter(blood_pressure_filter(level))
+        # 按异常项目筛选，如 finding=cholesterol_high
+        finding = self.request.query_params.get('finding', None)
+        if finding:
+            if finding not in findings.RULES_BY_CODE:
+                raise ValidationError({'finding': f"只支持 {'、'.join(findings.RULES_BY_CODE)}"})
+            queryset = queryset.filter(findings.finding_filter(finding))
+        return queryset
+
+    def statistics_queryset(self, request):
+        """统计范围：默认为当前用户，管理员可用 scope=all 统计全站"""
+        if request.query_params.get('scope') == 'all' and request.user.is_staff:
+            return self.queryset
+        return self.get_queryset()
 
     def perform_create(self, serializer):
         """关联当前用户并验证数据"""
         # 手动验证血压格式（补充序列化器验证）
         bp = serializer.validated_data.get('blood_pressure')
-        if bp and len(bp.split('/')) != 2:
+        if bp and parse_blood_pressure(bp)[0] is None:
             raise ValidationError({'blood_pressure': '血压格式错误'})
         serializer.save(user=self.request.user)
 
     @action(detail=False, methods=['get'])
     def statistics(self, request):
-        """获取体检记录统计信息"""
-        stats = self.get_queryset().aggregate(
+        """获取体检记录统计信息，管理员可用 scope=all 统计全站"""
+        stats = self.statistics_queryset(request).aggregate(
             total=Count('id'),
-            abnormal_count=Count('id', filter=Q(result='abnormal'))
+            abnormal_count=Count('id', filter=Q(findings__gt=0)),
+            **{f'{rule.code}_count': Count('id', filter=findings.finding_filter(rule.code)) for rule in findings.RULES}
         )
         return Response(stats)
 
+    @action(detail=False, methods=['get'])
+    def blood_pressure(self, request):
+        """
+        血压统计：各分级的体检次数与收缩压、舒张压的均值和极值
+        管理员可用 scope=all 查看全站数据
+        """
+        stats = self.statistics_queryset(request).filter(systolic__isnull=False, diastolic__isnull=False).aggregate(
+            total=Count('id'),
+            high=Count('id', filter=blood_pressure_filter('high')),
+            low=Count('id', filter=blood_pressure_filter('low')),
+            normal=Count('id', filter=blood_pressure_filter('normal')),
+            avg_systolic=Avg('systolic'),
+            avg_diastolic=Avg('diastolic'),
+            max_systolic=Max('systolic'),
+            max_diastolic=Max('diastolic'),
+            min_systolic=Min('systolic'),
+            min_diastolic=Min('diastolic'),
+        )
+        for name in ('avg_systolic', 'avg_diastolic'):
+            if stats[name] is not None:
+                stats[name] = round(stats[name], 1)
+        return Response(stats)
+
     @action(detail=False, methods=['get'])
     def latest(self, request):
-        """获取最近一次体检报告"""
-        exam = self.get_queryset().last()
+        """获取最近一次体检报告（由健康汇总记录，无需扫描体检表）"""
+        summary = HealthSummary.current(request.user.pk)
+        exam = self.filter_queryset(self.get_queryset()).filter(pk=summary.latest_exam_id).first() if summary.latest_exam_id else None
+        if exam is None:
+            return Response({'detail': '暂无体检报告'}, status=status.HTTP_404_NOT_FOUND)
         serializer = self.get_serializer(exam)
         return Response(serializer.data)
         
     @action(detail=True, methods=['get'])
+    @cached_response
     def report(self, request, pk=None):
         """获取体检报告详情，包含异常项目标记"""
         exam = self.get_object()
@@ -153,104 +269,66 @@ class PhysicalExamViewSet(BaseRecordViewSet):
             'exam_id': f"{exam.id:012d}"  # 格式化为12位数字
         }
         
-        # 模拟异常项目数据
-        # 实际项目中应该从体检报告解析或诊断系统获取
-        blood_pressure = exam.blood_pressure.split('/')
-        systolic = int(blood_pressure[0]) if len(blood_pressure) > 0 else 0
-        diastolic = int(blood_pressure[1]) if len(blood_pressure) > 1 else 0
-        
-        abnormal_items = []
-        
-        # 血压判断
-        if systolic > 140 or diastolic > 90:
-            abnormal_items.append({
-                'name': '高血压',
-                'severity': 'moderate',
-                'description': f'血压值偏高({exam.blood_pressure} mmHg)，正常范围应小于140/90 mmHg。',
-                'suggestion': '控制饮食，减少盐分摄入，适当运动，心内科随诊。',
-                'position': {'top': 35, 'left': 58}
-            })
-        elif systolic < 90 or diastolic < 60:
-            abnormal_items.append({
-                'name': '低血压',
-                'severity': 'mild',
-                'description': f'血压值偏低({exam.blood_pressure} mmHg)，正常范围应大于90/60 mmHg。',
-                'suggestion': '多补充水分，适量增加盐分摄入，必要时就医。',
-                'position': {'top': 35, 'left': 58}
-            })
-            
-        # BMI判断
-        bmi = exam.calculate_bmi()
-        if bmi and bmi > 28:
-            abnormal_items.append({
-                'name': '肥胖',
-                'severity': 'moderate',
-                'description': f'体重指数(BMI)为{bmi}，属于肥胖。',
-                'suggestion': '控制饮食，增加运动量，营养科随诊。',
-                'position': {'top': 45, 'left': 50}
-            })
-        elif bmi and bmi > 24:
-            abnormal_items.append({
-                'name': '超重',
-                'severity': 'mild',
-                'description': f'体重指数(BMI)为{bmi}，属于超重。',
-                'suggestion': '注意饮食健康，适量运动。',
-                'position': {'top': 45, 'left': 50}
-            })
-        
-        # 血糖判断
-        if hasattr(exam, 'blood_glucose') and exam.blood_glucose:
-            if exam.blood_glucose > 6.1:
-                abnormal_items.append({
-                    'name': '血糖偏高',
-                    'severity': 'moderate',
-                    'description': f'空腹血糖值为{exam.blood_glucose} mmol/L，正常范围为3.9-6.1 mmol/L。',
-                    'suggestion': '控制碳水化合物摄入，内分泌科随诊。',
-                    'position': {'top': 55, 'left': 45}
-                })
-            elif exam.blood_glucose < 3.9:
-                abnormal_items.append({
-                    'name': '血糖偏低',
-                    'severity': 'mild',
-                    'description': f'空腹血糖值为{exam.blood_glucose} mmol/L，正常范围为3.9-6.1 mmol/L。',
-                    'suggestion': '定时进食，避免空腹。',
-                    'position': {'top': 55, 'left': 45}
-                })
-        
-        # 胆固醇判断
-        if hasattr(exam, 'cholesterol') and exam.cholesterol:
-            if exam.cholesterol > 5.2:
-                abnormal_items.append({
-                    'name': '胆固醇偏高',
-                    'severity': 'moderate',
-                    'description': f'总胆固醇值为{exam.cholesterol} mmol/L，正常范围应小于5.2 mmol/L。',
-                    'suggestion': '控制油脂摄入，多食用富含膳食纤维的食物，心内科随诊。',
-                    'position': {'top': 45, 'left': 68}
-                })
+        # 异常项目在保存时已按规则判定，这里只解码位图
+        abnormal_items = exam.abnormal_items()
         
         # 合并结果
         result = {**exam_data, **user_data, 'abnormal_items': abnormal_items}
         return Response(result)
 
+    @action(detail=True, methods=['get'], renderer_classes=[PassthroughRenderer])
+    def download(self, request, pk=None):
+        """下载体检报告PDF，支持Range分段请求"""
+        exam = self.get_object()
+        if not exam.report_pdf:
+            return Response({'error': '该体检记录没有报告文件'}, status=status.HTTP_404_NOT_FOUND)
+        return report_file_response(request, exam.report_pdf)
+
 class MedicalAttachmentViewSet(BaseRecordViewSet):
     queryset = MedicalAttachment.objects.all()
     serializer_class = MedicalAttachmentSerializer
+    ordering = ('-upload_time', '-id')
+    query_budgets = {'list': 3, 'retrieve': 3}
     parser_classes = (MultiPartParser, FormParser)
 
+    def initialize_request(self, request, *args, **kwargs):
+        """使用在接收时计算摘要的上传处理器"""
+        request.upload_handlers = [
+            DigestMemoryFileUploadHandler(request),
+            DigestTemporaryFileUploadHandler(request),
+        ]
+        return super().initialize_request(request, *args, **kwargs)
+
+    def get_queryset(self):
+        """附件通过所属就医记录归属用户"""
+        return self.queryset.filter(record__user=self.request.user)
+
+    @action(detail=True, methods=['get'], renderer_classes=[PassthroughRenderer])
+    def download(self, request, pk=None):
+        """下载附件，支持Range分段请求"""
+        attachment = self.get_object()
+        return ranged_file_response(
+            request,
+            attachment.file.storage.open(attachment.file.name),
+            attachment.name,
+        )
+
     @action(detail=True, methods=['post'])
     def upload_attachment(self, request, pk=None):
-        """上传附件"""
-        record = self.get_object()
+        """上传附件，相同内容只存储一份"""
+        record = get_object_or_404(MedicalRecord, pk=pk, user=request.user)
         file_obj = request.FILES.get('file')
         
         if not file_obj:
             return Response({'error': '没有文件上传'}, status=status.HTTP_400_BAD_REQUEST)
 
+        blob = AttachmentBlob.acquire(file_obj, getattr(file_obj, 'sha256', None))
         attachment = MedicalAttachment.objects.create(
             record=record,
             name=file_obj.name,
-            file=file_obj,
-            size=file_obj.size
+            blob=blob,
+            file=blob.file.name,
+            size=blob.size
         )
 
         serializer = MedicalAttachmentSerializer(attachment)
@@ -258,7 +336,7 @@ class MedicalAttachmentViewSet(BaseRecordViewSet):
 
     @action(detail=True, methods=['delete'])
     def delete_attachment(self, request, pk=None):
-        """删除附件"""
+        """删除附件，仅释放对附件内容的一次引用"""
         attachment_id = request.query_params.get('attachment_id')
         if not attachment_id:
             return Response({'error': '未指定附件ID'}, status=status.HTTP_400_BAD_REQUEST)
@@ -269,52 +347,65 @@ class MedicalAttachmentViewSet(BaseRecordViewSet):
                 record_id=pk,
                 record__user=request.user
             )
-            # 删除文件
-            if default_storage.exists(attachment.file.name):
-                default_storage.delete(attachment.file.name)
+            # 附件内容由信号处理器按引用计数释放
             attachment.delete()
             return Response(status=status.HTTP_204_NO_CONTENT)
         except MedicalAttachment.DoesNotExist:
             return Response({'error': '附件不存在'}, status=status.HTTP_404_NOT_FOUND)
 
-class HealthOverviewAPI(viewsets.ViewSet):
+class EncryptedFileAPI(APIView):
+    """
+    按存储文件名下载加密文件，加密存储的 url() 指向这里
+    只允许文件所属用户或工作人员访问；另接受会话认证，供管理后台的文件控件使用
+    """
+    authentication_classes = [*api_settings.DEFAULT_AUTHENTICATION_CLASSES, SessionAuthentication]
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [PassthroughRenderer]
+    query_budgets = {'get': 4}
+
+    def get(self, request, name):
+        # url() 移除了加密文件扩展名
+        exams = PhysicalExam.objects.filter(report_pdf__in=(name, f'{name}.encrypted'))
+        if not request.user.is_staff:
+            exams = exams.filter(user=request.user)
+        exam = exams.only('pk', 'report_pdf').first()
+        if exam is None:
+            raise Http404
+        return report_file_response(request, exam.report_pdf)
+
+class HealthOverviewAPI(ConditionalGetMixin, viewsets.ViewSet):
     """健康总览API"""
     permission_classes = [IsAuthenticated]
+    # 汇总不存在时首次访问需要从明细表重建，预算按重建计算，另有每类一次的最近记录查询
+    query_budgets = {'statistics': 15, 'timeline': 3}
+    # 时间线类型 -> 总览中的分组
+    SUMMARY_GROUPS = {
+        'medical': 'medical_records',
+        'medication': 'medication_records',
+        'vaccination': 'vaccination_records',
+        'physical': 'physical_exams',
+    }
+    etag_actions = ('statistics', 'timeline')
+
+    def get_etag_sources(self):
+        """总览由四类记录汇总而来"""
+        user = self.request.user
+        return [
+            (model.objects.filter(user=user), 'updated_at')
+            for model, *_ in TIMELINE_SOURCES.values()
+        ]
 
     @action(detail=False, methods=['get'])
+    @cached_response
     def statistics(self, request):
-        """获取健康记录总览统计"""
-        user = request.user
-        medical_records = MedicalRecord.objects.filter(user=user)
-        medication_records = MedicationRecord.objects.filter(user=user)
-        vaccination_records = VaccinationRecord.objects.filter(user=user)
-        physical_exams = PhysicalExam.objects.filter(user=user)
-
-        stats = {
-            'medical_records': {
-                'total': medical_records.count(),
-                'recent': medical_records.order_by('-visit_date')[:5],
-                'by_department': medical_records.values('department').annotate(count=Count('id'))
-            },
-            'medication_records': {
-                'total': medication_records.count(),
-                'active': medication_records.filter(is_long_term=True).count(),
-                'recent': medication_records.order_by('-start_date')[:5]
-            },
-            'vaccination_records': {
-                'total': vaccination_records.count(),
-                'pending_next_dose': vaccination_records.filter(next_dose_date__isnull=False).count(),
-                'recent': vaccination_records.order_by('-vaccination_date')[:5]
-            },
-            'physical_exams': {
-                'total': physical_exams.count(),
-                'abnormal': physical_exams.filter(result='abnormal').count(),
-                'recent': physical_exams.order_by('-exam_date')[:5]
-            }
-        }
+        """获取健康记录总览统计：计数直接读取增量维护的健康汇总，另附各类最近5条记录"""
+        stats = HealthSummary.current(request.user.pk).as_dict()
+        for kind, records in recent_records(request.user).items():
+            stats[self.SUMMARY_GROUPS[kind]]['recent'] = records
         return Response(stats)
 
     @action(detail=False, methods=['get'])
+    @cached_response
     def abnormal_organs(self, request):
         """获取异常器官数据"""
         user = request.user
@@ -324,48 +415,9 @@ class HealthOverviewAPI(viewsets.ViewSet):
         
         abnormal_organs = []
         
-        if latest_exam and latest_exam.result == 'abnormal':
-            # 从体检报告数据提取异常信息
-            # 实际应用中，这些数据可能来自医疗记录解析或诊断系统
-            # 这里使用样例数据模拟
-            
-            # 通过血压判断心脏状况
-            if latest_exam.blood_pressure:
-                try:
-                    systolic, diastolic = map(int, latest_exam.blood_pressure.split('/'))
-                    if systolic > 140 or diastolic > 90:
-                        abnormal_organs.append({
-                            'id': 1,
-                            'name': '心脏',
-                            'status': 'danger',
-                            'description': f'血压偏高({latest_exam.blood_pressure}mmHg)，可能存在高血压风险，建议进一步检查。'
-                        })
-                    elif systolic < 90 or diastolic < 60:
-                        abnormal_organs.append({
-                            'id': 2,
-                            'name': '心脏',
-                            'status': 'warning',
-                            'description': f'血压偏低({latest_exam.blood_pressure}mmHg)，注意休息，适量补充水分和盐分。'
-                        })
-                except (ValueError, IndexError):
-                    pass
-            
-            # 通过BMI判断肥胖
-            bmi = latest_exam.calculate_bmi()
-            if bmi and bmi > 28:
-                abnormal_organs.append({
-                    'id': 3,
-                    'name': '肥胖',
-                    'status': 'danger',
-                    'description': f'体重指数(BMI)为{bmi:.1f}，属于肥胖，建议控制饮食，增加运动。'
-                })
-            elif bmi and bmi > 24:
-                abnormal_organs.append({
-                    'id': 4,
-                    'name': '超重',
-                    'status': 'warning',
-                    'description': f'体重指数(BMI)为{bmi:.1f}，属于超重，建议适当控制饮食。'
-                })
+        if latest_exam and latest_exam.findings:
+            # 血压、BMI等异常在保存时已按规则判定，解码位图得到对应器官
+            abnormal_organs = findings.abnormal_organs(latest_exam.findings, latest_exam.metrics())
             
             # 模拟更多异常器官检测
             # 肝脏、肺部等其他器官的异常判断可以根据体检报告中的具体指标添加
@@ -419,10 +471,13 @@ class HealthOverviewAPI(viewsets.ViewSet):
         return Response({'abnormal_organs': abnormal_organs})
 
     @action(detail=False, methods=['get'])
+    @cached_response
     def health_trends(self, request):
         """获取健康趋势数据"""
         user = request.user
-        physical_exams = PhysicalExam.objects.filter(user=user).order_by('exam_date')
+        # 只读取需要的列，血压直接取结构化的收缩压、舒张压列
+        physical_exams = PhysicalExam.objects.filter(user=user).order_by('exam_date').values_list(
+            'exam_date', 'weight', 'systolic', 'diastolic', 'heart_rate')
         
         trends = {
             'dates': [],
@@ -432,65 +487,85 @@ class HealthOverviewAPI(viewsets.ViewSet):
             'heart_rate': []
         }
         
-        for exam in physical_exams:
-            trends['dates'].append(exam.exam_date)
-            trends['weight'].append(exam.weight)
-            trends['systolic_pressure'].append(exam.systolic_pressure)
-            trends['diastolic_pressure'].append(exam.diastolic_pressure)
-            trends['heart_rate'].append(exam.heart_rate)
+        for exam_date, weight, systolic, diastolic, heart_rate in physical_exams:
+            trends['dates'].append(exam_date)
+            trends['weight'].append(weight)
+            trends['systolic_pressure'].append(systolic)
+            trends['diastolic_pressure'].append(diastolic)
+            trends['heart_rate'].append(heart_rate)
         
         return Response(trends)
 
     @action(detail=False, methods=['get'])
-    def recent_activities(self, request):
-        """获取最近的健康活动"""
-        user = request.user
-        
-        # 获取所有类型的最近记录
-        medical = MedicalRecord.objects.filter(user=user).order_by('-visit_date')[:5]
-        medication = MedicationRecord.objects.filter(user=user).order_by('-start_date')[:5]
-        vaccination = VaccinationRecord.objects.filter(user=user).order_by('-vaccination_date')[:5]
-        physical = PhysicalExam.objects.filter(user=user).order_by('-exam_date')[:5]
-        
-        activities = []
-        
-        # 合并并排序所有活动
-        for record in medical:
-            activities.append({
-                'type': 'medical',
-                'date': record.visit_date,
-                'description': f'就医于{record.hospital}{record.department}',
-                'id': record.id
-            })
-            
-        for record in medication:
-            activities.append({
-                'type': 'medication',
-                'date': record.start_date,
-                'description': f'开始服用{record.medication_name}',
-                'id': record.id
-            })
-            
-        for record in vaccination:
-            activities.append({
-                'type': 'vaccination',
-                'date': record.vaccination_date,
-                'description': f'接种{record.vaccine_name}疫苗',
-                'id': record.id
-            })
-            
-        for record in physical:
-            activities.append({
-                'type': 'physical',
-                'date': record.exam_date,
-                'description': f'在{record.hospital}进行体检',
-                'id': record.id
-            })
-        
-        # 按日期排序，最近的在前
-        activities.sort(key=lambda x: x['date'], reverse=True)
-        
-        return Response(activities[:10])  # 只返回最近的10条活动
+    def timeline(self, request):
+        """
+        健康时间线，四类记录按日期倒序合并
+        使用 cursor 参数翻页，types 参数（逗号分隔）筛选记录类型
+        """
+        cursor = request.query_params.get('cursor')
+        position = parse_position(decode_cursor(cursor)) if cursor else None
+        kinds = None
+        if request.query_params.get('types'):
+            kinds = set(request.query_params['types'].split(','))
+            if kinds - set(TIMELINE_SOURCES):
+                raise ValidationError({'types': f"可选类型：{', '.join(TIMELINE_SOURCES)}"})
+        items, next_position = timeline_page(request.user, position, get_page_size(request), kinds)
+        next_url = None
+        if next_position:
+            next_url = replace_query_param(request.build_absolute_uri(), 'cursor', encode_cursor(next_position))
+        return Response({'next': next_url, 'results': items})
+
+class RecordSearchAPI(viewsets.ViewSet):
+    """全文检索API"""
+    permission_classes = [IsAuthenticated]
+    query_budgets = {'list': 1}
+
+    def list(self, request):
+        """
+        检索当前用户的全部记录，按相关度排序
+        q 为检索词（空格分隔的词同时匹配，词尾 * 为前缀查询），types 筛选记录类型，offset 翻页
+        """
+        query = request.query_params.get('q', '').strip()
+        if not search.parse_query(query):
+            raise ValidationError({'q': '请输入检索词'})
+        kinds = None
+        if request.query_params.get('types'):
+            kinds = set(request.query_params['types'].split(','))
+            if kinds - set(search.KINDS):
+                raise ValidationError({'types': f"可选类型：{', '.join(search.KINDS)}"})
+        try:
+            offset = max(int(request.query_params.get('offset', 0)), 0)
+        except ValueError:
+            raise ValidationError({'offset': '必须是整数'})
+        size = get_page_size(request)
+        items = search.search(request.user.pk, query, kinds, size + 1, offset)
+        next_url = None
+        if len(items) > size:
+            next_url = replace_query_param(request.build_absolute_uri(), 'offset', offset + size)
+        return Response({'next': next_url, 'results': items[:size]})
+
+class NameSuggestionAPI(viewsets.ViewSet):
+    """医院、医生、药品名称联想API"""
+    permission_classes = [IsAuthenticated]
+    query_budgets = {'list': 2}
+
+    def list(self, request):
+        """
+        field 为 hospital、doctor 或 drug，q 可以是汉字、全拼或拼音首字母前缀
+        返回用户自己用过的与全站常用的名称，各按使用次数排序
+        """
+        field = request.query_params.get('field')
+        if field not in NameSuggestion.Field.values:
+            raise ValidationError({'field': f"可选类型：{', '.join(NameSuggestion.Field.values)}"})
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            raise ValidationError({'q': '请输入名称'})
+        try:
+            limit = int(request.query_params.get('limit', suggestions.suggestion_setting('LIMIT')))
+        except ValueError:
+            raise ValidationError({'limit': '必须是整数'})
+        limit = max(1, min(limit, suggestions.suggestion_setting('MAX_LIMIT')))
+        return Response(suggestions.suggest(request.user.pk, field, query, limit))
 
 class RecordListView(ListView):
     """展示记录列表的视图"""
@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.utils.translation import gettext_lazy as _
-from .models import CustomUser, FamilyRelationship
+from .models import CustomUser, FamilyRelationship, UserDataKey
 
 @admin.register(CustomUser)
 class CustomUserAdmin(UserAdmin):
@@ -128,3 +128,14 @@ class FamilyRelationshipAdmin(admin.ModelAdmin):
             return
         super().save_model(request, obj, form, change)
 
+
+@admin.register(UserDataKey)
+class UserDataKeyAdmin(admin.ModelAdmin):
+    """用户数据密钥管理（只读，删除即擦除该用户的全部加密文件）"""
+    list_display = ('user', 'key_id', 'master_key_id', 'created_at', 'rewrapped_at')
+    search_fields = ('user__username', 'key_id')
+    readonly_fields = ('user', 'key_id', 'master_key_id', 'created_at', 'rewrapped_at')
+    exclude = ('wrapped_key',)
+
+    def has_add_permission(self, request):
+        return False
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:39
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserDataKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key_id', models.CharField(help_text='写入加密文件头的密钥标识（十六进制）', max_length=32, unique=True, verbose_name='密钥ID')),
+                ('wrapped_key', models.BinaryField(verbose_name='包装后的密钥')),
+                ('master_key_id', models.CharField(db_index=True, help_text='包装该数据密钥所用的主密钥，轮换主密钥时据此找出需要重新包装的记录', max_length=32, verbose_name='主密钥ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('rewrapped_at', models.DateTimeField(blank=True, null=True, verbose_name='最近重新包装时间')),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='data_key', to=settings.AUTH_USER_MODEL, verbose_name='所属用户')),
+            ],
+            options={
+                'verbose_name': '用户数据密钥',
+                'verbose_name_plural': '用户数据密钥',
+            },
+        ),
+    ]
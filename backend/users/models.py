@@ -127,6 +127,51 @@ class CustomUser(AbstractUser):
                 raise ValidationError({'hobbies': _('兴趣爱好不能超过10个')})
 
 
+class UserDataKey(models.Model):
+    """
+    用户数据密钥
+    用户的加密文件使用该密钥加密，密钥本身由主密钥包装后保存
+    删除该记录后用户的全部加密文件立即不可读（密码学擦除）
+    """
+    user = models.OneToOneField(
+        CustomUser,
+        on_delete=models.CASCADE,
+        related_name='data_key',
+        verbose_name=_('所属用户')
+    )
+    key_id = models.CharField(
+        verbose_name=_('密钥ID'),
+        max_length=32,
+        unique=True,
+        help_text=_('写入加密文件头的密钥标识（十六进制）')
+    )
+    wrapped_key = models.BinaryField(
+        verbose_name=_('包装后的密钥')
+    )
+    master_key_id = models.CharField(
+        verbose_name=_('主密钥ID'),
+        max_length=32,
+        db_index=True,
+        help_text=_('包装该数据密钥所用的主密钥，轮换主密钥时据此找出需要重新包装的记录')
+    )
+    created_at = models.DateTimeField(
+        verbose_name=_('创建时间'),
+        auto_now_add=True
+    )
+    rewrapped_at = models.DateTimeField(
+        verbose_name=_('最近重新包装时间'),
+        null=True,
+        blank=True
+    )
+
+    class Meta:
+        verbose_name = _('用户数据密钥')
+        verbose_name_plural = _('用户数据密钥')
+
+    def __str__(self):
+        return f"{self.user_id}的数据密钥（{self.key_id}）"
+
+
 class FamilyRelationship(models.Model):
     """
     家庭成员关系中间模型